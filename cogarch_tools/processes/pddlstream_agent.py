@@ -459,6 +459,14 @@ class PDDLStreamAgent(MotionAgent):
 
         self.save_commands(join(self.exp_dir, f"commands.pkl"))
 
+        stream_profiler = getattr(self.world, 'stream_profiler', None)
+        if stream_profiler is not None:
+            stream_profiler.dump(self.exp_dir)
+
+        ik_cache = getattr(self.robot, 'ik_cache', None)
+        if ik_cache is not None:
+            print(f'save_stats | {ik_cache}')
+
     def save_agent_state(self):
         """ resume planning """
 
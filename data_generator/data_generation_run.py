@@ -21,6 +21,7 @@ from pybullet_tools.stream_agent import solve_multiple, post_process, pddlstream
     create_cwd_saver
 from pybullet_tools.pr2_primitives import control_commands, apply_commands
 from pybullet_tools.logging_utils import parallel_print, myprint, summarize_facts, print_goal
+from pybullet_tools.grasp_utils import export_grasp_stores
 
 from world_builder.world import State
 from world_builder.actions import apply_commands
@@ -91,6 +92,7 @@ def data_generation_process(config, world_only=False):
 
     print_solution(solution)
     plan, cost, evaluations = solution
+    export_grasp_stores()  ## merge the grasps sampled by this worker into the shared json files
 
     """ ============== save world configuration ==================== """
     tmp_dir = cwd_saver.tmp_cwd
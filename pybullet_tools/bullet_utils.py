@@ -1,7 +1,8 @@
 from __future__ import print_function
 
 import random
-from itertools import product
+from itertools import product, count
+from collections import OrderedDict
 from os.path import isfile, dirname, abspath, join, isdir
 import sys
 
@@ -14,14 +15,14 @@ import os
 import json
 from pybullet_tools.logging_utils import dump_json
 
-from pybullet_tools.utils import unit_pose, get_collision_data, get_links, pairwise_collision, get_link_name, \
+from pybullet_tools.utils import profiled, unit_pose, get_collision_data, get_links, pairwise_collision, get_link_name, \
     is_movable, get_movable_joints, draw_pose, pose_from_pose2d, set_velocity, set_joint_states, get_bodies, \
     flatten, INF, inf_generator, get_time_step, get_all_links, get_visual_data, pose2d_from_pose, multiply, invert, \
     get_sample_fn, pairwise_collisions, sample_placement, aabb_contains_point, point_from_pose, \
     aabb2d_from_aabb, is_center_stable, aabb_contains_aabb, get_pose, get_aabb, GREEN, AABB, remove_body, stable_z, \
     get_joints, set_joint_position, Euler, PI, LockRenderer, HideOutput, load_model, \
     set_camera_pose, sample_aabb, get_min_limit, get_max_limit, get_joint_position, get_joint_name, \
-    get_client, JOINT_TYPES, get_joint_type, get_link_pose, get_closest_points, \
+    get_client, get_body_metadata, JOINT_TYPES, get_joint_type, get_link_pose, get_closest_points, \
     body_collision, is_placed_on_aabb, joint_from_name, body_from_end_effector, flatten_links, get_aabb_volume, \
     get_link_subtree, quat_from_euler, euler_from_quat, create_box, set_pose, Pose, Point, get_camera_matrix, \
     YELLOW, add_line, draw_point, RED, remove_handles, apply_affine, vertices_from_rigid, \
@@ -32,7 +33,7 @@ from pybullet_tools.utils import unit_pose, get_collision_data, get_links, pairw
     get_box_geometry, create_body, get_link_parent, NULL_ID, get_joint_info, get_dynamics_info, \
     clone_collision_shape, clone_visual_shape, get_local_link_pose, get_joint_positions, \
     collision_shape_from_data, visual_shape_from_data, is_unknown_file, create_collision_shape, \
-    aabb_from_extent_center
+    aabb_from_extent_center, get_num_joints, parent_link_from_joint
 
 
 OBJ = '?obj'
@@ -329,6 +330,143 @@ def initialize_collision_logs():
     if isfile(COLLISION_FILE): os.remove(COLLISION_FILE)
 
 
+COLLISION_CACHE_TOKENS = count()  ## distinguishes a body from a later one that reuses its id
+
+
+class CollisionCache(object):
+    """ LRU cache of collision results keyed on the quantized state of the bodies involved,
+        i.e. (body, links, base pose, joint positions) for the body and each of its obstacles,
+        so re-evaluating the same cfree tests during replanning doesn't query pybullet again """
+
+    def __init__(self, max_size=100000, position_resolution=1e-5, orientation_resolution=1e-5):
+        self.max_size = max_size
+        self.position_resolution = position_resolution
+        self.orientation_resolution = orientation_resolution
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def quantize(self, values, resolution):
+        return tuple(int(round(v / resolution)) for v in values)
+
+    def get_body_key(self, body):
+        links = None
+        if isinstance(body, tuple):  ## (body, link) or (body, links)
+            body, links = body[0], str(body[1:])
+        if not isinstance(body, int):
+            body = body.body
+        ## the metadata is cleared by remove_body(), so the entries of a removed body are never hit again
+        token = get_body_metadata(body).setdefault('collision_cache_token', next(COLLISION_CACHE_TOKENS))
+        client = get_client()
+        point, quat = p.getBasePositionAndOrientation(body, physicsClientId=client)
+        if quat[3] < 0:  ## q and -q are the same orientation
+            quat = [-v for v in quat]
+        num_joints = get_num_joints(body)
+        positions = []
+        if num_joints > 0:
+            positions = [state[0] for state in p.getJointStates(body, range(num_joints), physicsClientId=client)]
+        return (body, token, links, self.quantize(point, self.position_resolution),
+                self.quantize(quat, self.orientation_resolution),
+                self.quantize(positions, self.orientation_resolution))
+
+    def lookup(self, bodies, fn, tag=()):
+        """ return the cached result of fn() given the current states of bodies, compute it on a miss """
+        key = tuple(tag) + tuple(self.get_body_key(body) for body in bodies)
+        if key in self.results:
+            self.hits += 1
+            self.results.move_to_end(key)
+            return self.results[key]
+        self.misses += 1
+        result = fn()
+        self.results[key] = result
+        if len(self.results) > self.max_size:
+            self.results.popitem(last=False)
+        return result
+
+    def pairwise_collision(self, body1, body2, **kwargs):
+        tag = ('pairwise_collision',) + tuple(sorted(kwargs.items()))
+        return self.lookup([body1, body2], lambda: pairwise_collision(body1, body2, **kwargs), tag=tag)
+
+    def clear(self):
+        self.results.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.results)
+
+    def __repr__(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total > 0 else 0
+        return f'{self.__class__.__name__}(size={len(self)}, hits={self.hits}, misses={self.misses}, ' \
+               f'hit_rate={hit_rate:.3f})'
+
+
+class IKCache(object):
+    """ LRU cache of arm ik solutions keyed on the quantized tool pose relative to the parent link of the
+        first arm joint, which stays the same when reaching for the same grasp of an object from nearby base confs.
+        a solution is reused directly for the same relative pose, otherwise it seeds the ik solver """
+
+    def __init__(self, max_size=10000, position_resolution=0.01, orientation_resolution=0.05, tolerance=1e-6):
+        self.max_size = max_size
+        self.position_resolution = position_resolution
+        self.orientation_resolution = orientation_resolution
+        self.tolerance = tolerance
+        self.solutions = OrderedDict()  ## (arm, point, euler): (base_from_tool, conf)
+        self.reused = 0
+        self.hits = 0
+        self.misses = 0
+
+    def quantize(self, values, resolution):
+        return tuple(int(round(v / resolution)) for v in values)
+
+    def get_base_from_tool(self, body, arm_joint, tool_pose):
+        world_from_base = get_link_pose(body, parent_link_from_joint(body, arm_joint))
+        return multiply(invert(world_from_base), tool_pose)
+
+    def get_key(self, arm, base_from_tool):
+        point, quat = base_from_tool
+        return (arm, self.quantize(point, self.position_resolution),
+                self.quantize(euler_from_quat(quat), self.orientation_resolution))
+
+    def lookup(self, arm, base_from_tool):
+        """ return (conf, exact) of the solution stored for the quantized pose, or (None, False) """
+        key = self.get_key(arm, base_from_tool)
+        if key not in self.solutions:
+            self.misses += 1
+            return None, False
+        self.solutions.move_to_end(key)
+        stored_pose, conf = self.solutions[key]
+        exact = all(np.allclose(a, b, atol=self.tolerance) for a, b in zip(stored_pose, base_from_tool))
+        if exact:
+            self.reused += 1
+        else:
+            self.hits += 1
+        return conf, exact
+
+    def add(self, arm, base_from_tool, conf):
+        key = self.get_key(arm, base_from_tool)
+        self.solutions[key] = (base_from_tool, tuple(conf))
+        self.solutions.move_to_end(key)
+        if len(self.solutions) > self.max_size:
+            self.solutions.popitem(last=False)
+
+    def clear(self):
+        self.solutions.clear()
+        self.reused = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.solutions)
+
+    def __repr__(self):
+        total = self.reused + self.hits + self.misses
+        hit_rate = (self.reused + self.hits) / total if total > 0 else 0
+        return f'{self.__class__.__name__}(size={len(self)}, reused={self.reused}, seeded={self.hits}, ' \
+               f'misses={self.misses}, hit_rate={hit_rate:.3f})'
+
+
 def log_collided(obj, obs, visualize=False):
     # from world_builder.robots import RobotAPI
 
@@ -348,10 +486,11 @@ def log_collided(obj, obs, visualize=False):
         wait_unlocked()
 
 
+@profiled('collision')
 def collided(obj, obstacles=[], world=None, articulated=False, verbose=False, tag='',
              visualize=False, min_num_pts=3, use_aabb=True, ignored_pairs=[],
-             log_collisions=True, **kwargs):
-
+             log_collisions=True, cache=None, **kwargs):
+    """ cache: a CollisionCache that the pairwise collisions between obj and each obstacle are looked up in """
     if world is None and hasattr(obj, 'world'):
         world = obj.world
     obj_print = world.get_name(obj) if world is not None else obj
@@ -380,8 +519,9 @@ def collided(obj, obstacles=[], world=None, articulated=False, verbose=False, ta
     bodies = []
     verbose_bodies = []
     to_print = ''
+    collision_fn = pairwise_collision if cache is None else cache.pairwise_collision
     for b in obstacles:
-        if pairwise_collision(obj, b) and (obj, b) not in ignored_pairs:
+        if collision_fn(obj, b) and (obj, b) not in ignored_pairs:
             if world is None:
                 print('bullet_utils.collided | world is None')
                 import traceback
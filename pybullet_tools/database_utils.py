@@ -0,0 +1,146 @@
+""" columnar storage of the sampler databases, i.e. {key: [row]} or {key: {key2: [row]}} dicts,
+    as one float array of all rows (path.npy) and an index of the keys and their row ranges (path.json).
+    the array is memory-mapped, so planning workers share one copy of the data and start up immediately """
+
+import hashlib
+import json
+import time
+from os.path import isfile, abspath
+from numbers import Number
+
+import numpy as np
+
+from pybullet_tools.utils import read_pickle
+
+COLUMNAR_VERSION = 1
+
+
+class ColumnarDatabase(object):
+    """ read-only view with the dict interface used by the learned samplers """
+
+    def __init__(self, values, index, scalar=False):
+        self.values = values
+        self.index = index  ## key: (start, end) or key: ColumnarDatabase
+        self.scalar = scalar
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def items(self):
+        return [(key, self[key]) for key in self.index]
+
+    def get_array(self, key):
+        """ the rows of key as a (memory-mapped) array, without converting them to tuples """
+        start, end = self.index[key]
+        return self.values[start:end]
+
+    def __getitem__(self, key):
+        entry = self.index[key]
+        if isinstance(entry, ColumnarDatabase):
+            return entry
+        rows = self.get_array(key).tolist()
+        if self.scalar:
+            return [row[0] for row in rows]
+        return [tuple(row) for row in rows]
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({len(self)} keys, {len(self.values)} rows)'
+
+
+def tuple_from_list(key):
+    """ keys are stored as json, where their tuples became lists """
+    if isinstance(key, list):
+        return tuple(map(tuple_from_list, key))
+    return key
+
+
+def get_columnar_paths(path):
+    path = path.replace('.pickle', '')
+    return f'{path}.npy', f'{path}.json'
+
+
+def get_file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def has_columnar_database(path):
+    """ the columnar database is outdated if the pickle it was converted from has changed since """
+    values_path, index_path = get_columnar_paths(path)
+    if not isfile(values_path) or not isfile(index_path):
+        return False
+    pickle_path = path.replace('.pickle', '') + '.pickle'
+    if not isfile(pickle_path):
+        return True
+    with open(index_path, 'r') as f:
+        data = json.load(f)
+    return data['version'] == COLUMNAR_VERSION and data.get('source_hash') == get_file_hash(pickle_path)
+
+
+def save_columnar_database(db, path, source=None):
+    """ rows must be numbers or tuples of numbers of the same length, keys numbers, strings or tuples of them,
+        source is the pickle that db was loaded from """
+    values = []
+
+    def add_rows(rows):
+        start = len(values)
+        values.extend([row] if isinstance(row, Number) else list(row) for row in rows)
+        return [start, len(values)]
+
+    index = []
+    nested = any(isinstance(v, dict) for v in db.values())
+    for key, v in db.items():
+        if nested:
+            index.append([key, [[key2, add_rows(rows)] for key2, rows in v.items()]])
+        else:
+            index.append([key, add_rows(v)])
+    if len(set(map(len, values))) > 1:
+        raise ValueError(f'save_columnar_database | rows of different lengths in {path}')
+
+    first_row = next(iter(db.values()))
+    if nested:
+        first_row = next(iter(first_row.values()))
+    scalar = len(first_row) > 0 and isinstance(first_row[0], Number)
+
+    values_path, index_path = get_columnar_paths(path)
+    np.save(values_path, np.array(values, dtype=float).reshape(len(values), -1))
+    with open(index_path, 'w') as f:
+        source_hash = None if source is None else get_file_hash(source)
+        json.dump(dict(version=COLUMNAR_VERSION, source_hash=source_hash, nested=nested, scalar=scalar,
+                       index=index), f)
+    return values_path, index_path
+
+
+def load_columnar_database(path, mmap=True, verbose=False):
+    start_time = time.time()
+    values_path, index_path = get_columnar_paths(path)
+    values = np.load(values_path, mmap_mode='r' if mmap else None)
+    with open(index_path, 'r') as f:
+        data = json.load(f)
+    scalar = data['scalar']
+    index = {}
+    for key, entry in data['index']:
+        if data['nested']:
+            entry = ColumnarDatabase(values, {tuple_from_list(key2): tuple(rows) for key2, rows in entry},
+                                     scalar=scalar)
+        index[tuple_from_list(key)] = entry if data['nested'] else tuple(entry)
+    if verbose:
+        print(f'Loaded: {abspath(values_path)} ({time.time() - start_time:.3f} sec)')
+    return ColumnarDatabase(values, index, scalar=scalar)
+
+
+def convert_pickled_database(pickle_path):
+    """ the inverse reachability databases only keep their gripper_from_base poses, as (point, quat) rows """
+    db = read_pickle(pickle_path)
+    if 'gripper_from_base' in db:
+        db = {'gripper_from_base': [tuple(point) + tuple(quat) for point, quat in db['gripper_from_base']]}
+    return save_columnar_database(db, pickle_path, source=pickle_path)
@@ -14,8 +14,9 @@ from pybullet_tools.flying_gripper_utils import get_ik_fn, get_free_motion_gen,
 from pybullet_tools.stream_agent import opt_move_cost_fn
 
 
-def get_stream_map(p, c, l, t, **kwargs):
-    """ p = problem, c = collisions, l = custom_limits, t = teleport """
+def get_stream_map(p, c, l, t, profile_streams=False, **kwargs):
+    """ p = problem, c = collisions, l = custom_limits, t = teleport
+        profile_streams = see stream_agent.get_stream_map """
 
     stream_map = {
         'sample-pose-on': from_gen_fn(get_stable_gen(p, collisions=c)),
@@ -68,6 +69,8 @@ def get_stream_map(p, c, l, t, **kwargs):
         # 'TrajArmCollision': fn_from_constant(False),
         # 'TrajGraspCollision': fn_from_constant(False),
     }
+    if profile_streams:
+        stream_map = p.world.get_stream_profiler().wrap_stream_map(stream_map)
     return stream_map
 
 
@@ -19,7 +19,8 @@ from pybullet_tools.utils import create_box, set_base_values, set_point, set_pos
     approximate_as_prism, set_renderer, plan_joint_motion, create_flying_body, SE3, euler_from_quat, BodySaver, \
     intrinsic_euler_from_quat, quat_from_euler, wait_for_duration, get_aabb, get_aabb_extent, \
     joint_from_name, get_joint_limits, irange, is_pose_close, CLIENT, set_all_color, GREEN, RED, \
-    wait_unlocked, dump_joint, VideoSaver
+    wait_unlocked, dump_joint, VideoSaver, child_link_from_joint, get_relative_pose, invert, Euler, \
+    get_collision_fn, ConfSaver
 from pybullet_tools.pr2_primitives import Conf, Grasp, Trajectory, Commands, State
 from pybullet_tools.general_streams import Position, get_grasp_list_gen, get_handle_link, \
     process_motion_fluents
@@ -240,7 +241,38 @@ def pose_from_se3(conf):
     return (conf[:3], quat_from_euler(conf[3:]))
 
 
-def se3_ik(robot, target_pose, max_iterations=200, max_time=5, verbose=False, mod_target=None):
+def get_se3_tool_offset(robot, body=None):
+    """ the fixed pose of the tool link in the frame of the last (yaw) link of the se3 chain,
+        measured on body if given, e.g. the cloned gripper that has the same links """
+    yaw_link = child_link_from_joint(get_se3_joints(robot)[-1])
+    return get_relative_pose(robot if body is None else body, link_from_name(robot, FEG_TOOL_LINK), yaw_link)
+
+
+def se3_fk(robot, conf):
+    """ the x, y, z, roll, pitch, yaw joints are chained in that order, so the rotation is intrinsic xyz """
+    world_from_yaw = multiply(get_pose(robot), Pose(point=conf[:3]), Pose(euler=Euler(roll=conf[3])),
+                              Pose(euler=Euler(pitch=conf[4])), Pose(euler=Euler(yaw=conf[5])))
+    return multiply(world_from_yaw, get_se3_tool_offset(robot))
+
+
+def closed_form_se3_ik(robot, target_pose, body=None):
+    """ inverts se3_fk, returns None if the target position is out of the joint limits,
+        body is the robot or its cloned gripper whose root pose is used """
+    body = robot if body is None else body
+    world_from_yaw = multiply(target_pose, invert(get_se3_tool_offset(robot, body)))
+    point, quat = multiply(invert(get_pose(body)), world_from_yaw)
+    conf = list(point) + list(intrinsic_euler_from_quat(quat))
+    joints = get_se3_joints(robot)
+    for joint, value in zip(joints[:3], conf[:3]):
+        lower, upper = get_joint_limits(robot, joint)
+        if not (lower <= value <= upper):
+            return None
+    return conf
+
+
+def se3_ik(robot, target_pose, max_iterations=200, max_time=5, verbose=False, mod_target=None,
+           closed_form=True):
+    """ closed_form=False solves with pybullet's iterative solver on a cloned gripper """
     report_failure = False
     debug = False
 
@@ -249,10 +281,25 @@ def se3_ik(robot, target_pose, max_iterations=200, max_time=5, verbose=False, mo
         target_pose = mod_target
 
     title = f'   se3_ik | for pose {nice(target_pose)}'
+    start_time = time.time()
+
+    ## not cached, because the conf depends on where the cloned gripper currently is
+    if closed_form:
+        ## solved for the cloned gripper, like the iterative solver below
+        sub_kinematic_conf = closed_form_se3_ik(robot, target_pose, body=robot.get_gripper())
+        if verbose:
+            print(f'{title} closed form in {nice(elapsed_time(start_time))} sec', nice(sub_kinematic_conf))
+        if sub_kinematic_conf is None:
+            if report_failure: print(f'{title} out of joint limits')
+            return None
+        if mod_target is not None:
+            sub_kinematic_conf = list(actual_target[0]) + list(sub_kinematic_conf)[3:]
+        return sub_kinematic_conf
+
     if nice(target_pose) in CACHE:
         if verbose: print(f'{title} found in cache')
         return CACHE[nice(target_pose)]
-    start_time = time.time()
+
     link = link_from_name(robot, FEG_TOOL_LINK)
     target_point, target_quat = target_pose
 
@@ -312,9 +359,48 @@ def approximate_as_box(robot):
     return get_aabb_extent(aabb)
 
 
+def unwrap_se3_conf(conf, previous_conf):
+    """ shifts the roll, pitch, yaw of conf by multiples of 2*pi to be the closest to previous_conf """
+    angles = np.array(conf[3:])
+    angles -= 2*np.pi * np.round((angles - np.array(previous_conf[3:])) / (2*np.pi))
+    return list(conf[:3]) + angles.tolist()
+
+
+def plan_se3_straight_motion(robot, initial_conf, final_conf, obstacles=[], custom_limits={}, attachments=[],
+                             pos_step_size=0.02, ori_step_size=np.pi/16, max_angle_step=np.pi/4):
+    """ interpolates the tool pose between the two confs, returns None if any waypoint is in collision
+        or if any step turns a rotation joint by more than max_angle_step, which isn't collision checked """
+    joints = get_se3_joints(robot)
+    collision_fn = get_collision_fn(robot, joints, obstacles=obstacles, attachments=attachments,
+                                    self_collisions=False, custom_limits=custom_limits)
+    path = [list(initial_conf)]
+    pose1, pose2 = se3_fk(robot, initial_conf), se3_fk(robot, final_conf)
+    for pose in list(interpolate_poses(pose1, pose2, pos_step_size, ori_step_size))[1:-1]:
+        conf = closed_form_se3_ik(robot, pose)
+        if conf is None:
+            return None
+        path.append(unwrap_se3_conf(conf, path[-1]))
+    path.append(list(final_conf))
+    ## final_conf isn't unwrapped, so the last step may be a full turn, e.g. from yaw pi-0.1 to -pi+0.1
+    angle_steps = np.abs(np.diff(np.array(path)[:, 3:], axis=0))
+    if np.any(angle_steps > max_angle_step):
+        return None
+    if any(collision_fn(conf) for conf in path):
+        return None
+    return path
+
+
 def plan_se3_motion(robot, initial_conf, final_conf, obstacles=[],
-                    custom_limits={}, attachments=[], visualize=False):
+                    custom_limits={}, attachments=[], visualize=False, straight=True):
+    """ straight=True first tries the straight-line path of the tool before sampling-based planning """
     joints = get_se3_joints(robot)
+    if straight:
+        with ConfSaver(robot):
+            path = plan_se3_straight_motion(robot, initial_conf, final_conf, obstacles=obstacles,
+                                            custom_limits=custom_limits, attachments=attachments)
+        if path is not None:
+            set_joint_positions(robot, joints, initial_conf)
+            return path
     set_joint_positions(robot, joints, initial_conf)
     path = plan_joint_motion(robot, joints, final_conf, obstacles=obstacles,
                              weights=[1, 1, 1, 0.2, 0.2, 0.2],
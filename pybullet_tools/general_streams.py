@@ -20,7 +20,7 @@ from pybullet_tools.pr2_primitives import Pose, Grasp, APPROACH_DISTANCE, GRASP_
 from pybullet_tools.bullet_utils import nice, visualize_point, collided, is_box_entity, \
     query_yes_no
 from pybullet_tools.pose_utils import sample_obj_in_body_link_space, is_contained, \
-    ObjAttachment, sample_obj_on_body_link_surface, has_much_larger_aabb, adjust_sampled_pose
+    ObjAttachment, sample_obj_on_body_link_surface, has_much_larger_aabb, adjust_sampled_pose, xyzyaw_to_pose
 from pybullet_tools.camera_utils import set_camera_target_body
 from pybullet_tools.grasp_utils import get_hand_grasps, sample_from_pickled_grasps, is_top_grasp, \
     needs_special_grasp
@@ -277,8 +277,18 @@ def get_rel_pose(body, surface, body_pose):
     return p
 
 
+def sample_free_space_pose(world, body, region):
+    """ samples from the free space map of region if it is a Surface or Space, else returns None """
+    from world_builder.entities import Surface, Space
+    region = world.BODY_TO_OBJECT.get(region)
+    if not isinstance(region, (Surface, Space)):
+        return None
+    result = region.sample_free_placement(body)
+    return None if result is None else xyzyaw_to_pose(result)
+
+
 def get_stable_gen(problem, collisions=True, num_samples=20, verbose=False, visualize=False,
-                   learned_sampling=True, relpose=False, **kwargs):
+                   learned_sampling=True, relpose=False, free_space=True, **kwargs):
     from pybullet_tools.pr2_primitives import Pose
     from world_builder.world_utils import smarter_sample_placement
     obstacles = problem.fixed if collisions else []
@@ -324,24 +334,30 @@ def get_stable_gen(problem, collisions=True, num_samples=20, verbose=False, visu
         while count > 0:
             count -= 1
             surface = random.choice(surfaces)  # TODO: weight by area
-            if isinstance(surface, tuple):  ## (body, link)
-                # body_pose = sample_obj_on_body_link_surface(body, surface[0], surface[-1])
-                body_pose = sample_placement(body, surface[0], bottom_link=surface[-1], **kwargs)
+            body_pose = None
+            ## objects that are barely smaller than the surface keep their orientation, see the last sampler below
+            if free_space and (isinstance(surface, tuple) or has_much_larger_aabb(surface, body)):
+                body_pose = sample_free_space_pose(world, body, surface)
 
-                ## return false when the surface aabb is too small
-                if body_pose is None:
-                    bottom_aabb = get_aabb(surface[0], link=surface[-1])
-                    _, extent = get_center_extent(body)
-                    x, y, _ = get_aabb_center(bottom_aabb)
-                    z = bottom_aabb.upper[2] + extent[2] / 2 + 0.01
-                    body_pose = ((x, y, z), quat_from_euler(Euler(yaw=PI/2)))
+            if body_pose is None:
+                if isinstance(surface, tuple):  ## (body, link)
+                    # body_pose = sample_obj_on_body_link_surface(body, surface[0], surface[-1])
+                    body_pose = sample_placement(body, surface[0], bottom_link=surface[-1], **kwargs)
 
-            elif has_much_larger_aabb(surface, body):
-                body_pose = smarter_sample_placement(body, surface, world, **kwargs)
+                    ## return false when the surface aabb is too small
+                    if body_pose is None:
+                        bottom_aabb = get_aabb(surface[0], link=surface[-1])
+                        _, extent = get_center_extent(body)
+                        x, y, _ = get_aabb_center(bottom_aabb)
+                        z = bottom_aabb.upper[2] + extent[2] / 2 + 0.01
+                        body_pose = ((x, y, z), quat_from_euler(Euler(yaw=PI/2)))
 
-            else:
-                body_pose = sample_placement(body, surface, percent=0, **kwargs)  ## ok if one dimension is smaller
-                body_pose = (body_pose[0], original_pose[1])
+                elif has_much_larger_aabb(surface, body):
+                    body_pose = smarter_sample_placement(body, surface, world, **kwargs)
+
+                else:
+                    body_pose = sample_placement(body, surface, percent=0, **kwargs)  ## ok if one dimension is smaller
+                    body_pose = (body_pose[0], original_pose[1])
 
             if body_pose is None:
                 break
@@ -388,7 +404,7 @@ def get_mod_pose(pose):
 
 
 def get_contain_gen(problem, collisions=True, num_samples=20, verbose=False, relpose=False,
-                    learned_sampling=True, **kwargs):
+                    learned_sampling=True, free_space=True, **kwargs):
     from pybullet_tools.pr2_primitives import Pose
     from world_builder.entities import Object
     obstacles = problem.fixed if collisions else []
@@ -434,22 +450,24 @@ def get_contain_gen(problem, collisions=True, num_samples=20, verbose=False, rel
 
             if isinstance(space, Object):
                 space = Object.pybullet_name
-            if isinstance(space, tuple):
-                result = sample_obj_in_body_link_space(body, body=space[0], link=space[-1],
-                                                       PLACEMENT_ONLY=True, verbose=verbose, **kwargs)
-                if result is None:
-                    break
-                x, y, z, yaw = result
-                body_pose = ((x, y, z), quat_from_euler(Euler(yaw=yaw)))
-            else:
-                ## e.g. braiser body
-                result = sample_obj_in_body_link_space(body, body=space, link=None,
-                                                       PLACEMENT_ONLY=True, verbose=verbose, **kwargs)
-                if result is None:
-                    break
-                _, _, z, yaw = result
-                x, y, _ = get_aabb_center(get_aabb(space))
-                body_pose = ((x, y, z), quat_from_euler(Euler(yaw=yaw)))
+            body_pose = sample_free_space_pose(world, body, space) if free_space else None
+            if body_pose is None:
+                if isinstance(space, tuple):
+                    result = sample_obj_in_body_link_space(body, body=space[0], link=space[-1],
+                                                           PLACEMENT_ONLY=True, verbose=verbose, **kwargs)
+                    if result is None:
+                        break
+                    x, y, z, yaw = result
+                    body_pose = ((x, y, z), quat_from_euler(Euler(yaw=yaw)))
+                else:
+                    ## e.g. braiser body
+                    result = sample_obj_in_body_link_space(body, body=space, link=None,
+                                                           PLACEMENT_ONLY=True, verbose=verbose, **kwargs)
+                    if result is None:
+                        break
+                    _, _, z, yaw = result
+                    x, y, _ = get_aabb_center(get_aabb(space))
+                    body_pose = ((x, y, z), quat_from_euler(Euler(yaw=yaw)))
 
             if body_pose is None:
                 break
@@ -697,9 +715,25 @@ def sample_joint_position_gen(problem, num_samples=14, p_max=PI, to_close=False,
 """
 
 
+def rank_grasps(world, arm, body, grasps, default_score=0.5):
+    """ the grasps with more successful ik calls first, precomputed by robot_utils.save_grasp_scores(),
+        grasps without a score are ranked as default_score and ties keep their order """
+    from robot_builder.robot_utils import get_grasp_score
+    instance_name = world.get_instance_name(body) if hasattr(world, 'get_instance_name') else None
+    if instance_name is None:
+        return grasps
+    scores = [get_grasp_score(world.robot, instance_name, arm, grasp.value) for grasp in grasps]
+    if all(score is None for score in scores):
+        return grasps
+    scores = [default_score if score is None else score for score in scores]
+    order = sorted(range(len(grasps)), key=lambda i: -scores[i])
+    return [grasps[i] for i in order]
+
+
 def get_grasp_gen(problem, collisions=True, num_samples=20, randomize=True, verbose=True, debug=False,
                   top_grasp_tolerance=None, side_grasp_tolerance=None,  # None | PI/4 | INF
-                  test_offset=False, loaded_offset=None, **kwargs):
+                  test_offset=False, loaded_offset=None, ranked=True, **kwargs):
+    """ ranked=True yields the grasps with higher reachability scores first, if they are precomputed """
     robot = problem.robot
     world = problem.world
     grasp_type = 'hand'
@@ -737,6 +771,8 @@ def get_grasp_gen(problem, collisions=True, num_samples=20, randomize=True, verb
 
         if randomize_here:
             random.shuffle(grasps)
+        if ranked and not test_offset:
+            grasps = rank_grasps(world, arm, body, grasps)
         # print(f'get_grasp_gen({body}, {world.get_name(body)}) = {len(grasps)} grasps')
         # return [(g,) for g in grasps]
         i = 0
@@ -953,6 +989,25 @@ def get_reachable_test(radius=1.3, verbose=False):
     return test
 
 
+def get_workspace_reachable_test(problem, radius=1.3, verbose=False):
+    """ rejects (grasp, pose, base conf) whose tool point is outside the precomputed workspace map of the arm,
+        see robot_utils.save_workspace_map(), without any collision or ik call.
+        falls back to get_reachable_test(radius) for robots without a map """
+    from robot_builder.robot_utils import is_reachable_in_workspace
+    robot = problem.robot
+    radius_test = get_reachable_test(radius=radius, verbose=verbose)
+
+    def test(a, o, p, g, q):
+        grasp_pose = robot.get_grasp_pose(p.value, g.value, a, body=o)
+        result = is_reachable_in_workspace(robot, a, grasp_pose, q)
+        if result is None:
+            return radius_test(a, o, p, g, q)
+        if verbose:
+            print(f'general_streams.get_workspace_reachable_test({o}, {p}, {q}) -> {result}')
+        return result
+    return test
+
+
 """ ==============================================================
 
             Nudge Grasp for Doors
@@ -1038,11 +1093,20 @@ def get_cfree_obj_approach_pose_test(robot, collisions=True):
     return test
 
 
+def get_pairwise_collision_fn(problem):
+    """ use the collision cache of the problem (a world.State) if there is one """
+    collision_cache = getattr(problem, 'collision_cache', None)
+    if collision_cache is None:
+        return pairwise_collision
+    return collision_cache.pairwise_collision
+
+
 def get_cfree_approach_pose_test(problem, collisions=True):
     """ PR2 version """
     # TODO: apply this before inverse kinematics as well
     arm = problem.robot.arms[0]
     gripper = problem.get_gripper()
+    pairwise_collision_fn = get_pairwise_collision_fn(problem)
 
     def test(b1, p1, g1, b2, p2):
         if not collisions or (b1 == b2) or b2 in ['@world']:
@@ -1051,7 +1115,7 @@ def get_cfree_approach_pose_test(problem, collisions=True):
         bb2 = b2[0] if isinstance(b2, tuple) else b2
         result = True
         for _ in problem.robot.iterate_approach_path(arm, gripper, p1.value, g1, body=b1):
-            if pairwise_collision(b1, bb2) or pairwise_collision(gripper, bb2):
+            if pairwise_collision_fn(b1, bb2) or pairwise_collision_fn(gripper, bb2):
                 result = False
                 break
         return result
@@ -1061,6 +1125,7 @@ def get_cfree_approach_pose_test(problem, collisions=True):
 def get_cfree_pose_pose_test(problem, collisions=True, visualize=False, **kwargs):
     robot = problem.robot
     ignored_pairs = problem.ignored_pairs
+    pairwise_collision_fn = get_pairwise_collision_fn(problem)
     def test(b1, p1, b2, p2, fluents=[]):
         if not collisions or (b1 == b2) or b2 in ['@world'] or (b1, b2) in ignored_pairs:
             return True
@@ -1069,7 +1134,7 @@ def get_cfree_pose_pose_test(problem, collisions=True, visualize=False, **kwargs
         p1.assign()
         p2.assign()
         bb2 = b2[0] if isinstance(b2, tuple) else b2
-        result = not pairwise_collision(b1, bb2, **kwargs)
+        result = not pairwise_collision_fn(b1, bb2, **kwargs)
         if not result and visualize:
             wait_unlocked()
         return result #, max_distance=0.001)
@@ -1118,7 +1183,7 @@ def get_cfree_approach_rel_pose_test(problem, collisions=True):
 ## ------------------------------------------------------------------------------------------------
 
 
-def _check_cfree_traj_pose(c, b2, p2, world, collisions=True, verbose=False, visualize=True):
+def _check_cfree_traj_pose(c, b2, p2, world, collisions=True, verbose=False, visualize=True, collision_cache=None):
     from pybullet_tools.flying_gripper_utils import pose_from_se3
     # TODO: infer robot from c
     if not collisions:
@@ -1154,7 +1219,7 @@ def _check_cfree_traj_pose(c, b2, p2, world, collisions=True, verbose=False, vis
             continue
         title = f'[step {count}/{length}]'
         state.assign()
-        if collided(b2, obstacles, verbose=verbose, world=world, tag=title):
+        if collided(b2, obstacles, verbose=verbose, world=world, tag=title, cache=collision_cache):
             result = False
     if visualize:
         remove_handles(handles)
@@ -1163,6 +1228,7 @@ def _check_cfree_traj_pose(c, b2, p2, world, collisions=True, verbose=False, vis
 
 def get_cfree_traj_pose_test(problem, **kwargs):
     world = problem.world
+    kwargs.setdefault('collision_cache', getattr(problem, 'collision_cache', None))
 
     def test(c, b2, p2):
         return _check_cfree_traj_pose(c, b2, p2, world, **kwargs)
@@ -1171,6 +1237,7 @@ def get_cfree_traj_pose_test(problem, **kwargs):
 
 def get_cfree_traj_pose_at_bconf_at_joint_position_test(problem, **kwargs):
     world = problem.world
+    kwargs.setdefault('collision_cache', getattr(problem, 'collision_cache', None))
 
     def test(c, b2, p2, q, o, pstn):
         with ConfSaver(world.robot.body):
@@ -1182,6 +1249,7 @@ def get_cfree_traj_pose_at_bconf_at_joint_position_test(problem, **kwargs):
 
 def get_cfree_traj_pose_at_bconf_at_joint_position_at_link_pose_test(problem, **kwargs):
     world = problem.world
+    kwargs.setdefault('collision_cache', getattr(problem, 'collision_cache', None))
 
     def test(c, b2, p2, q, o, pstn, l, p):
         with ConfSaver(world.robot.body):
@@ -1,5 +1,7 @@
+import atexit
 import random
-from os.path import isfile, dirname, abspath, join, isdir
+from contextlib import contextmanager
+from os.path import isfile, dirname, abspath, join, isdir, basename
 import sys
 
 import numpy as np
@@ -18,7 +20,8 @@ from pybullet_tools.utils import unit_pose, get_collision_data, get_links, multi
     YELLOW, add_line, draw_point, RED, remove_handles, apply_affine, vertices_from_rigid, \
     aabb_from_points, get_aabb_extent, get_aabb_center, get_aabb_edges, has_gui, get_rigid_clusters, \
     link_pairs_collision, wait_unlocked, apply_alpha, set_color, BASE_LINK as ROOT_LINK, \
-    BROWN, BLUE, WHITE, TAN, GREY, YELLOW, GREEN, BLACK, RED, quat_from_pose, Point, tform_point, angle_between
+    BROWN, BLUE, WHITE, TAN, GREY, YELLOW, GREEN, BLACK, RED, quat_from_pose, Point, tform_point, angle_between, \
+    get_all_links, can_collide, tform_from_pose
 from pybullet_tools.bullet_utils import nice, collided, equal, minus, add, get_color_by_index, \
     get_datetime, is_box_entity, draw_fitted_box, get_model_pose, colors
 from pybullet_tools.camera_utils import set_camera_target_body
@@ -130,10 +133,137 @@ def get_gripper_direction(pose, epsilon=0.01):
     return None
 
 
+GRASP_DB_COMPACT_AFTER = 10  ## appended updates before the json file is rewritten
+GRASP_STORES = {}  ## db_file: GraspStore
+
+
+class GraspStore(object):
+    """ in-process cache of a hand grasps json file shared by parallel data generation workers,
+        updates are appended to a write-ahead log (db_file.log) under a file lock (db_file.lock)
+        and merged into the json file, which keeps the same format, every GRASP_DB_COMPACT_AFTER updates """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.log_file = db_file + '.log'
+        self.lock_file = db_file + '.lock'
+        self.db = {}  ## instance_name: entry, also the index for lookups
+        self.db_stat = None
+        self.log_offset = 0
+        self.num_appended = 0
+
+    @contextmanager
+    def lock(self, exclusive=False):
+        try:
+            import fcntl
+        except ImportError:  ## no file locking on Windows, only safe with one worker
+            yield
+            return
+        with open(self.lock_file, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get_stat(self, path):
+        if not isfile(path):
+            return None
+        stat = os.stat(path)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def refresh(self):
+        """ reloads the json file only if another worker rewrote it, then reads the new log entries """
+        db_stat = self.get_stat(self.db_file)
+        if db_stat != self.db_stat:
+            self.db = json.load(open(self.db_file, 'r')) if db_stat is not None else {}
+            self.db_stat = db_stat
+            self.log_offset = 0
+        if isfile(self.log_file) and os.path.getsize(self.log_file) > self.log_offset:
+            with open(self.log_file, 'r') as f:
+                f.seek(self.log_offset)
+                for line in f:
+                    update = json.loads(line)
+                    self.db[update['instance']] = update['entry']
+                self.log_offset = f.tell()
+        elif not isfile(self.log_file):
+            self.log_offset = 0
+
+    def get_db(self):
+        with self.lock():
+            self.refresh()
+        return self.db
+
+    def add(self, instance_name, grasps, name='None', length_variants=False, scale=None):
+        """ the entry is updated from the latest state under the lock, so no worker overwrites another """
+        key = 'grasps' if not length_variants else 'grasps_l'
+        with self.lock(exclusive=True):
+            self.refresh()
+            if instance_name in self.db:
+                entry = self.db[instance_name]
+                if 'other_scales' not in entry:
+                    entry['other_scales'] = {}
+                entry['other_scales'][str(scale)] = grasps
+            else:
+                entry = {
+                    'name': name,
+                    key: grasps,
+                    'datetime': get_datetime(),
+                    'scale': scale,
+                }
+                self.db[instance_name] = entry
+            with open(self.log_file, 'a') as f:
+                f.write(json.dumps({'instance': instance_name, 'entry': entry}) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+                self.log_offset = f.tell()
+            self.num_appended += 1
+            if self.num_appended >= GRASP_DB_COMPACT_AFTER:
+                self.compact()
+        return entry
+
+    def compact(self):
+        """ atomically rewrites the json file with all logged updates, must be called holding the lock """
+        keys = {k: v['datetime'] for k, v in self.db.items()}
+        keys = sorted(keys.items(), key=lambda x: x[1])
+        db = {k: self.db[k] for k, v in keys}
+        tmp_file = f'{self.db_file}.{os.getpid()}.tmp'
+        dump_json(db, tmp_file, sort_dicts=False)
+        os.replace(tmp_file, self.db_file)
+        if isfile(self.log_file):
+            os.remove(self.log_file)
+        self.db_stat = self.get_stat(self.db_file)
+        self.log_offset = 0
+        self.num_appended = 0
+
+    def export(self):
+        """ merges the pending updates of all workers into the json file """
+        with self.lock(exclusive=True):
+            self.refresh()
+            if isfile(self.log_file):
+                self.compact()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({basename(self.db_file)}, {len(self.db)} instances)'
+
+
+def export_grasp_stores():
+    for store in GRASP_STORES.values():
+        if store.num_appended > 0:
+            store.export()
+
+
+def get_grasp_store(db_file):
+    if db_file not in GRASP_STORES:
+        if len(GRASP_STORES) == 0:
+            atexit.register(export_grasp_stores)
+        GRASP_STORES[db_file] = GraspStore(db_file)
+    return GRASP_STORES[db_file]
+
+
 def find_grasp_in_db(db_file, instance_name, length_variants=False, scale=None,
                      use_all_grasps=False, verbose=False, world=None):
     """ find saved json files, prioritize databases/ subdir """
-    db = json.load(open(db_file, 'r')) if isfile(db_file) else {}
+    db = get_grasp_store(db_file).get_db()
 
     def rewrite_grasps(data):
         ## the newest format has poses written as (x, y, z, roll, pitch, row)
@@ -179,9 +309,9 @@ def find_grasp_in_db(db_file, instance_name, length_variants=False, scale=None,
 
 
 def add_grasp_in_db(db, db_file, instance_name, grasps, name=None, length_variants=False, scale=None):
+    """ appended to the GraspStore of db_file, db is updated in place for callers that keep their own dict """
     if instance_name is None: return
 
-    key = 'grasps' if not length_variants else 'grasps_l'
     add_grasps = []
     for g in grasps:
         add_grasps.append(list(nice(g, 4)))
@@ -192,22 +322,10 @@ def add_grasp_in_db(db, db_file, instance_name, grasps, name=None, length_varian
     if name is None:
         name = 'None'
 
-    if instance_name in db:
-        if 'other_scales' not in db[instance_name]:
-            db[instance_name]['other_scales'] = {}
-        db[instance_name]['other_scales'][str(scale)] = add_grasps
-    else:
-        db[instance_name] = {
-            'name': name,
-            key: add_grasps,
-            'datetime': get_datetime(),
-            'scale': scale,
-        }
-    keys = {k: v['datetime'] for k, v in db.items()}
-    keys = sorted(keys.items(), key=lambda x: x[1])
-    db = {k: db[k] for k, v in keys}
-    if isfile(db_file): os.remove(db_file)
-    dump_json(db, db_file, sort_dicts=False)
+    store = get_grasp_store(db_file)
+    entry = store.add(instance_name, add_grasps, name=name, length_variants=length_variants, scale=scale)
+    if db is not None and db is not store.db:
+        db[instance_name] = entry
     print(f'\n    bullet_utils.add_grasp_in_db saved {len(grasps)} grasps for {instance_name}\n')
 
 
@@ -318,7 +436,9 @@ def make_nudge_grasps_from_handle_grasps(world, found_hand_grasps, body, body_po
 def get_hand_grasps(world, body, link=None, grasp_length=0.1, visualize=False,
                     handle_filter=False, length_variants=False, use_all_grasps=True,
                     retain_all=False, verbose=True, collisions=False, debug_del=False,
-                    test_offset=False, skip_grasp_index_until=None, nudge=False, nudge_back=False):
+                    test_offset=False, skip_grasp_index_until=None, nudge=False, nudge_back=False, prefilter=True):
+    """ prefilter=True rejects with numpy the candidates whose closed gripper can't touch the object,
+        before spawning the cloned gripper for each in check_cfree_gripper """
     body_name = (body, None, link) if link is not None else body
     title = f'grasp_utils.get_hand_grasps({body_name}) | '
     dist = grasp_length
@@ -382,7 +502,7 @@ def get_hand_grasps(world, body, link=None, grasp_length=0.1, visualize=False,
             print('check_new(aabbs, aabb)')
         return True
 
-    def check_grasp(f, r):
+    def check_grasp(f, r, on_longest):
         grasps = []
         grasp = multiply(Pose(point=f), Pose(euler=r))
 
@@ -433,6 +553,7 @@ def get_hand_grasps(world, body, link=None, grasp_length=0.1, visualize=False,
     # set_renderer(visualize)
     grasps = []
     # aabbs = []
+    candidates = []
     index = 0
     for f in faces:
         p = np.array(f)
@@ -456,10 +577,7 @@ def get_hand_grasps(world, body, link=None, grasp_length=0.1, visualize=False,
                 if index - 1 < skip_grasp_index_until:
                     continue
                 print(f'grasp_index\t{index}')
-
-            grasps.extend(check_grasp(f, r))
-            if test_offset:
-                return grasps
+            candidates.append((f, r, on_longest))
 
         # ## just to look at the orientation
         # if debug_del:
@@ -468,6 +586,21 @@ def get_hand_grasps(world, body, link=None, grasp_length=0.1, visualize=False,
         #     print(f'bullet_utils.get_hand_grasps -> ({len(these)})', [nice(n[1]) for n in these])
         #     print('bullet_utils.get_hand_grasps')
 
+    ## skip the candidates that the closed gripper can't touch before checking collisions in pybullet
+    passed = [True] * len(candidates)
+    if prefilter and not test_offset:
+        bb = body if link is None else (body, link)
+        passed = prefilter_hand_grasps(robot, body, [multiply(Pose(point=f), Pose(euler=r)) for f, r, _ in candidates],
+                                       body_pose, bb=bb)
+        if verbose:
+            print(f'{title} prefilter passed {sum(passed)}/{len(candidates)} candidates')
+    for (f, r, on_longest), keep in zip(candidates, passed):
+        if not keep:
+            continue
+        grasps.extend(check_grasp(f, r, on_longest))
+        if test_offset:
+            return grasps
+
     # set_renderer(True)
     if verbose:
         print(f"{title} ({len(grasps)}) {[nice(g) for g in grasps]}")
@@ -486,6 +619,69 @@ def get_hand_grasps(world, body, link=None, grasp_length=0.1, visualize=False,
     return grasps  ##[:1]
 
 
+def boxes_overlap(centers1, rotations1, extents1, centers2, rotations2, extents2, margin=0.):
+    """ separating axis test between n pairs of oriented boxes, given as (n, 3) centers, (n, 3, 3) rotations
+        and (n, 3) half extents, returns a boolean array of the pairs that overlap """
+    extents1 = np.asarray(extents1) + margin / 2
+    extents2 = np.asarray(extents2) + margin / 2
+    rotation = np.einsum('nji,njk->nik', rotations1, rotations2)  ## box2 axes in the frame of box1
+    t = np.einsum('nji,nj->ni', rotations1, np.asarray(centers2) - np.asarray(centers1))
+    abs_rotation = np.abs(rotation) + 1e-9
+    separated = np.any(np.abs(t) > extents1 + np.einsum('nij,nj->ni', abs_rotation, extents2), axis=1)
+    separated |= np.any(np.abs(np.einsum('nij,ni->nj', rotation, t)) >
+                        np.einsum('nij,ni->nj', abs_rotation, extents1) + extents2, axis=1)
+    for i in range(3):
+        i1, i2 = (i + 1) % 3, (i + 2) % 3
+        for j in range(3):
+            j1, j2 = (j + 1) % 3, (j + 2) % 3
+            ra = extents1[:, i1] * abs_rotation[:, i2, j] + extents1[:, i2] * abs_rotation[:, i1, j]
+            rb = extents2[:, j1] * abs_rotation[:, i, j2] + extents2[:, j2] * abs_rotation[:, i, j1]
+            separated |= np.abs(t[:, i2] * rotation[:, i1, j] - t[:, i1] * rotation[:, i2, j]) > ra + rb
+    return ~separated
+
+
+def get_closed_gripper_boxes(robot, body_pose, body=None):
+    """ (centers, half extents) of the links of the closed cloned gripper, in the frame of the grasp,
+        from the aabbs of the gripper placed so that the grasp frame is the world frame """
+    grasp = invert(robot.get_body_pose(body_pose, body=body))
+    gripper = robot.visualize_grasp(body_pose, grasp, body=body)
+    if gripper is None:
+        return None
+    robot.close_cloned_gripper(gripper)
+    aabbs = [get_aabb(gripper, link) for link in get_all_links(gripper) if can_collide(gripper, link)]
+    robot.open_cloned_gripper(gripper)
+    return np.array([get_aabb_center(aabb) for aabb in aabbs]), \
+        np.array([get_aabb_extent(aabb) / 2 for aabb in aabbs])
+
+
+def prefilter_hand_grasps(robot, body, grasps, body_pose, bb=None, margin=0.02):
+    """ check_cfree_gripper requires the closed gripper to collide with the object, which is impossible when
+        none of the boxes of the closed gripper links overlaps the aabb of any link of the object,
+        returns the boolean array of the grasps that can pass, tested all at once with numpy """
+    gripper_boxes = get_closed_gripper_boxes(robot, body_pose, body=bb)
+    object_aabbs = [get_aabb(body, link) for link in get_all_links(body) if can_collide(body, link)]
+    if gripper_boxes is None or len(object_aabbs) == 0 or len(grasps) == 0:
+        return np.ones(len(grasps), dtype=bool)
+    centers, extents = gripper_boxes
+    world_from_body = robot.get_body_pose(body_pose, body=bb)
+    tforms = np.array([tform_from_pose(multiply(world_from_body, grasp)) for grasp in grasps])
+
+    ## all (grasp, gripper link, object link) triples
+    n, m, k = len(grasps), len(centers), len(object_aabbs)
+    gripper_centers = np.einsum('nij,mj->nmi', tforms[:, :3, :3], centers) + tforms[:, None, :3, 3]
+    gripper_rotations = np.broadcast_to(tforms[:, None, None, :3, :3], (n, m, k, 3, 3)).reshape(-1, 3, 3)
+    gripper_centers = np.broadcast_to(gripper_centers[:, :, None], (n, m, k, 3)).reshape(-1, 3)
+    gripper_extents = np.broadcast_to(extents[None, :, None], (n, m, k, 3)).reshape(-1, 3)
+    object_centers = np.array([get_aabb_center(aabb) for aabb in object_aabbs])
+    object_extents = np.array([get_aabb_extent(aabb) / 2 for aabb in object_aabbs])
+    object_centers = np.broadcast_to(object_centers[None, None], (n, m, k, 3)).reshape(-1, 3)
+    object_extents = np.broadcast_to(object_extents[None, None], (n, m, k, 3)).reshape(-1, 3)
+    object_rotations = np.broadcast_to(np.eye(3), (n * m * k, 3, 3))
+    overlaps = boxes_overlap(gripper_centers, gripper_rotations, gripper_extents,
+                             object_centers, object_rotations, object_extents, margin=margin)
+    return overlaps.reshape(n, m * k).any(axis=1)
+
+
 def check_cfree_gripper(grasp, world, body_pose, obstacles, verbose=False, visualize=False, body=None,
                         min_num_pts=40, retain_all=False, collisions=False, test_offset=False, **kwargs):
     robot = world.robot
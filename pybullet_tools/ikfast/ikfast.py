@@ -11,12 +11,14 @@ sys.path.append(PARENT_DIR)
 
 from itertools import islice, chain
 
-from .utils import compute_inverse_kinematics, compute_forward_kinematics
+from .utils import compute_inverse_kinematics, compute_forward_kinematics, compute_batch_inverse_kinematics, \
+    get_free_grid
 from ..utils import get_link_pose, link_from_name, multiply, invert, parent_joint_from_link, parent_link_from_joint, \
     prune_fixed_joints, joints_from_names, INF, get_difference_fn, \
     get_joint_positions, get_min_limits, get_max_limits, interval_generator, elapsed_time, randomize, violates_limits, \
     get_length, get_relative_pose, set_joint_positions, get_pose_distance, ConfSaver, \
-    sub_inverse_kinematics, set_configuration, wait_for_user, multiple_sub_inverse_kinematics, get_ordered_ancestors
+    sub_inverse_kinematics, set_configuration, wait_for_user, multiple_sub_inverse_kinematics, get_ordered_ancestors, \
+    is_circular, PI
 
 SETUP_FILENAME = 'setup.py'
 
@@ -168,9 +170,58 @@ def ikfast_inverse_kinematics(robot, ikfast_info, tool_link, world_from_target,
                 yield conf
 
 
+def sort_solutions(robot, joints, solutions, current_conf, norm=INF, max_distance=INF):
+    """ violates_limits, get_difference_fn and get_length over all rows of solutions at once,
+        returns the solutions within limits and max_distance, closest first """
+    circular = np.array([is_circular(robot, joint) for joint in joints], dtype=bool)
+    lower_limits = np.where(circular, -INF, get_min_limits(robot, joints))
+    upper_limits = np.where(circular, INF, get_max_limits(robot, joints))
+    solutions = solutions[np.all((lower_limits <= solutions) & (solutions <= upper_limits), axis=1)]
+    differences = solutions - np.array(current_conf)
+    differences[:, circular] = (differences[:, circular] + PI) % (2 * PI) - PI
+    distances = np.linalg.norm(differences, ord=norm, axis=1)
+    solutions, distances = solutions[distances <= max_distance], distances[distances <= max_distance]
+    order = np.argsort(distances, kind='stable')
+    return solutions[order], distances[order]
+
+
+def batch_inverse_kinematics(robot, ikfast_info, tool_link, world_from_target, fixed_joints=[],
+                             num_per_joint=10, norm=INF, max_distance=INF, **kwargs):
+    """ solves at a grid of free joint values (starting from the current ones) in one go
+        instead of sampling them one at a time like ikfast_inverse_kinematics,
+        returns an array of the solutions and their distances to the current conf, closest first """
+    if max_distance is None:
+        max_distance = INF
+    ikfast = import_ikfast(ikfast_info)
+    ik_joints = get_ik_joints(robot, ikfast_info, tool_link)
+    free_joints = joints_from_names(robot, ikfast_info.free_joints)
+    base_from_ee = get_base_from_ee(robot, ikfast_info, tool_link, world_from_target)
+    current_conf = get_joint_positions(robot, ik_joints)
+    current_positions = get_joint_positions(robot, free_joints)
+
+    free_deltas = np.array([0. if joint in fixed_joints else max_distance for joint in free_joints])
+    lower_limits = np.maximum(get_min_limits(robot, free_joints), current_positions - free_deltas)
+    upper_limits = np.minimum(get_max_limits(robot, free_joints), current_positions + free_deltas)
+    free_grid = get_free_grid(lower_limits, upper_limits, num_per_joint=num_per_joint,
+                              first_values=current_positions)
+    solutions = compute_batch_inverse_kinematics(ikfast.get_ik, base_from_ee, free_grid)
+    return sort_solutions(robot, ik_joints, solutions, current_conf, norm=norm, max_distance=max_distance)
+
+
 def closest_inverse_kinematics(robot, ikfast_info, tool_link, world_from_target,
-                               max_candidates=INF, norm=INF, verbose=True, **kwargs):
+                               max_candidates=INF, norm=INF, verbose=True, batch=False, **kwargs):
+    """ batch = solve over a grid of free joint values with batch_inverse_kinematics,
+        e.g. for pick streams that call ik hundreds of times per plan """
     start_time = time.time()
+    if batch:
+        solutions, distances = batch_inverse_kinematics(robot, ikfast_info, tool_link, world_from_target,
+                                                        norm=norm, **kwargs)
+        if max_candidates < INF:
+            solutions, distances = solutions[:max_candidates], distances[:max_candidates]
+        if verbose:
+            print('Identified {} IK solutions with minimum distance of {:.3f} in {:.3f} seconds'.format(
+                len(solutions), min([INF] + distances.tolist()), elapsed_time(start_time)))
+        return iter(map(tuple, solutions.tolist()))
     ik_joints = get_ik_joints(robot, ikfast_info, tool_link)
     current_conf = get_joint_positions(robot, ik_joints)
     generator = ikfast_inverse_kinematics(robot, ikfast_info, tool_link, world_from_target, norm=norm, **kwargs)
@@ -1,8 +1,10 @@
 import os.path
 import random
 
+import numpy as np
+
 from ..utils import get_ik_limits, compute_forward_kinematics, compute_inverse_kinematics, select_solution, \
-    USE_ALL, USE_CURRENT
+    USE_ALL, USE_CURRENT, get_free_grid, compute_batch_inverse_kinematics
 from ...pr2_utils import PR2_TOOL_FRAMES, get_torso_arm_joints, get_gripper_link, get_arm_joints, side_from_arm
 from ...utils import multiply, get_link_pose, link_from_name, get_joint_positions, \
     joint_from_name, invert, get_custom_limits, all_between, sub_inverse_kinematics, set_joint_positions, \
@@ -65,12 +67,15 @@ def is_ik_compiled():
     except ImportError:
         return False
 
-def get_ik_generator(robot, arm, ik_pose, torso_limits=USE_ALL, upper_limits=USE_ALL, custom_limits={}):
+def check_ik_compiled():
     if not is_ik_compiled():
         from . import setup
         script_path = os.path.abspath(setup.__file__)
         raise RuntimeError('Please compile IKFast for the PR2: (cd {}; python {})'.format(
             os.path.dirname(script_path), os.path.basename(script_path)))
+
+def get_ik_generator(robot, arm, ik_pose, torso_limits=USE_ALL, upper_limits=USE_ALL, custom_limits={}):
+    check_ik_compiled()
     from .ikLeft import leftIK
     from .ikRight import rightIK
     arm_ik = {'left': leftIK, 'right': rightIK}
@@ -91,6 +96,24 @@ def get_ik_generator(robot, arm, ik_pose, torso_limits=USE_ALL, upper_limits=USE
         if all(lower == upper for lower, upper in sampled_limits):
             break
 
+def get_batch_ik_solutions(robot, arm, ik_pose, torso_limits=USE_ALL, upper_limits=USE_ALL, custom_limits={},
+                           num_per_joint=10):
+    """ the solutions over a grid of torso and upper arm roll values as one array, within the custom limits """
+    check_ik_compiled()
+    from .ikLeft import leftIK
+    from .ikRight import rightIK
+    arm_ik = {'left': leftIK, 'right': rightIK}
+    world_from_base = get_link_pose(robot, link_from_name(robot, BASE_FRAME))
+    base_from_ik = multiply(invert(world_from_base), ik_pose)
+    sampled_joints = [joint_from_name(robot, name) for name in [TORSO_JOINT, UPPER_JOINT[arm]]]
+    sampled_limits = [get_ik_limits(robot, joint, limits) for joint, limits in zip(sampled_joints, [torso_limits, upper_limits])]
+    arm_joints = get_torso_arm_joints(robot, arm)
+
+    free_grid = get_free_grid(*zip(*sampled_limits), num_per_joint=num_per_joint)
+    solutions = compute_batch_inverse_kinematics(arm_ik[arm], base_from_ik, free_grid)
+    min_limits, max_limits = map(np.array, get_custom_limits(robot, arm_joints, custom_limits))
+    return solutions[np.all((min_limits <= solutions) & (solutions <= max_limits), axis=1)]
+
 def get_tool_from_ik(robot, arm):
     # TODO: change PR2_TOOL_FRAMES[arm] to be IK_LINK[arm]
     world_from_tool = get_link_pose(robot, link_from_name(robot, PR2_TOOL_FRAMES[arm]))
@@ -98,10 +121,22 @@ def get_tool_from_ik(robot, arm):
     return multiply(invert(world_from_tool), world_from_ik)
 
 
-def sample_tool_ik(robot, arm, tool_pose, nearby_conf=USE_ALL, max_attempts=25, **kwargs):
+def sample_tool_ik(robot, arm, tool_pose, nearby_conf=USE_ALL, max_attempts=25, batch=False, num_per_joint=10,
+                   **kwargs):
+    """ batch = solve over a grid of num_per_joint values of each free joint at once, instead of max_attempts samples """
     ik_pose = multiply(tool_pose, get_tool_from_ik(robot, arm))
-    generator = get_ik_generator(robot, arm, ik_pose, **kwargs)
     arm_joints = get_torso_arm_joints(robot, arm)
+    if batch:
+        solutions = get_batch_ik_solutions(robot, arm, ik_pose, num_per_joint=num_per_joint, **kwargs)
+        if len(solutions) == 0:
+            return None
+        if nearby_conf is USE_ALL:
+            return tuple(solutions[random.randrange(len(solutions))].tolist())
+        if nearby_conf is USE_CURRENT:
+            nearby_conf = get_joint_positions(robot, arm_joints)
+        return tuple(solutions[np.argmin(np.linalg.norm(solutions - np.array(nearby_conf), axis=1))].tolist())
+
+    generator = get_ik_generator(robot, arm, ik_pose, **kwargs)
     for _ in range(max_attempts):
         try:
             solutions = next(generator)
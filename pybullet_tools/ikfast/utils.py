@@ -3,7 +3,7 @@ from collections import namedtuple
 import numpy as np
 
 from ..utils import matrix_from_quat, point_from_pose, quat_from_pose, quat_from_matrix, \
-    get_joint_limits, get_joint_position, get_joint_positions, get_distance
+    get_joint_limits, get_joint_position, get_joint_positions, get_distance, profiled
 
 # TODO: lookup robot & tool in dictionary and use if exists
 
@@ -20,6 +20,7 @@ def compute_forward_kinematics(fk_fn, conf):
     return pos, quat
 
 
+@profiled('ik')
 def compute_inverse_kinematics(ik_fn, pose, sampled=[]):
     pos = point_from_pose(pose)
     rot = matrix_from_quat(quat_from_pose(pose)).tolist()
@@ -32,6 +33,29 @@ def compute_inverse_kinematics(ik_fn, pose, sampled=[]):
     return solutions
 
 
+def get_free_grid(lower_limits, upper_limits, num_per_joint=10, first_values=None):
+    """ all combinations of num_per_joint evenly spaced values of each free joint, as rows of an array """
+    axes = [np.array([lower]) if lower == upper else np.linspace(lower, upper, num=num_per_joint)
+            for lower, upper in zip(lower_limits, upper_limits)]
+    grid = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, len(axes))
+    if first_values is not None:
+        grid = np.vstack([first_values, grid])
+    return grid
+
+
+@profiled('ik')
+def compute_batch_inverse_kinematics(ik_fn, pose, free_grid):
+    """ the solutions at every row of free joint values, stacked into one (num_solutions, num_joints) array """
+    pos = list(point_from_pose(pose))
+    rot = matrix_from_quat(quat_from_pose(pose)).tolist()
+    solutions = []
+    for sampled in free_grid:
+        confs = ik_fn(rot, pos, list(sampled)) if len(sampled) > 0 else ik_fn(rot, pos)
+        if confs:
+            solutions.extend(confs)
+    return np.array(solutions, dtype=float).reshape(len(solutions), 6 + np.shape(free_grid)[1])
+
+
 def get_ik_limits(robot, joint, limits=USE_ALL):
     if limits is USE_ALL:
         return get_joint_limits(robot, joint)
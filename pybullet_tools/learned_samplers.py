@@ -1,10 +1,13 @@
 import json
 import pickle
+import random
+from contextlib import contextmanager
 from os.path import join, isdir, isfile
 from os import listdir
 from collections import defaultdict
 
 from world_builder.paths import DATABASES_PATH
+from pybullet_tools.database_utils import save_columnar_database
 
 
 pose_preds = {
@@ -37,8 +40,14 @@ def unpack(fact):
 
 
 def save_sampler_database(dic, name):
-    with open(join(DATABASES_PATH, f'{name}.pickle'), 'wb') as f:
+    pickle_path = join(DATABASES_PATH, f'{name}.pickle')
+    with open(pickle_path, 'wb') as f:
         pickle.dump(dic, f)
+    try:
+        save_columnar_database(dic, pickle_path, source=pickle_path)
+    except ValueError as e:
+        ## load_database() falls back to the pickle
+        print(f'save_sampler_database | skipping the columnar database of {name}: {e}')
 
 
 def summarize_reachability(time_json_files, prefix='nvidia_kitchen_'):
@@ -119,3 +128,116 @@ def summarize_reachability(time_json_files, prefix='nvidia_kitchen_'):
     # save_sampler_database(aopg_to_q, f"{prefix}aopg_to_q")
     save_sampler_database(aog_to_p_to_q, f"{prefix}aog_to_p_to_q")
     save_sampler_database(j_to_p, f"{prefix}j_to_p")
+
+
+## --------------------------------------------------------------------------------------------
+
+
+def get_world_pose_value(inputs):
+    """ the world pose of the grasped object or handle given the inputs of an ik stream """
+    from pybullet_tools.general_streams import linkpose_from_position
+    from pybullet_tools.utils import multiply
+    p = inputs[2]
+    if len(inputs) == 6:  ## (a, o1, rp1, o2, p2, g)
+        return multiply(inputs[4].value, p.value)
+    if 'pstn' in str(p):
+        return linkpose_from_position(p)
+    return p.value
+
+
+class OnlineReachability(object):
+    """ the base confs that solved ik for (arm, object, grasp) at world poses during planning,
+        appended to a json-lines file so later problems in the same scene can start from them,
+        objects are keyed by their names in world, so the file should be specific to the scene """
+
+    def __init__(self, path, world=None, max_distance=0.1):
+        self.path = path
+        self.lock_file = path + '.lock'
+        self.world = world
+        self.max_distance = max_distance
+        self.database = {}  ## (arm, object name, grasp): {pose: [(joints, bconf)]}
+        self.pose_arrays = {}  ## (arm, object name, grasp): (poses, np.array(poses))
+        if isfile(path):
+            with self.lock():
+                with open(path, 'r') as f:
+                    for line in f:
+                        self._add(json.loads(line))
+            print(f'OnlineReachability | loaded {len(self)} base confs from {path}')
+
+    @contextmanager
+    def lock(self, exclusive=False):
+        try:
+            import fcntl
+        except ImportError:  ## no file locking on Windows, only safe with one worker
+            yield
+            return
+        with open(self.lock_file, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get_object_name(self, obj):
+        """ body ids are reused by other objects in other scenes, names are not """
+        name = self.world.get_name(obj) if self.world is not None else None
+        return str(obj) if name is None else str(name)
+
+    def __len__(self):
+        return sum(len(bqs) for p_to_q in self.database.values() for bqs in p_to_q.values())
+
+    def _add(self, record):
+        from pybullet_tools.database_utils import tuple_from_list
+        key, pose, entry = [tuple_from_list(record[k]) for k in ['key', 'pose', 'bconf']]
+        p_to_q = self.database.setdefault(key, {})
+        if entry in p_to_q.get(pose, []):
+            return False
+        p_to_q.setdefault(pose, []).append(entry)
+        self.pose_arrays.pop(key, None)
+        return True
+
+    def add(self, arm, obj, pose_value, grasp, base_conf):
+        from pybullet_tools.bullet_utils import nice
+        record = dict(key=(arm, self.get_object_name(obj), nice(grasp.value)), pose=nice(pose_value),
+                      bconf=(tuple(base_conf.joints), nice(base_conf.values)))
+        if self._add(json.loads(json.dumps(record))):
+            with self.lock(exclusive=True):
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+
+    def get_bconfs(self, arm, obj, pose_value, grasp):
+        """ the saved base confs at the pose, or else at the nearest saved pose within max_distance """
+        import numpy as np
+        from pybullet_tools.bullet_utils import nice
+        key = (arm, self.get_object_name(obj), nice(grasp.value))
+        if key not in self.database:
+            return []
+        p_to_q = self.database[key]
+        pose = nice(pose_value)
+        if pose in p_to_q:
+            return p_to_q[pose]
+        if key not in self.pose_arrays:
+            poses = list(p_to_q.keys())
+            self.pose_arrays[key] = (poses, np.asarray(poses))
+        poses, pose_array = self.pose_arrays[key]
+        distances = np.max(np.abs(pose_array - np.asarray(pose)), axis=1)
+        index = np.argmin(distances)
+        if distances[index] < self.max_distance:
+            return p_to_q[poses[index]]
+        return []
+
+    def get_bconf_list_gen(self, fallback=None):
+        """ for World.learned_bconf_list_gen, falls back to the domain specific databases """
+        from pybullet_tools.pr2_primitives import Conf
+
+        def list_gen(world, inputs, num_samples=30, verbose=False):
+            a, o, g = inputs[0], inputs[1], inputs[-1]
+            bqs = self.get_bconfs(a, o, get_world_pose_value(inputs), g)
+            bqs = random.sample(bqs, min(num_samples, len(bqs)))
+            results = [Conf(world.robot.body, joints, bq) for joints, bq in bqs]
+            if verbose:
+                print(f'OnlineReachability | found {len(results)} base confs for {(a, o)}')
+            if fallback is not None and len(results) < num_samples:
+                results += fallback(world, inputs, num_samples=num_samples - len(results), verbose=verbose)
+            return results
+        return list_gen
@@ -1,11 +1,13 @@
 import json
 import zipfile
 import os
+import time
 from os.path import join, isfile, isdir, abspath, dirname, relpath
 from os import mkdir
 from datetime import datetime
 import csv
 import pprint
+from collections.abc import Iterator
 
 TXT_FILE = abspath('txt_file.txt')
 
@@ -203,6 +205,112 @@ def write_stream_statistics(externals, verbose=True):
         print('Wrote:', filename)
 
 
+STREAM_PROFILE_FIELDS = ['instances', 'calls', 'successes', 'outputs', 'time', 'collision_time', 'ik_time',
+                         'ik_solver_saved_time']
+
+
+class StreamProfiler(object):
+    """ wraps the functions of a stream_map to record per stream the number of instances (function calls),
+        calls (outputs requested by pddlstream), successes (calls with at least one output), outputs,
+        and the wall time, of which spent inside collision checks and inverse kinematics,
+        and the time saved by reusing pooled ik solvers instead of constructing them """
+
+    def __init__(self):
+        self.statistics = {}
+
+    def wrap_stream_map(self, stream_map):
+        from pybullet_tools.utils import set_profile_subroutines
+        set_profile_subroutines(True)
+        return {name: self.wrap_stream(name, fn) for name, fn in stream_map.items()}
+
+    def wrap_stream(self, name, fn):
+        if not callable(fn):
+            return fn
+
+        def wrapped_fn(*args, **kwargs):
+            result = self.record(name, fn, *args, **kwargs)
+            statistics = self.statistics[name]
+            statistics['instances'] += 1
+            if not isinstance(result, Iterator):  ## functions, e.g. MoveCost
+                statistics['calls'] += 1
+                statistics['successes'] += int(result is not None)
+                return result
+            generator = self.wrap_generator(name, result)
+            if hasattr(result, 'max_calls'):
+                ## keep the enumerated flag of from_fn, from_test and from_list_fn streams
+                from pddlstream.language.generator import BoundedGenerator
+                generator = BoundedGenerator(generator, max_calls=result.max_calls)
+            return generator
+        return wrapped_fn
+
+    def wrap_generator(self, name, generator):
+        while True:
+            try:
+                outputs = self.record(name, next, generator)
+            except StopIteration:
+                return
+            statistics = self.statistics[name]
+            statistics['calls'] += 1
+            if outputs:
+                statistics['successes'] += 1
+                statistics['outputs'] += len(outputs) if isinstance(outputs, list) else 1
+            yield outputs
+
+    def record(self, name, fn, *args, **kwargs):
+        from pybullet_tools.utils import PROFILED_TIMES
+        if name not in self.statistics:
+            self.statistics[name] = {k: 0 for k in STREAM_PROFILE_FIELDS}
+        statistics = self.statistics[name]
+        collision_time, ik_time = PROFILED_TIMES['collision'], PROFILED_TIMES['ik']
+        ik_solver_saved_time = PROFILED_TIMES['ik_solver_saved']
+        start_time = time.time()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            statistics['time'] += time.time() - start_time
+            statistics['collision_time'] += PROFILED_TIMES['collision'] - collision_time
+            statistics['ik_time'] += PROFILED_TIMES['ik'] - ik_time
+            statistics['ik_solver_saved_time'] += PROFILED_TIMES['ik_solver_saved'] - ik_solver_saved_time
+
+    def get_rows(self):
+        """ streams sorted by the total time spent in them """
+        rows = []
+        for name, statistics in sorted(self.statistics.items(), key=lambda x: x[1]['time'], reverse=True):
+            row = {'stream': name}
+            row.update({k: round(v, 4) for k, v in statistics.items()})
+            rows.append(row)
+        return rows
+
+    def dump(self, output_dir, name='stream_profile', verbose=True):
+        """ save stream_profile.json and stream_profile.csv in the run directory, next to planning_config.json """
+        rows = self.get_rows()
+        with open(join(output_dir, f'{name}.json'), 'w') as f:
+            json.dump(rows, f, indent=4)
+        with open(join(output_dir, f'{name}.csv'), mode='w') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=['stream'] + STREAM_PROFILE_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+        if verbose:
+            from tabulate import tabulate
+            print(f'\n[STREAM PROFILE] ({output_dir})')
+            print(tabulate([list(row.values()) for row in rows],
+                           headers=['stream'] + STREAM_PROFILE_FIELDS, tablefmt='orgtbl'))
+
+
+def merge_stream_profiles(json_files):
+    """ sum up the stream_profile.json of many runs to find the samplers that dominate planning time """
+    statistics = {}
+    for json_file in json_files:
+        for row in json.load(open(json_file, 'r')):
+            if row['stream'] not in statistics:
+                statistics[row['stream']] = {k: 0 for k in STREAM_PROFILE_FIELDS}
+            for k in STREAM_PROFILE_FIELDS:
+                statistics[row['stream']][k] += row.get(k, 0)
+    profiler = StreamProfiler()
+    profiler.statistics = statistics
+    return profiler
+
+
 def dump_json(db, db_file, indent=2, width=160, sort_dicts=True, **kwargs):
     """ don't break lines for list elements """
     with open(db_file, 'w') as f:
@@ -1,5 +1,7 @@
 from __future__ import print_function
 
+import time
+
 from pybullet_tools.utils import invert, get_all_links, get_name, set_pose, get_link_pose, is_placement, \
     pairwise_collision, set_joint_positions, get_joint_positions, sample_placement, get_pose, waypoints_from_path, \
     unit_quat, plan_base_motion, plan_joint_motion, base_values_from_pose, pose_from_base_values, \
@@ -15,12 +17,14 @@ from pybullet_tools.ikfast.pr2.ik import pr2_inverse_kinematics
 from pybullet_tools.ikfast.utils import USE_CURRENT
 from pybullet_tools.pr2_primitives import Conf, Commands, create_trajectory, State, Trajectory
 from pybullet_tools.pr2_streams import DEFAULT_RESOLUTION
-from pybullet_tools.pr2_utils import open_arm, arm_conf, learned_pose_generator
+from pybullet_tools.pr2_utils import open_arm, arm_conf, learned_pose_generator, learned_pose_generator_vectorized
 from pybullet_tools.general_streams import *
 from pybullet_tools.pose_utils import bconf_to_pose, pose_to_bconf, add_pose, sample_new_bconf
 from pybullet_tools.grasp_utils import add_to_rc2oc
 from pybullet_tools.logging_utils import print_debug, print_blue
 
+from robot_builder.robot_utils import is_reachable_in_workspace
+
 
 def get_ir_sampler(problem, custom_limits={}, max_attempts=40, collisions=True,
                    learned=True, verbose=False, visualize=False):
@@ -67,13 +71,16 @@ def get_ir_sampler(problem, custom_limits={}, max_attempts=40, collisions=True,
         default_conf = robot.get_carry_conf(arm, grasp.grasp_type, grasp.value)
         arm_joints = robot.get_arm_joints(arm)
         base_joints = robot.get_base_joints()
+        lower_limits, upper_limits = get_custom_limits(robot, base_joints, custom_limits)
         if learned:
+            ## candidates outside the (x, y, theta) limits or overlapping fixed obstacles are dropped beforehand
             grasp_type = 'top' if grasp.grasp_type == 'hand' else grasp.grasp_type
-            base_generator = learned_pose_generator(robot, gripper_pose, arm=arm, grasp_type=grasp_type)
+            base_limits = (np.array(lower_limits)[[0, 1, -1]], np.array(upper_limits)[[0, 1, -1]])
+            base_generator = learned_pose_generator_vectorized(robot, gripper_pose, arm=arm, grasp_type=grasp_type,
+                                                               base_limits=base_limits, obstacles=obstacles)
         else:
             base_generator = uniform_pose_generator(robot, gripper_pose)
 
-        lower_limits, upper_limits = get_custom_limits(robot, base_joints, custom_limits)
         aconf = nice(get_joint_positions(robot, arm_joints))
         while True:
             count = 0
@@ -195,7 +202,8 @@ def get_ik_rel_fn_old(problem, custom_limits={}, collisions=True, teleport=False
 
 
 def get_ik_pull_gen(problem, max_attempts=80, num_intervals=30, collisions=True, learned=True, teleport=False,
-                    ir_only=False, soft_failures=False, verbose=False, visualize=False, ACONF=False, **kwargs):
+                    ir_only=False, soft_failures=False, verbose=False, visualize=False, ACONF=False,
+                    num_ik_workers=0, num_ik_results=1, **kwargs):
     """ the one func that combines all """
     ## not using this if tracik compiled
     ir_sampler = get_ir_sampler(problem, collisions=collisions, learned=learned,
@@ -224,7 +232,9 @@ def get_ik_pull_gen(problem, max_attempts=80, num_intervals=30, collisions=True,
         inputs = a, o, pst1, g
         results = sample_bconf(world, robot, inputs, pose_value, obstacles, heading,
             ir_sampler=ir_sampler, ik_fn=ik_fn, ir_max_attempts=max_attempts, ir_only=ir_only,
-            verbose=verbose, visualize=visualize, soft_failures=soft_failures, learned=learned)
+            verbose=verbose, visualize=visualize, soft_failures=soft_failures, learned=learned,
+            collision_cache=getattr(problem, 'collision_cache', None), num_ik_workers=num_ik_workers,
+            num_ik_results=num_ik_results)
         for (bq1, aq1, at) in results:
             inputs = a, o, pst1, pst2, g, bq1, aq1
             result = compute_pull_door_arm_motion(inputs, world, robot, obstacles, ignored_pairs, saver,
@@ -253,7 +263,8 @@ def get_ik_pull_gen(problem, max_attempts=80, num_intervals=30, collisions=True,
 
 
 def get_ik_pull_with_link_gen(problem, max_attempts=80, num_intervals=30, collisions=True, learned=True, teleport=False,
-                              ir_only=False, soft_failures=False, verbose=False, visualize=False, ACONF=False, **kwargs):
+                              ir_only=False, soft_failures=False, verbose=False, visualize=False, ACONF=False,
+                              num_ik_workers=0, num_ik_results=1, **kwargs):
     """ the one func that combines all """
     ## not using this if tracik compiled
     ir_sampler = get_ir_sampler(problem, collisions=collisions, learned=learned,
@@ -283,7 +294,9 @@ def get_ik_pull_with_link_gen(problem, max_attempts=80, num_intervals=30, collis
         inputs = a, o, pst1, g
         results = sample_bconf(world, robot, inputs, pose_value, obstacles, heading,
             ir_sampler=ir_sampler, ik_fn=ik_fn, ir_max_attempts=max_attempts, ir_only=ir_only,
-            verbose=verbose, visualize=visualize, soft_failures=soft_failures, learned=learned)
+            verbose=verbose, visualize=visualize, soft_failures=soft_failures, learned=learned,
+            collision_cache=getattr(problem, 'collision_cache', None), num_ik_workers=num_ik_workers,
+            num_ik_results=num_ik_results)
         for (bq1, aq1, at) in results:
             inputs = a, o, pst1, pst2, g, bq1, aq1
             result = compute_pull_door_arm_motion(inputs, world, robot, obstacles, ignored_pairs, saver,
@@ -317,7 +330,8 @@ def get_ik_pull_with_link_gen(problem, max_attempts=80, num_intervals=30, collis
 
 
 def get_ik_gen_old(problem, max_attempts=80, collisions=True, learned=True, teleport=False, ir_only=False,
-                   soft_failures=False, verbose=False, visualize=False, ACONF=False, **kwargs):
+                   soft_failures=False, verbose=False, visualize=False, ACONF=False,
+                   num_ik_workers=0, num_ik_results=1, **kwargs):
     """ given grasp of target object at relative pose rp with regard to supporter at p2, return base conf and arm traj """
     ## not using this if tracik compiled
     ir_sampler = get_ir_sampler(problem, collisions=collisions, learned=learned,
@@ -343,13 +357,16 @@ def get_ik_gen_old(problem, max_attempts=80, collisions=True, learned=True, tele
         return sample_bconf(
             world, robot, inputs, pose_value, obstacles, heading, ir_sampler=ir_sampler, ik_fn=ik_fn,
             verbose=verbose, visualize=visualize, soft_failures=soft_failures, learned=learned,
-            ir_max_attempts=max_attempts, ir_only=ir_only)
+            ir_max_attempts=max_attempts, ir_only=ir_only,
+            collision_cache=getattr(problem, 'collision_cache', None), num_ik_workers=num_ik_workers,
+            num_ik_results=num_ik_results)
 
     return gen
 
 
 def get_ik_rel_gen_old(problem, max_attempts=30, collisions=True, learned=True, teleport=False, ir_only=False,
-                       soft_failures=False, verbose=False, visualize=False, ACONF=False, **kwargs):
+                       soft_failures=False, verbose=False, visualize=False, ACONF=False,
+                       num_ik_workers=0, num_ik_results=1, **kwargs):
     """ given grasp of target object at relative pose rp with regard to supporter at p2, return base conf and arm traj """
     ## not using this if tracik compiled
     ir_sampler = get_ir_sampler(problem, collisions=collisions, learned=learned,
@@ -370,7 +387,9 @@ def get_ik_rel_gen_old(problem, max_attempts=30, collisions=True, learned=True,
         inputs = a, o1, rp1, o2, p2, g
         return sample_bconf(world, robot, inputs, pose_value, obstacles, heading, ir_sampler=ir_sampler, ik_fn=ik_fn,
                             verbose=verbose, visualize=visualize, soft_failures=soft_failures, learned=learned,
-                            ir_max_attempts=max_attempts, ir_only=ir_only)
+                            ir_max_attempts=max_attempts, ir_only=ir_only,
+                            collision_cache=getattr(problem, 'collision_cache', None), num_ik_workers=num_ik_workers,
+                            num_ik_results=num_ik_results)
 
     return gen
 
@@ -408,9 +427,96 @@ def process_ik_context(context, verbose=False):
             raise ValueError(stream.name)
 
 
+PARALLEL_IK_ARGS = None  ## (ik_fn, inputs, candidates, seed) inherited by the forked workers
+
+
+def run_ik_candidate(ik_fn, inputs, ir_outputs, seed):
+    """ with the random seeds of the candidate, which makes its result in a worker likely, but not certain,
+        to be reproduced in the parent, since TracIK has its own random restarts and a time limit """
+    random_state, numpy_state = random.getstate(), np.random.get_state()
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+    try:
+        return ik_fn(*(inputs + ir_outputs))
+    finally:
+        random.setstate(random_state)
+        np.random.set_state(numpy_state)
+
+
+def _evaluate_ik_candidate(index):
+    """ returns the traceback of an exception instead of the result, to be raised again in the parent """
+    import traceback
+    ik_fn, inputs, candidates, seed = PARALLEL_IK_ARGS
+    try:
+        return index, run_ik_candidate(ik_fn, inputs, candidates[index], seed + index) is not None
+    except Exception:
+        return index, traceback.format_exc()
+
+
+def evaluate_ik_candidates(ik_fn, inputs, candidates, num_workers=4, num_results=1, seed=0):
+    """ screens the base conf candidates with ik_fn in forked worker processes, each with a copy of the DIRECT
+        client and the world as it is now. returns the indices of the first num_results candidates that succeeded
+        and of all the candidates evaluated, the workers still evaluating the others are terminated
+        when the pool exits """
+    import multiprocessing
+    global PARALLEL_IK_ARGS
+    PARALLEL_IK_ARGS = (ik_fn, inputs, candidates, seed)
+    found = []
+    evaluated = set()
+    try:
+        with multiprocessing.get_context('fork').Pool(processes=num_workers) as pool:
+            for index, success in pool.imap_unordered(_evaluate_ik_candidate, range(len(candidates))):
+                if isinstance(success, str):
+                    raise RuntimeError(f'evaluate_ik_candidates | ik_fn failed on candidate {index} '
+                                       f'in a worker process:\n{success}')
+                evaluated.add(index)
+                if success:
+                    found.append(index)
+                    if len(found) >= num_results:
+                        break
+    finally:
+        PARALLEL_IK_ARGS = None
+    return found, evaluated
+
+
+def sample_bconf_parallel(inputs, candidates, ik_fn, num_workers=4, num_results=1, verbose=False):
+    """ the trajectories and attachments of ik_fn refer to the robot of this process,
+        so the winning candidates of the workers are solved again here, with the same random seeds.
+        afterwards, the candidates that the workers didn't get to are tried here one by one, like in the serial loop,
+        which also covers the winners that fail when solved again """
+    seed = random.randrange(2**31)
+    start_time = time.time()
+    found, evaluated = evaluate_ik_candidates(ik_fn, inputs, candidates, num_workers=num_workers,
+                                              num_results=num_results, seed=seed)
+    if verbose:
+        print(f'sample_bconf_parallel | {len(found)} of {len(candidates)} candidates succeeded '
+              f'with {num_workers} workers in {time.time() - start_time:.2f} sec')
+    num_yielded = 0
+    for index in found:
+        ik_outputs = run_ik_candidate(ik_fn, inputs, candidates[index], seed + index)
+        if ik_outputs is not None:
+            num_yielded += 1
+            yield candidates[index] + ik_outputs
+        elif verbose:
+            print(f'sample_bconf_parallel | candidate {index} failed when solved again')
+    for index, ir_outputs in enumerate(candidates):
+        if index in evaluated:
+            continue
+        ik_outputs = ik_fn(*(inputs + ir_outputs))
+        if ik_outputs is not None:
+            num_yielded += 1
+            yield ir_outputs + ik_outputs
+    if verbose:
+        print(f'sample_bconf_parallel | yielded {num_yielded} of {len(candidates)} candidates')
+
+
 def sample_bconf(world, robot, inputs, pose_value, obstacles, heading,
                  ir_sampler=None, ik_fn=None, ir_only=False, learned=False,
-                 ir_max_attempts=40, soft_failures=False, verbose=False, visualize=False):
+                 ir_max_attempts=40, soft_failures=False, verbose=False, visualize=False, collision_cache=None,
+                 num_ik_workers=0, num_ik_results=1):
+    """ num_ik_workers > 1 = evaluate ik_fn on the learned or ir sampled base confs in parallel processes
+            (when there is no gui) until num_ik_results succeed, which are yielded first,
+            then the rest of the base confs are tried in this process """
     a, o = inputs[:2]
     g = inputs[-1]
     robot.open_arm(a)
@@ -418,7 +524,7 @@ def sample_bconf(world, robot, inputs, pose_value, obstacles, heading,
 
     context_saver = WorldSaver(bodies=[robot, o])
     title = f'\t\tsample_bconf({o}, learned={learned}) | start sampling '
-    col_kwargs = dict(articulated=True, verbose=False, world=world, min_num_pts=0)
+    col_kwargs = dict(articulated=True, verbose=False, world=world, min_num_pts=0, cache=collision_cache)
 
     # set_renderer(enable=False)  ## TODO: debug
     if visualize:
@@ -427,7 +533,7 @@ def sample_bconf(world, robot, inputs, pose_value, obstacles, heading,
 
     ## ----------- identifying collisions, but with this opening joint then picking won't work ------
     gripper_grasp = robot.set_gripper_pose(pose_value, g.value, arm=a, body=g.body)
-    if collided(gripper_grasp, obstacles, articulated=False, world=world, tag='ir.gripper'):
+    if collided(gripper_grasp, obstacles, articulated=False, world=world, tag='ir.gripper', cache=collision_cache):
         pass
         # if verbose:
         #     print(f'{heading} -------------- grasp {nice(g.value)} is in collision, continue anyway')
@@ -437,9 +543,22 @@ def sample_bconf(world, robot, inputs, pose_value, obstacles, heading,
     arm_joints = robot.get_arm_joints(a)
     default_conf = robot.get_carry_conf(a, g.grasp_type, g.value)
 
+    parallel = num_ik_workers > 1 and not ir_only and not has_gui()
+
+    ## skip the base confs from which the grasp is outside the precomputed workspace of the arm
+    grasp_pose = robot.get_grasp_pose(pose_value, g.value, a, body=g.body)
+
+    def reachable(bq):
+        return is_reachable_in_workspace(robot, a, grasp_pose, bq) is not False
+
     ## use domain specific bconf databases
     if learned and world.learned_bconf_list_gen is not None:
-        results = world.learned_bconf_list_gen(world, inputs, num_samples=ir_max_attempts)
+        results = [bq for bq in world.learned_bconf_list_gen(world, inputs, num_samples=ir_max_attempts)
+                   if reachable(bq)]
+        if parallel and len(results) > 0:
+            yield from sample_bconf_parallel(inputs, [(bq,) for bq in results], ik_fn, num_workers=num_ik_workers,
+                                             num_results=num_ik_results, verbose=verbose)
+            results = []
         searched = False
         for bq in results:
             searched = True
@@ -543,6 +662,18 @@ def sample_bconf(world, robot, inputs, pose_value, obstacles, heading,
             print(f'sample_bconf\tIKSolver somehow stopped generating after {attempts} attempts')
 
     ## do ir sampling of x, y, theta, torso, then solve ik for arm
+    elif parallel:
+        while True:
+            candidates = [ir_outputs for ir_outputs in islice(ir_sampler(*inputs), ir_max_attempts)
+                          if ir_outputs is not None and reachable(ir_outputs[0])]
+            yield from sample_bconf_parallel(inputs, candidates, ik_fn, num_workers=num_ik_workers,
+                                             num_results=num_ik_results, verbose=verbose)
+            print(f'{heading} exceeding ir_max_attempts = {ir_max_attempts}')
+            if not soft_failures:
+                return
+            yield None
+            context_saver.restore()
+
     else:
         ir_generator = ir_sampler(*inputs)
         attempts = 0
@@ -563,7 +694,7 @@ def sample_bconf(world, robot, inputs, pose_value, obstacles, heading,
                 print(f'{heading} exceeding ir_generator ir_max_attempts = {ir_max_attempts}')
                 return
 
-            if ir_outputs is None:
+            if ir_outputs is None or not reachable(ir_outputs[0]):
                 continue
             inp = ir_generator.gi_frame.f_locals
             inp = [inp[k] for k in ['pose', 'grasp', 'custom_limits']]
@@ -670,7 +801,7 @@ def solve_approach_ik(arm, obj, pose_value, grasp, base_conf,
         tool_link = robot.get_tool_link(arm)
         tool_pose = robot.get_tool_pose_for_ik(arm, approach_pose)
         ik_solver = IKSolver(robot.body, tool_link=tool_link, first_joint=arm_joints[0],
-                             custom_limits=custom_limits)  # TODO: cache
+                             custom_limits=custom_limits)  ## the TracIKSolver is pooled
         approach_conf = ik_solver.solve(tool_pose, seed_conf=grasp_conf)
 
     if not has_tracik() or approach_conf is None:
@@ -787,6 +918,12 @@ def solve_approach_ik(arm, obj, pose_value, grasp, base_conf,
 
     if visualize:
         remove_body(gripper_grasp)
+
+    ## remember the base conf for later problems, see World.enable_online_reachability()
+    online_reachability = getattr(world, 'online_reachability', None)
+    if online_reachability is not None:
+        online_reachability.add(arm, obj, pose_value, grasp, base_conf)
+
     if ACONF:
         return (mt.path[-1], cmd)
     return (cmd,)
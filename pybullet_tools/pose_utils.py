@@ -33,7 +33,7 @@ from pybullet_tools.utils import unit_pose, get_collision_data, get_links, pairw
     dimensions_from_camera_matrix, get_field_of_view, get_image, timeout, unit_point, get_joint_limits, ConfSaver, \
     BROWN, BLUE, WHITE, TAN, GREY, YELLOW, GREEN, BLACK, RED, tform_point, create_shape, STATIC_MASS, \
     quat_from_euler, euler_from_quat, get_aabb_center, get_aabb, get_pose, \
-    set_pose, wait_for_user
+    set_pose, wait_for_user, get_footprints, get_footprint_index, get_footprint_yaws
 from pybullet_tools.camera_utils import set_camera_target_body
 from pybullet_tools.bullet_utils import draw_fitted_box, draw_points, nice, nice_tuple, nice_float, \
     in_list, equal
@@ -417,6 +417,14 @@ OBJ_YAWS = {
 
 def sample_pose(obj, aabb, obj_aabb=None, yaws=OBJ_YAWS):
     ## sample a pose in aabb that can fit an object in
+    ## use pre-defined yaws for appliances like microwave
+    yaw = yaws[obj] if obj in yaws else np.random.uniform(0, PI)
+    if obj_aabb is not None and isinstance(obj, int):
+        ## the extent of obj rotated by the sampled yaw instead of by its current one
+        index = get_footprint_index(yaw)
+        yaw = get_footprint_yaws()[index]
+        obj_aabb = get_footprints(obj)[index]
+
     if obj_aabb is not None:
         ori = aabb
         lower, upper = obj_aabb
@@ -443,14 +451,108 @@ def sample_pose(obj, aabb, obj_aabb=None, yaws=OBJ_YAWS):
         # print('bullet_utils.sample_pose\t!adjusted z to be lower')
 
     x, y, z = sample_aabb(aabb)
+    return x, y, z, yaw
 
-    ## use pre-defined yaws for appliances like microwave
-    if obj in yaws:
-        yaw = yaws[obj]
-    else:
-        yaw = np.random.uniform(0, PI)
 
-    return x, y, z, yaw
+FREE_SPACE_RESOLUTION = 0.02
+
+
+def get_footprint(body, yaw=0):
+    """ xy extent of the aabb of body rotated by the discretized yaw closest to yaw,
+        the xy offset of its center from the body origin, and the height of the body origin above its bottom """
+    footprint = get_footprints(body)[get_footprint_index(yaw)]
+    return get_aabb_extent(footprint)[:2], get_aabb_center(footprint)[:2], -footprint.lower[2]
+
+
+class FreeSpaceMap(object):
+    """ rasterized xy occupancy of a Surface or Space by the aabbs of the objects it supports,
+        counts the footprints covering each cell so that objects can be removed incrementally """
+
+    def __init__(self, aabb, resolution=FREE_SPACE_RESOLUTION, buffer=0.01):
+        self.aabb = aabb
+        self.resolution = resolution
+        self.buffer = buffer
+        self.lower = np.array(aabb.lower[:2])
+        shape = np.maximum(np.floor(np.array(get_aabb_extent(aabb)[:2]) / resolution), 1).astype(int)
+        self.occupied = np.zeros(shape, dtype=int)
+        self.footprints = {}  ## body: (aabb, cell ranges)
+
+    def get_cells(self, aabb):
+        lower = np.floor((np.array(aabb.lower[:2]) - self.buffer - self.lower) / self.resolution)
+        upper = np.ceil((np.array(aabb.upper[:2]) + self.buffer - self.lower) / self.resolution)
+        lower = np.clip(lower, 0, self.occupied.shape).astype(int)
+        upper = np.clip(upper, 0, self.occupied.shape).astype(int)
+        return tuple(lower), tuple(upper)
+
+    def add(self, body, aabb=None):
+        if body in self.footprints:
+            self.remove(body)
+        if aabb is None:
+            aabb = get_aabb(body)
+        (i1, j1), (i2, j2) = cells = self.get_cells(aabb)
+        self.occupied[i1:i2, j1:j2] += 1
+        self.footprints[body] = (aabb, cells)
+
+    def remove(self, body):
+        if body not in self.footprints:
+            return
+        _, ((i1, j1), (i2, j2)) = self.footprints.pop(body)
+        self.occupied[i1:i2, j1:j2] -= 1
+
+    def update(self, bodies):
+        """ only rasterizes again the bodies that were added, moved or removed since the last update """
+        bodies = set(bodies)
+        for body in list(self.footprints):
+            if body not in bodies:
+                self.remove(body)
+        for body in bodies:
+            aabb = get_aabb(body)
+            if body not in self.footprints or not np.allclose(self.footprints[body][0], aabb, atol=1e-3):
+                self.add(body, aabb)
+
+    def get_free_cells(self, footprint):
+        """ the lower cells of the windows of cells that fit footprint without touching an occupied cell """
+        size = np.ceil(np.array(footprint) / self.resolution).astype(int)
+        if np.any(size > self.occupied.shape):
+            return np.zeros((0, 2), dtype=int), size
+        integral = np.zeros(np.array(self.occupied.shape) + 1, dtype=int)
+        integral[1:, 1:] = np.cumsum(np.cumsum(self.occupied > 0, axis=0), axis=1)
+        kx, ky = size
+        counts = integral[kx:, ky:] - integral[:-kx, ky:] - integral[kx:, :-ky] + integral[:-kx, :-ky]
+        return np.argwhere(counts == 0), size
+
+    def sample(self, footprint):
+        """ the center of a random free window for footprint, jittered within the slack of the window """
+        cells, size = self.get_free_cells(footprint)
+        if len(cells) == 0:
+            return None
+        cell = cells[np.random.randint(len(cells))]
+        slack = size * self.resolution - np.array(footprint)
+        return self.lower + (cell + size / 2.) * self.resolution + np.random.uniform(-slack / 2, slack / 2)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.occupied.shape}, {len(self.footprints)} objects, ' \
+               f'{np.mean(self.occupied == 0):.0%} free)'
+
+
+def sample_free_space_placement(body, free_space_map, yaws=None, max_attempts=10, on_top=True, epsilon=1e-3):
+    """ samples x, y, z, yaw of body resting on (on_top=True) or at the bottom of the aabb of the map,
+        random yaws are tried first, then the axis-aligned ones that have the smallest footprints in narrow gaps """
+    if yaws is None:
+        yaws = list(np.random.uniform(0, PI, size=max(max_attempts - 2, 0))) + [0, PI / 2]
+    else:
+        yaws = random.sample(yaws, min(len(yaws), max_attempts))
+    for yaw in yaws:
+        yaw = get_footprint_yaws()[get_footprint_index(yaw)]
+        footprint, offset, z_offset = get_footprint(body, yaw)
+        center = free_space_map.sample(footprint)
+        if center is None:
+            continue
+        x, y = center - np.array(offset)
+        aabb = free_space_map.aabb
+        z = (aabb.upper[2] + epsilon if on_top else aabb.lower[2] + 0.01) + z_offset
+        return x, y, z, yaw
+    return None
 
 
 def sample_obj_on_body_link_surface(obj, body, link, PLACEMENT_ONLY=False, max_trial=3, verbose=False):
@@ -863,11 +863,13 @@ def get_pose_in_region_gen(problem, collisions=True, max_attempts=40, verbose=Fa
 ##################################################
 
 
-def get_base_motion_gen(problem, custom_limits={}, collisions=True, teleport=False, debug=False):
+def get_base_motion_gen(problem, custom_limits={}, collisions=True, teleport=False, debug=False, use_roadmap=False):
+    """ use_roadmap: first search the PRM of the fixed obstacles stored on the world, shared across replans """
     robot = problem.robot
     saver = BodySaver(robot)
     obstacles = problem.fixed if collisions else []
     ignored_pairs = problem.world.ignored_pairs
+    use_roadmap &= collisions and hasattr(problem.world, 'get_roadmap')
 
     def fn(bq1, bq2, fluents=[]):
         obstacles_here = copy.deepcopy(obstacles)
@@ -900,6 +902,11 @@ def get_base_motion_gen(problem, custom_limits={}, collisions=True, teleport=Fal
         # default_conf = arm_conf(arm, grasp.carry)
         # set_joint_positions(robot, arm_joints, default_conf)
 
+        roadmap = None
+        if use_roadmap:
+            with BodySaver(robot):
+                roadmap = problem.world.get_roadmap(robot, bq2.joints, custom_limits=custom_limits)
+
         params = [(4, 75)] ## (4, 50), (10, 100)
         num_trials = len(params)  ## sometimes it can't find a path to get around the open door
         while num_trials > 0:
@@ -909,7 +916,7 @@ def get_base_motion_gen(problem, custom_limits={}, collisions=True, teleport=Fal
                                          custom_limits=custom_limits, resolutions=None, # TODO: base resolutions
                                          use_aabb=True, cache=True,
                                          restarts=param[0], iterations=param[1], smooth=50,
-                                         ignored_pairs=ignored_pairs_here
+                                         ignored_pairs=ignored_pairs_here, roadmap=roadmap
                                          ) # smooth=50
                                          # restarts=4, iterations=50, smooth=50)
             # break
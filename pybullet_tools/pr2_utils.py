@@ -8,8 +8,9 @@ from itertools import combinations
 import numpy as np
 
 from .pr2_never_collisions import NEVER_COLLISIONS
+from .database_utils import has_columnar_database, load_columnar_database
 from .utils import multiply, get_link_pose, set_joint_position, set_joint_positions, get_joint_positions, get_min_limit, get_max_limit, quat_from_euler, read_pickle, set_pose, \
-    get_pose, euler_from_quat, link_from_name, point_from_pose, invert, Pose, \
+    get_pose, euler_from_quat, link_from_name, point_from_pose, invert, Pose, matrix_from_quat, get_aabbs, \
     unit_pose, joints_from_names, PoseSaver, get_aabb, get_joint_limits, ConfSaver, get_bodies, create_mesh, remove_body, \
     unit_from_theta, violates_limit, violates_limits, add_line, get_body_name, get_num_joints, approximate_as_cylinder, \
     approximate_as_prism, unit_quat, unit_point, angle_between, quat_from_pose, compute_jacobian, \
@@ -462,7 +463,11 @@ def load_inverse_reachability(arm, grasp_type):
     if key not in IR_CACHE:
         filename = IR_FILENAME.format(grasp_type, arm)
         path = get_database_file(filename)
-        IR_CACHE[key] = read_pickle(path)['gripper_from_base']
+        if has_columnar_database(path):
+            IR_CACHE[key] = [(tuple(row[:3]), tuple(row[3:])) for row in
+                             load_columnar_database(path)['gripper_from_base']]
+        else:
+            IR_CACHE[key] = read_pickle(path)['gripper_from_base']
     return IR_CACHE[key]
 
 
@@ -488,6 +493,81 @@ def learned_pose_generator(robot, gripper_pose, arm, grasp_type):
         #yield get_pose(robot)
         yield base_values
 
+
+IR_ARRAY_CACHE = {}
+IR_BASE_HEIGHT = 0.35
+
+
+def load_inverse_reachability_arrays(arm, grasp_type):
+    """ the inverse reachability database stacked as (N, 3) points and (N, 4) quats of gripper_from_base """
+    key = (arm, grasp_type)
+    if key not in IR_ARRAY_CACHE:
+        path = get_database_file(IR_FILENAME.format(grasp_type, arm))
+        if has_columnar_database(path):
+            gripper_from_base = load_columnar_database(path).get_array('gripper_from_base')
+            IR_ARRAY_CACHE[key] = (gripper_from_base[:, :3], gripper_from_base[:, 3:])
+        else:
+            points, quats = zip(*load_inverse_reachability(arm, grasp_type))
+            IR_ARRAY_CACHE[key] = (np.array(points), np.array(quats))
+    return IR_ARRAY_CACHE[key]
+
+
+def multiply_quats(quat, quats):
+    """ quat * quats for (N, 4) quats in [X,Y,Z,W] order """
+    x1, y1, z1, w1 = quat
+    x2, y2, z2, w2 = quats.T
+    return np.stack([w1*x2 + x1*w2 + y1*z2 - z1*y2,
+                     w1*y2 - x1*z2 + y1*w2 + z1*x2,
+                     w1*z2 + x1*y2 - y1*x2 + z1*w2,
+                     w1*w2 - x1*x2 - y1*y2 - z1*z2], axis=1)
+
+
+def yaws_from_quats(quats):
+    """ the yaw of euler_from_quat for each of the (N, 4) quats, also at gimbal lock where it is wrapped to [-PI, PI) """
+    x, y, z, w = quats.T
+    sarg = -2 * (x*z - w*y)
+    yaws = np.arctan2(2 * (x*y + w*z), w*w + x*x - y*y - z*z)
+    yaws = np.where(sarg <= -0.99999, 2 * np.arctan2(x, -y), yaws)
+    yaws = np.where(sarg >= 0.99999, 2 * np.arctan2(-x, y), yaws)
+    return np.mod(yaws + PI, 2 * PI) - PI
+
+
+def get_base_occupancy_boxes(obstacles, max_height=IR_BASE_HEIGHT, min_height=0.01):
+    """ the 2D AABBs, shape (M, 2, 2), of the links of obstacles that the base can't drive under or over """
+    boxes = [(lower[:2], upper[:2]) for body in obstacles for lower, upper in get_aabbs(body)
+             if lower[2] < max_height and upper[2] > min_height]
+    return np.array(boxes).reshape(-1, 2, 2)
+
+
+def learned_pose_generator_vectorized(robot, gripper_pose, arm, grasp_type, base_limits=None,
+                                      obstacles=[], base_radius=None):
+    """ same as learned_pose_generator, but composes all database entries with gripper_pose at once,
+        then drops the base values outside base_limits = (lower, upper) over (x, y) or (x, y, theta)
+        and those whose base footprint overlaps the fixed obstacles before shuffling them,
+        base_radius defaults to robot.base_radius, the occupancy test is skipped if neither is given """
+    if base_radius is None:
+        base_radius = getattr(robot, 'base_radius', None)
+    gripper_point, gripper_quat = gripper_pose
+    points, quats = load_inverse_reachability_arrays(arm, grasp_type)
+    base_points = np.array(gripper_point) + np.dot(points, matrix_from_quat(gripper_quat).T)
+    base_quats = multiply_quats(gripper_quat, quats)
+    base_values = np.stack([base_points[:, 0], base_points[:, 1], yaws_from_quats(base_quats)], axis=1)
+
+    if base_limits is not None:
+        lower, upper = map(np.array, base_limits)
+        k = len(lower)
+        base_values = base_values[np.all((lower <= base_values[:, :k]) & (base_values[:, :k] <= upper), axis=1)]
+
+    boxes = get_base_occupancy_boxes(obstacles) if base_radius is not None else []
+    if len(boxes) > 0 and len(base_values) > 0:
+        points = base_values[:, None, :2]
+        distances = np.maximum(np.maximum(boxes[None, :, 0] - points, points - boxes[None, :, 1]), 0)
+        occupied = np.any(np.sum(distances ** 2, axis=2) < base_radius ** 2, axis=1)
+        base_values = base_values[~occupied]
+
+    for base_value in base_values[np.random.permutation(len(base_values))]:
+        yield tuple(base_value)
+
 #####################################
 
 # Camera
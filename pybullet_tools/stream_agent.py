@@ -24,7 +24,7 @@ from pybullet_tools.general_streams import get_grasp_list_gen, get_contain_list_
     get_handle_grasp_gen, get_compute_pose_kin, get_compute_pose_rel_kin, get_above_pose_gen, \
     get_cfree_approach_pose_test, get_cfree_pose_pose_test, get_cfree_traj_pose_test, \
     get_bconf_close_to_surface, sample_joint_position_closed_gen, get_cfree_rel_pose_pose_test, \
-    get_cfree_approach_rel_pose_test, get_reachable_test, get_stable_list_gen, get_cfree_pose_between_test, \
+    get_cfree_approach_rel_pose_test, get_workspace_reachable_test, get_stable_list_gen, get_cfree_pose_between_test, \
     get_nudge_grasp_gen, get_cfree_traj_pose_at_bconf_at_joint_position_test, \
     get_cfree_traj_pose_at_bconf_at_joint_position_at_link_pose_test
 from pybullet_tools.camera_utils import set_camera_target_body
@@ -36,7 +36,8 @@ from pybullet_tools.pr2_streams import DEFAULT_RESOLUTION
 from pybullet_tools.utils import get_client, get_joint_limits, \
     Pose, get_bodies, pairwise_collision, get_pose, point_from_pose, set_renderer, get_joint_name, \
     remove_body, LockRenderer, WorldSaver, wait_if_gui, SEPARATOR, safe_remove, ensure_dir, \
-    get_distance, get_max_limit, BROWN, BLUE, WHITE, TAN, GREY, YELLOW, GREEN, BLACK, RED, CLIENTS, wait_unlocked
+    get_distance, get_max_limit, BROWN, BLUE, WHITE, TAN, GREY, YELLOW, GREEN, BLACK, RED, CLIENTS, wait_unlocked, \
+    set_path_postprocess
 from pybullet_tools.stream_tests import process_debug_goals
 from pybullet_tools.logging_utils import myprint as print, print_debug
 
@@ -70,8 +71,24 @@ FAILED = 'FAILED'
 def get_stream_map(p, c, l, t, movable_collisions=True, motion_collisions=True,
                    pull_collisions=True, base_collisions=True, debug=False, verbose=False,
                    use_all_grasps=False, top_grasp_tolerance=None, side_grasp_tolerance=None, ir_max_attempts=60,
-                   use_learned_ir=True, resolution=DEFAULT_RESOLUTION, num_grasps=20):
+                   use_learned_ir=True, resolution=DEFAULT_RESOLUTION, num_grasps=20, use_roadmap=False,
+                   path_postprocess=None, profile_streams=False, online_reachability=False, ik_cache=False,
+                   num_ik_workers=0, num_ik_results=1, collision_cache=False, batch_ik=False):
     """ p = problem, c = collisions, l = custom_limits, t = teleport
+        use_roadmap = reuse a PRM of the fixed obstacles for base motion across replans
+        path_postprocess = kwargs of utils.postprocess_path applied to all planned motions,
+            e.g. dict(shortcut_checks=200, waypoints=False, verbose=True)
+        profile_streams = record the calls, outputs and time (in collisions and IK) of every stream
+            in world.stream_profiler, dumped to stream_profile.json/.csv in the run directory
+        online_reachability = save the base confs that solved ik to databases/online_reachability_{robot}_{scene hash}.jsonl
+            and sample them first for the same (arm, object, grasp) at nearby poses in later problems
+        ik_cache = reuse the arm ik solutions for nearly the same tool pose relative to the arm, see IKCache
+        num_ik_workers = evaluate the base conf candidates of the ik streams that also solve ik in that many
+            forked processes, see mobile_streams.sample_bconf
+        num_ik_results = the number of successful candidates to stop the workers at, which are yielded first
+        collision_cache = reuse the pairwise collision results of the cfree tests across streams and replans
+            when neither body has moved, see CollisionCache
+        batch_ik = solve IKFast over a grid of free joint values at once when it's compiled, see robot.solve_ik_once
         add the kwargs to config yaml files in problem_sets.problem_utils.
     """
     from pybullet_tools.logging_utils import myprint as print
@@ -86,7 +103,22 @@ def get_stream_map(p, c, l, t, movable_collisions=True, motion_collisions=True,
     print(f'\tPull collisions: {pull_collisions}')
     print(f'\tBase collisions: {base_collisions}')
     print(f'\tTeleport: {t}')
+    print(f'\tPath postprocess: {path_postprocess}')
+    print(f'\tProfile streams: {profile_streams}')
+    print(f'\tOnline reachability: {online_reachability}')
+    print(f'\tIK cache: {ik_cache}')
+    print(f'\tIK workers: {num_ik_workers} (results: {num_ik_results})')
+    print(f'\tCollision cache: {collision_cache}')
+    print(f'\tBatch IK: {batch_ik}')
     print('-------------------------------------')
+    set_path_postprocess(**(path_postprocess or {}))
+    if online_reachability:
+        p.world.enable_online_reachability()
+    if ik_cache:
+        p.robot.enable_ik_cache()
+    if collision_cache:
+        p.enable_collision_cache()
+    p.robot.batch_ik = batch_ik
 
     tc = dict(teleport=t, custom_limits=l)
     ptc = dict(teleport=t, custom_limits=l, collisions=pull_collisions)
@@ -100,7 +132,7 @@ def get_stream_map(p, c, l, t, movable_collisions=True, motion_collisions=True,
     ir.update(dict(collisions=True, max_attempts=ir_max_attempts, learned=use_learned_ir))
 
     pull = copy.deepcopy(pull_kwargs)
-    pull.update(dict(collisions=True))
+    pull.update(dict(collisions=True, num_ik_workers=num_ik_workers, num_ik_results=num_ik_results))
 
     stream_map = {
 
@@ -158,7 +190,7 @@ def get_stream_map(p, c, l, t, movable_collisions=True, motion_collisions=True,
         ##                    motion
         ## ---------------------------------------------------
 
-        'plan-base-motion': from_fn(get_base_motion_gen(p, collisions=base_collisions, **tc)),
+        'plan-base-motion': from_fn(get_base_motion_gen(p, collisions=base_collisions, use_roadmap=use_roadmap, **tc)),
         # 'plan-base-motion-with-obj': from_fn(get_base_motion_with_obj_gen(p, collisions=base_collisions, teleport=t, custom_limits=l)),
 
         'plan-arm-turn-knob': from_fn(get_pull_door_handle_motion_gen(p, **ptc, verbose=True)),
@@ -201,7 +233,7 @@ def get_stream_map(p, c, l, t, movable_collisions=True, motion_collisions=True,
         'test-cfree-btraj-pose': from_test(get_cfree_btraj_pose_test(p.robot, collisions=c)),
 
         'test-bconf-close-to-surface': from_test(get_bconf_close_to_surface(p)),
-        'test-inverse-reachability': from_test(get_reachable_test()),
+        'test-inverse-reachability': from_test(get_workspace_reachable_test(p)),
 
         ## ---------------------------------------------------
         ##                    not in use
@@ -242,6 +274,9 @@ def get_stream_map(p, c, l, t, movable_collisions=True, motion_collisions=True,
             #'test-pose-in-space': from_test(universe_test),
         })
 
+    if profile_streams:
+        stream_map = p.world.get_stream_profiler().wrap_stream_map(stream_map)
+
     return stream_map
 
 
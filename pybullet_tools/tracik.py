@@ -1,5 +1,6 @@
 import math
 import os.path
+import time
 
 import numpy as np
 from tracikpy import TracIKSolver
@@ -7,7 +8,53 @@ from tracikpy import TracIKSolver
 from pybullet_tools.utils import Pose, multiply, invert, tform_from_pose, get_model_info, BASE_LINK, \
     get_link_name, link_from_name, get_joint_name, joint_from_name, parent_link_from_joint, joints_from_names, \
     links_from_names, get_link_pose, draw_pose, set_joint_positions, get_joint_positions, get_joint_limits, \
-    CIRCULAR_LIMITS, get_custom_limits
+    CIRCULAR_LIMITS, get_custom_limits, profiled, PROFILED_TIMES
+
+TRACIK_SOLVERS = {}  ## (urdf, base link, tool link, max_time, error, joint limits): TracIKSolver
+TRACIK_CHAINS = {}  ## (urdf, base link, tool link, max_time, error): (joint names, construction time)
+
+
+def create_tracik_solver(urdf_path, base_name, tool_name, max_time, error):
+    return TracIKSolver(
+        urdf_file=urdf_path,
+        base_link=base_name,
+        tip_link=tool_name,
+        timeout=max_time, epsilon=error,
+        solve_type='Speed', # Speed | Distance | Manipulation1 | Manipulation2
+    )
+
+
+def get_tracik_solver(body, base_name, tool_name, custom_limits={}, max_time=5e-3, error=1e-5):
+    """ constructing a TracIKSolver parses the urdf and builds the KDL chain, so the solvers are pooled
+        across IKSolvers of stream generators, cloned worlds and repeated problems. the pool is keyed on
+        the joint limits too because they are set on the solver. the construction time saved by reusing
+        a solver is added to PROFILED_TIMES['ik_solver_saved'] for the StreamProfiler """
+    urdf_path = os.path.abspath(get_model_info(body).path)
+    chain = (urdf_path, base_name, tool_name, max_time, error)
+    ik_solver = None
+    if chain not in TRACIK_CHAINS:
+        start_time = time.time()
+        ik_solver = create_tracik_solver(*chain)
+        TRACIK_CHAINS[chain] = (ik_solver.joint_names, time.time() - start_time)
+    joint_names, construction_time = TRACIK_CHAINS[chain]
+
+    joints = joints_from_names(body, joint_names)
+    joint_limits = tuple(map(tuple, get_custom_limits(
+        body, joints, custom_limits=custom_limits, circular_limits=CIRCULAR_LIMITS)))
+    key = chain + (joint_limits,)
+    if key in TRACIK_SOLVERS:
+        PROFILED_TIMES['ik_solver_saved'] += construction_time
+        return TRACIK_SOLVERS[key]
+    if ik_solver is None:
+        ik_solver = create_tracik_solver(*chain)
+    ik_solver.joint_limits = list(joint_limits)
+    TRACIK_SOLVERS[key] = ik_solver
+    return ik_solver
+
+
+def clear_tracik_solvers():
+    TRACIK_SOLVERS.clear()
+    TRACIK_CHAINS.clear()
 
 
 class IKSolver(object):
@@ -26,18 +73,12 @@ class IKSolver(object):
 
         urdf_info = get_model_info(body)
         self.urdf_path = os.path.abspath(urdf_info.path)
-        self.ik_solver = TracIKSolver(
-            urdf_file=self.urdf_path,
-            base_link=get_link_name(self.body, self.base_link),
-            tip_link=get_link_name(self.body, self.tool_link),
-            timeout=max_time, epsilon=error,
-            solve_type='Speed', # Speed | Distance | Manipulation1 | Manipulation2
-        )
+        self.ik_solver = get_tracik_solver(
+            self.body, get_link_name(self.body, self.base_link), get_link_name(self.body, self.tool_link),
+            custom_limits=custom_limits, max_time=max_time, error=error)
 
         self.links = links_from_names(self.body, self.link_names)
         self.joints = joints_from_names(self.body, self.joint_names)
-        self.ik_solver.joint_limits = list(get_custom_limits(
-            self.body, self.joints, custom_limits=custom_limits, circular_limits=CIRCULAR_LIMITS))
 
         self.tool_offset = tool_offset # None
         self.random_generator = np.random.RandomState(seed)
@@ -119,6 +160,7 @@ class IKSolver(object):
     def sample_conf(self):
         return self.random_generator.uniform(*self.joint_limits)
 
+    @profiled('ik')
     def solve(self, tool_pose, seed_conf=None, pos_tolerance=1e-5,
               ori_tolerance=math.radians(5e-2), verbose=False):
         import time
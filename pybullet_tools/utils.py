@@ -18,8 +18,9 @@ import datetime
 import shutil
 import cProfile
 import pstats
+import heapq
 
-from functools import lru_cache
+from functools import lru_cache, wraps
 from collections import defaultdict, deque, namedtuple
 from itertools import product, combinations, count, cycle, islice
 from multiprocessing import TimeoutError
@@ -890,6 +891,26 @@ def get_model_info(body):
     key = (CLIENT, body)
     return INFO_FROM_BODY.get(key, None)
 
+METADATA_FROM_BODY = {} # (client, body) -> static structure (names, joint info, collision shapes) queried so far
+
+def get_body_metadata(body):
+    if not isinstance(body, int):
+        body = body.body
+    key = (CLIENT, body)
+    if key not in METADATA_FROM_BODY:
+        METADATA_FROM_BODY[key] = {}
+    return METADATA_FROM_BODY[key]
+
+def clear_body_metadata(body=None):
+    """ clears the cached metadata of body, or of all bodies in the current client if body is None """
+    if body is not None:
+        if not isinstance(body, int):
+            body = body.body
+        METADATA_FROM_BODY.pop((CLIENT, body), None)
+        return
+    for key in [key for key in METADATA_FROM_BODY if key[0] == CLIENT]:
+        del METADATA_FROM_BODY[key]
+
 def get_urdf_flags(cache=False, cylinder=False, merge=False, sat=False):
     # by default, Bullet disables self-collision
     # URDF_INITIALIZE_SAT_FEATURES
@@ -929,6 +950,7 @@ def load_pybullet(filename, fixed_base=False, scale=1., **kwargs):
             body = create_obj(filename, scale=scale, **kwargs)
         else:
             raise ValueError(filename)
+    clear_body_metadata(body)
     INFO_FROM_BODY[CLIENT, body] = ModelInfo(None, filename, fixed_base, scale)
     return body
 
@@ -1027,6 +1049,33 @@ now = time.time
 def elapsed_time(start_time):
     return time.time() - start_time
 
+## time spent in the outermost call of expensive subroutines, read by logging_utils.StreamProfiler
+PROFILED_TIMES = defaultdict(float)
+PROFILED_DEPTHS = defaultdict(int)
+PROFILE_SUBROUTINES = False
+
+def set_profile_subroutines(enable=True):
+    global PROFILE_SUBROUTINES
+    PROFILE_SUBROUTINES = enable
+
+def profiled(category):
+    """ accumulates the time of the decorated function into PROFILED_TIMES[category] when
+        PROFILE_SUBROUTINES is on, nested calls of the same category are only counted once """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not PROFILE_SUBROUTINES or PROFILED_DEPTHS[category] > 0:
+                return fn(*args, **kwargs)
+            PROFILED_DEPTHS[category] += 1
+            start_time = time.time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                PROFILED_TIMES[category] += elapsed_time(start_time)
+                PROFILED_DEPTHS[category] -= 1
+        return wrapper
+    return decorator
+
 MouseEvent = namedtuple('MouseEvent', ['eventType', 'mousePosX', 'mousePosY', 'buttonIndex', 'buttonState'])
 
 def get_mouse_events():
@@ -1269,6 +1318,7 @@ def disconnect():
     # TODO: change CLIENT?
     if CLIENT in CLIENTS:
         del CLIENTS[CLIENT]
+    clear_body_metadata()
     with HideOutput():
         return p.disconnect(physicsClientId=CLIENT)
 
@@ -1337,6 +1387,7 @@ def reset_simulation():
     # RESET_USE_SIMPLE_BROADPHASE
     # RESET_USE_DEFORMABLE_WORLD
     # RESET_USE_DISCRETE_DYNAMICS_WORLD
+    clear_body_metadata()
     p.resetSimulation(physicsClientId=CLIENT)
 
 #####################################
@@ -1893,7 +1944,10 @@ def get_body_info(body):
     if not isinstance(body, int):
         body = body.body
     # TODO: p.syncBodyInfo
-    return BodyInfo(*p.getBodyInfo(body, physicsClientId=CLIENT))
+    metadata = get_body_metadata(body)
+    if 'body_info' not in metadata:
+        metadata['body_info'] = BodyInfo(*p.getBodyInfo(body, physicsClientId=CLIENT))
+    return metadata['body_info']
 
 def get_base_name(body):
     return get_body_info(body).base_name.decode(encoding='UTF-8')
@@ -1923,6 +1977,7 @@ def body_from_name(name):
 def remove_body(body):
     if (CLIENT, body) in INFO_FROM_BODY:
         del INFO_FROM_BODY[CLIENT, body]
+    clear_body_metadata(body)
     if body not in get_bodies():
         return
     return p.removeBody(body, physicsClientId=CLIENT)
@@ -2076,7 +2131,10 @@ JOINT_TYPES = {
 def get_num_joints(body):
     if not isinstance(body, int):
         body = body.body
-    return p.getNumJoints(body, physicsClientId=CLIENT)
+    metadata = get_body_metadata(body)
+    if 'num_joints' not in metadata:
+        metadata['num_joints'] = p.getNumJoints(body, physicsClientId=CLIENT)
+    return metadata['num_joints']
 
 def get_joints(body):
     return list(range(get_num_joints(body)))
@@ -2095,7 +2153,10 @@ JointInfo = namedtuple('JointInfo', ['jointIndex', 'jointName', 'jointType',
 def get_joint_info(body, joint):
     if not isinstance(body, int):
         body = body.body
-    return JointInfo(*p.getJointInfo(body, joint, physicsClientId=CLIENT))
+    joint_infos = get_body_metadata(body).setdefault('joint_info', {})
+    if joint not in joint_infos:
+        joint_infos[joint] = JointInfo(*p.getJointInfo(body, joint, physicsClientId=CLIENT))
+    return joint_infos[joint]
 
 def get_joint_name(body, joint):
     return get_joint_info(body, joint).jointName.decode('UTF-8')
@@ -2104,10 +2165,15 @@ def get_joint_names(body, joints):
     return [get_joint_name(body, joint) for joint in joints] # .encode('ascii')
 
 def joint_from_name(body, name):
-    for joint in get_joints(body):
-        if get_joint_name(body, joint) == name:
-            return joint
-    raise ValueError(body, name)
+    metadata = get_body_metadata(body)
+    if 'joint_from_name' not in metadata:
+        joint_from_names = {}
+        for joint in get_joints(body):
+            joint_from_names.setdefault(get_joint_name(body, joint), joint)
+        metadata['joint_from_name'] = joint_from_names
+    if name not in metadata['joint_from_name']:
+        raise ValueError(body, name)
+    return metadata['joint_from_name'][name]
 
 def has_joint(body, name):
     try:
@@ -2180,6 +2246,14 @@ def set_joint_positions(body, joints, values):
     # # ## TODO: when recording debugging
     # time.sleep(1)
 
+def reset_joint_positions(body, joints, values):
+    """ same as set_joint_positions for single-dof joints, but in one pybullet call """
+    if not isinstance(body, int):
+        body = body.body
+    assert len(joints) == len(values)
+    p.resetJointStatesMultiDof(body, list(joints), targetValues=[[value] for value in values],
+                               targetVelocities=[[0.]]*len(joints), physicsClientId=CLIENT)
+
 # def set_joint_velocities(body, joints, velocities):
 #     assert len(joints) == len(velocities)
 #     for joint, velocity in zip(joints, velocities):
@@ -2358,12 +2432,15 @@ def get_link_parent(body, link):
 parent_link_from_joint = get_link_parent
 
 def link_from_name(body, name):
-    if name == get_base_name(body):
-        return BASE_LINK
-    for link in get_joints(body):
-        if get_link_name(body, link) == name:
-            return link
-    raise ValueError(body, name)
+    metadata = get_body_metadata(body)
+    if 'link_from_name' not in metadata:
+        link_from_names = {get_base_name(body): BASE_LINK}
+        for link in get_joints(body):
+            link_from_names.setdefault(get_link_name(body, link), link)
+        metadata['link_from_name'] = link_from_names
+    if name not in metadata['link_from_name']:
+        raise ValueError(body, name)
+    return metadata['link_from_name'][name]
 
 def has_link(body, name):
     try:
@@ -2526,6 +2603,7 @@ def get_mass(body, link=BASE_LINK): # mass in kg
 def set_dynamics(body, link=BASE_LINK, **kwargs):
     # TODO: iterate over all links
     p.changeDynamics(body, link, physicsClientId=CLIENT, **kwargs)
+    get_body_metadata(body).pop('joint_info', None)
 
 def set_joint_limits(body, link, lower, upper):
     # NOTE that at the moment, the joint limits are not updated in 'getJointInfo'!
@@ -3106,9 +3184,13 @@ def get_collision_data(body, link=BASE_LINK):
         body = body.body
     if link is None:
         link = BASE_LINK
+    collision_data = get_body_metadata(body).setdefault('collision_data', {})
+    if link in collision_data:
+        return list(collision_data[link])
     try:
         data = p.getCollisionShapeData(body, link, physicsClientId=CLIENT)
-        return [CollisionShapeData(*tup) for tup in data]
+        collision_data[link] = [CollisionShapeData(*tup) for tup in data]
+        return list(collision_data[link])
     except:
         print(traceback.format_exc())
         print(f'utils.get_collision_data({body}) | Error receiving collision info from pybullet. Just run again :)')
@@ -3644,6 +3726,7 @@ def draw_collision_info(collision_info, **kwargs):
         handles.extend(draw_point(point, **kwargs))
     return handles
 
+@profiled('collision')
 def get_closest_points(body1, body2, link1=None, link2=None, max_distance=MAX_DISTANCE, use_aabb=False):
     if use_aabb and not aabb_overlap(get_buffered_aabb(body1, link1, max_distance=max_distance/2.),
                                      get_buffered_aabb(body2, link2, max_distance=max_distance/2.)):
@@ -3905,6 +3988,50 @@ def get_extend_fn(body, joints, resolutions=None, norm=2):
         return refine_fn(q1, q2)
     return fn
 
+def bisect_indices(n):
+    """ indices of a sequence of length n in bisection (van der Corput) order: middle, quarters, eighths, ... """
+    indices = []
+    intervals = deque([(0, n - 1)])
+    while intervals:
+        lower, upper = intervals.popleft()
+        if lower > upper:
+            continue
+        middle = (lower + upper) // 2
+        indices.append(middle)
+        intervals.extend([(lower, middle - 1), (middle + 1, upper)])
+    return indices
+
+def get_bisect_edge_fn(body, joints, collision_fn, extend_fn=None, resolutions=None, norm=2, stats=None):
+    """ returns edge_fn(q1, q2) -> the configurations after q1 up to q2 if they are all collision-free, else None
+        the configurations are checked in bisection order, where collisions in the middle of an edge are found first,
+        without extend_fn, they are linearly interpolated like get_extend_fn and only computed when checked
+        stats counts 'edges', 'checks' and 'skipped', i.e. the configurations left unchecked on colliding edges """
+    resolutions = get_default_resolutions(body, joints, resolutions)
+    difference_fn = get_difference_fn(body, joints)
+    if stats is None:
+        stats = defaultdict(int)
+
+    def get_interpolate_fn(q1, q2):
+        if extend_fn is not None:
+            path = list(extend_fn(q1, q2))
+            return len(path), lambda i: path[i]
+        difference = np.array(difference_fn(q2, q1))
+        num_steps = int(np.linalg.norm(np.divide(difference, resolutions), ord=norm)) + 1
+        return num_steps, lambda i: tuple(np.array(q1) + (i + 1.) / num_steps * difference)
+
+    def edge_fn(q1, q2):
+        num_steps, interpolate_fn = get_interpolate_fn(q1, q2)
+        stats['edges'] += 1
+        path = [None] * num_steps
+        for num_checks, i in enumerate(bisect_indices(num_steps)):
+            path[i] = interpolate_fn(i)
+            stats['checks'] += 1
+            if collision_fn(path[i]):
+                stats['skipped'] += num_steps - num_checks - 1
+                return None
+        return path
+    return edge_fn
+
 def remove_redundant(path, tolerance=1e-3):
     assert path
     new_path = [path[0]]
@@ -3934,6 +4061,76 @@ def waypoints_from_path(path, tolerance=1e-3):
     waypoints.append(last_conf)
     return waypoints
 
+PATH_POSTPROCESS = {}  ## default kwargs of postprocess_path in plan_joint_motion, nothing is done if empty
+
+def set_path_postprocess(**kwargs):
+    """ e.g. set_path_postprocess(shortcut_checks=200, waypoints=True, verbose=True) """
+    PATH_POSTPROCESS.clear()
+    PATH_POSTPROCESS.update(kwargs)
+
+def get_path_length(path, distance_fn):
+    return sum(distance_fn(q1, q2) for q1, q2 in get_pairs(path))
+
+def get_path_duration_fn(body, joints):
+    """ returns None if some joint has no max velocity """
+    velocities = np.array(get_max_velocities(body, joints))
+    if not np.all(velocities > 0):
+        return None
+    return get_duration_fn(body, joints, velocities=velocities)
+
+def shortcut_path(path, extend_fn, collision_fn, distance_fn, max_checks=200, max_attempts=100, stats=None):
+    """ repeatedly replaces a random subpath by the direct edge between its ends if that is shorter and
+        collision-free, until max_checks configurations have been checked """
+    path = list(path)
+    if stats is None:
+        stats = defaultdict(int)
+    for _ in range(max_attempts):
+        if (stats['checks'] >= max_checks) or (len(path) <= 2):
+            break
+        i, j = sorted(random.sample(range(len(path)), 2))
+        if j - i <= 1:
+            continue
+        if distance_fn(path[i], path[j]) >= get_path_length(path[i:j + 1], distance_fn):
+            continue
+        segment = list(extend_fn(path[i], path[j]))
+        if not segment or (len(segment) > max_checks - stats['checks']):
+            continue
+        for k in bisect_indices(len(segment)):
+            stats['checks'] += 1
+            if collision_fn(segment[k]):
+                break
+        else:
+            stats['shortcuts'] += 1
+            path = path[:i + 1] + segment[:-1] + path[j:]
+    return path
+
+def postprocess_path(path, extend_fn, collision_fn, distance_fn, duration_fn=None,
+                     shortcut_checks=0, waypoints=False, verbose=False, stats=None):
+    """ shortcuts the path within a budget of collision checks, then keeps only its waypoints,
+        stats records the length, duration and number of confs before and after """
+    if stats is None:
+        stats = defaultdict(int)
+
+    def record(path, when):
+        stats[f'{when}_confs'] = len(path)
+        stats[f'{when}_length'] = get_path_length(path, distance_fn)
+        if duration_fn is not None:
+            stats[f'{when}_duration'] = sum(duration_fn(q1, q2) for q1, q2 in get_pairs(path))
+
+    record(path, 'before')
+    if shortcut_checks > 0:
+        path = shortcut_path(path, extend_fn, collision_fn, distance_fn, max_checks=shortcut_checks, stats=stats)
+    if waypoints:
+        path = waypoints_from_path(path)
+    record(path, 'after')
+    if verbose:
+        line = f'\t[utils.postprocess_path] confs {stats["before_confs"]} -> {stats["after_confs"]}\t ' \
+               f'length {stats["before_length"]:.3f} -> {stats["after_length"]:.3f}'
+        if duration_fn is not None:
+            line += f'\t duration {stats["before_duration"]:.3f} -> {stats["after_duration"]:.3f}'
+        print(line + f'\t checks = {stats["checks"]}\t shortcuts = {stats["shortcuts"]}')
+    return path
+
 def adjust_path(robot, joints, path):
     difference_fn = get_difference_fn(robot, joints)
     differences = [difference_fn(q2, q1) for q1, q2 in get_pairs(path)]
@@ -3966,6 +4163,13 @@ def get_moving_pairs(body, moving_joints):
             yield link1, link2
 
 def get_self_link_pairs(body, joints, disabled_collisions=set(), only_moving=True):
+    key = (tuple(joints), frozenset(disabled_collisions), only_moving)
+    self_link_pairs = get_body_metadata(body).setdefault('self_link_pairs', {})
+    if key not in self_link_pairs:
+        self_link_pairs[key] = compute_self_link_pairs(body, joints, disabled_collisions, only_moving)
+    return list(self_link_pairs[key])
+
+def compute_self_link_pairs(body, joints, disabled_collisions=set(), only_moving=True):
     moving_links = list(filter(lambda link: can_collide(body, link), get_moving_links(body, joints)))
     fixed_links = list(filter(lambda link: can_collide(body, link), set(get_links(body)) - set(moving_links)))
     check_link_pairs = list(product(moving_links, fixed_links))
@@ -3995,121 +4199,240 @@ def get_limits_fn(body, joints, custom_limits={}, verbose=False):
     return limits_fn
 
 
+BROADPHASE_MODES = [None, 'sap', 'grid']
+
+DEBUG_COLLISION_NAMES = {'bottle': ['bottle', 'sink_counter_front', 'faucet']}  ## moving name: obstacle names
+
+def get_debug_collision_names(robot, body1, body2):
+    """ return (moving name, obstacle name) if the pair is watched in DEBUG_COLLISION_NAMES, only for robot objects """
+    world = getattr(robot, 'world', None)
+    if not hasattr(world, 'BODY_TO_OBJECT') or body2 not in world.BODY_TO_OBJECT:
+        return None
+    if isinstance(body1.body, int):
+        if body1.body not in world.BODY_TO_OBJECT:
+            return None
+        mov_name = world.BODY_TO_OBJECT[body1.body].name
+    else:
+        mov_name = body1.body.name
+    obs_name = world.BODY_TO_OBJECT[body2].name
+    for mov_key, obs_keys in DEBUG_COLLISION_NAMES.items():
+        if mov_key in mov_name and any(obs_key in obs_name for obs_key in obs_keys):
+            return mov_name, obs_name
+    return None
+
+class AABBIndex(object):
+    """
+    Broad-phase index over the AABBs of obstacles that don't move while a collision_fn is in use
+        'sap': sweep-and-prune, obstacles sorted by their lower x bound
+        'grid': uniform grid hashing, obstacles spanning more than max_cells cells are always returned
+    """
+
+    def __init__(self, bodies, aabbs, mode='sap', cell_size=0.5, max_cells=1000):
+        assert mode in BROADPHASE_MODES[1:], mode
+        self.mode = mode
+        self.cell_size = cell_size
+        pairs = [(body, aabb) for body, aabb in zip(bodies, aabbs) if aabb is not None]
+        self.bodies = [body for body, _ in pairs]
+        self.lowers = np.array([aabb[0] for _, aabb in pairs], dtype=float).reshape(-1, 3)
+        self.uppers = np.array([aabb[1] for _, aabb in pairs], dtype=float).reshape(-1, 3)
+
+        if mode == 'sap':
+            self.order = np.argsort(self.lowers[:, 0], kind='stable')
+            self.sorted_lower_x = self.lowers[self.order, 0]
+        else:
+            self.cells = defaultdict(list)
+            self.oversized = []
+            for i in range(len(self.bodies)):
+                cells = self._get_cells(self.lowers[i], self.uppers[i])
+                if len(cells) > max_cells:
+                    self.oversized.append(i)
+                    continue
+                for cell in cells:
+                    self.cells[cell].append(i)
+
+    def __len__(self):
+        return len(self.bodies)
+
+    def _get_cells(self, lower, upper):
+        lower_cell = np.floor(np.divide(lower, self.cell_size)).astype(int)
+        upper_cell = np.floor(np.divide(upper, self.cell_size)).astype(int)
+        return list(product(*[range(l, u + 1) for l, u in zip(lower_cell, upper_cell)]))
+
+    def query(self, aabb):
+        """ return the indexed bodies whose AABBs overlap the given one, in the order they were given """
+        if (aabb is None) or (len(self.bodies) == 0):
+            return []
+        lower, upper = np.array(aabb[0], dtype=float), np.array(aabb[1], dtype=float)
+        if self.mode == 'sap':
+            candidates = self.order[:np.searchsorted(self.sorted_lower_x, upper[0], side='right')]
+        else:
+            candidates = set(self.oversized)
+            for cell in self._get_cells(lower, upper):
+                candidates.update(self.cells.get(cell, []))
+            candidates = np.array(list(candidates), dtype=int)
+        overlap = np.all(self.lowers[candidates] <= upper, axis=1) & \
+                  np.all(lower <= self.uppers[candidates], axis=1)
+        return [self.bodies[i] for i in sorted(candidates[overlap])]
+
+
 def get_collision_fn(body, joints, obstacles=[], attachments=[], self_collisions=True, disabled_collisions=set(),
                      custom_limits={}, use_aabb=False, cache=False, max_distance=MAX_DISTANCE,
-                     verbose=False, ignored_pairs=[], **kwargs):
+                     verbose=False, ignored_pairs=[], broadphase=None, instrumented=False, batch=False, **kwargs):
+    """ broadphase in BROADPHASE_MODES builds an AABBIndex of the obstacles once,
+            so each check only tests the obstacles overlapping the moving bodies (implies use_aabb)
+        instrumented=True returns the slower collision_fn that looks up the names of every checked pair
+            to report the ones watched in DEBUG_COLLISION_NAMES
+        batch=True returns batch_collision_fn instead, see get_batch_collision_fn """
     # TODO: convert most of these to keyword arguments
+    if self_collisions and not disabled_collisions and hasattr(body, 'get_disabled_collisions'):
+        disabled_collisions = body.get_disabled_collisions()  ## never colliding link pairs of RobotAPI
     check_link_pairs = get_self_link_pairs(body, joints, disabled_collisions) if self_collisions else []
     moving_links = frozenset(link for link in get_moving_links(body, joints)
                              if can_collide(body, link)) # TODO: propagate elsewhere
+    ignored_pairs = {tuple(pair) for pair in ignored_pairs}
     attached_bodies = [attachment.child for attachment in attachments]
     moving_bodies = [CollisionPair(body, moving_links)] + list(map(parse_body, attached_bodies))
     #moving_bodies = list(flatten(flatten_links(*pair) for pair in moving_bodies)) # Introduces overhead
     #moving_bodies = [body] + [attachment.child for attachment in attachments]
     get_obstacle_aabb = cached_fn(get_buffered_aabb, cache=cache, max_distance=max_distance/2., **kwargs)
     limits_fn = get_limits_fn(body, joints, custom_limits=custom_limits, verbose=verbose)
+    lower_limits, upper_limits = map(np.array, get_custom_limits(body, joints, custom_limits))
+    obstacle_index = None
+    if broadphase is not None:
+        obstacle_index = AABBIndex(obstacles, [get_obstacle_aabb(obstacle) for obstacle in obstacles],
+                                   mode=broadphase)
     # TODO: sort bodies by bounding box size
 
-    def collision_fn(q, verbose=False):
-        # from pybullet_tools.camera_utils import set_camera_target_body
-        ## set_camera_target_body(body, dx=0.2, dy=-0.2, dz=0.2)
+    def get_obstacle_pairs(get_moving_aabb):
+        if obstacle_index is None:
+            return product(moving_bodies, obstacles)
+        return [(body1, body2) for body1 in moving_bodies for body2 in obstacle_index.query(get_moving_aabb(body1))]
+
+    def violates_limits(q, verbose=False):
         if limits_fn(q):
             if verbose:
                 print('utils.get_collision_fn | Joint limits violated')
             limits_fn(q)
             return True
+        return False
+
+    def set_configuration(q):
         set_joint_positions(body, joints, q)
         for attachment in attachments:
             attachment.assign()
-        # wait_for_duration(1e-2)
-        get_moving_aabb = cached_fn(get_buffered_aabb, cache=True, max_distance=max_distance/2., **kwargs)
+        return cached_fn(get_buffered_aabb, cache=True, max_distance=max_distance/2., **kwargs)
 
+    def self_collision(verbose=False):
         for link1, link2 in check_link_pairs:
             # Self-collisions should not have the max_distance parameter
             # TODO: self-collisions between body and attached_bodies (except for the link adjacent to the robot)
-            if (not use_aabb or aabb_overlap(get_moving_aabb(body), get_moving_aabb(body))) and \
-                    pairwise_link_collision(body, link1, body, link2): #, **kwargs):
-                # print(get_body_name(body), get_link_name(body, link1), get_link_name(body, link2))
+            if pairwise_link_collision(body, link1, body, link2): #, **kwargs):
                 if verbose:
                     print(f'check_link_pairs body {body}, link {link1} and link {link2}')
                 return True
+        return False
+
+    def obstacle_collision(body1, body2, get_moving_aabb):
+        return (not use_aabb or aabb_overlap(get_moving_aabb(body1), get_obstacle_aabb(body2))) \
+               and pairwise_collision(body1, body2, max_distance=max_distance, **kwargs)
 
-        # #step_simulation()
-        # #update_scene()
-        # for body1 in moving_bodies:
-        #     overlapping_pairs = [(body2, link2) for body2, link2 in get_bodies_in_region(get_moving_aabb(body1))
-        #                          if body2 in obstacles]
-        #     overlapping_bodies = {body2 for body2, _ in overlapping_pairs}
-        #     for body2 in overlapping_bodies:
-        #         if pairwise_collision(body1, body2, **kwargs):
-        #             #print(get_body_name(body1), get_body_name(body2))
-        #             if verbose: print(body1, body2)
-        #             return True
-        # return False
-
-        # if len(moving_bodies) > 0:
-        #     print('collision_fn', len(moving_bodies))
-
-        for body1, body2 in product(moving_bodies, obstacles):
+    def report_collision(body1, body2, verbose=False):
+        if verbose:
+            if not isinstance(body, int):
+                body.print_full_body_conf(title='get_collision_fn', debug=False)
+            print(f'collision_fn({body1}, {body2})')
+
+        ## robot object
+        if not isinstance(body, int):
+            b1 = body1.body if hasattr(body1, 'body') else body1
+            b2 = body2.body if hasattr(body2, 'body') else body2
+            body.log_collisions(body2, source=f'collision_fn({b1}, {b2}, obstacles={obstacles})')
+
+    def configuration_collision(get_moving_aabb, verbose=False):
+        if self_collision(verbose=verbose):
+            return True
+        for body1, body2 in get_obstacle_pairs(get_moving_aabb):
             if body1.body == body2 or (body1.body, body2) in ignored_pairs:
                 continue
-
-            ## debug colliding with sink
-            debug = False
-            if hasattr(moving_bodies[0].body, 'world'):
-                world = moving_bodies[0].body.world
-                if hasattr(world, 'BODY_TO_OBJECT'):
-                    if body2 in world.BODY_TO_OBJECT:
-                        if isinstance(body1.body, int):
-                            mov_name = world.BODY_TO_OBJECT[body1.body].name
-                        else:
-                            mov_name = body1.body.name
-                        obs_name = world.BODY_TO_OBJECT[body2].name
-                        if 'bottle' in mov_name and ('bottle' in obs_name or ##'sink#1' in obs_name or
-                                                     'sink_counter_front' in obs_name or 'faucet' in obs_name):
-                            debug = True
-                            # set_renderer(True)
-                            # if 'bottle' in obs_name:
-                            #     print(f'checking collision between {obs_name} and bottle')
-            if (not use_aabb or aabb_overlap(get_moving_aabb(body1), get_obstacle_aabb(body2))) \
-                    and pairwise_collision(body1, body2, max_distance=max_distance, **kwargs):
-                # print(get_body_name(body1), get_body_name(body2))
-                if verbose:
-                    from pybullet_tools.bullet_utils import nice  ## YANG
-                    if not isinstance(body1, int):
-                        body.print_full_body_conf(title='get_collision_fn', debug=False)
-                    print(f'collision_fn({body1}, {body2})')
-
-                ## robot object
-                if not isinstance(body, int):
-                    b1 = body1.body if hasattr(body1, 'body') else body1
-                    b2 = body2.body if hasattr(body2, 'body') else body2
-                    body.log_collisions(body2, source=f'collision_fn({b1}, {b2}, obstacles={obstacles})')
-
-                    # if debug:
-                    #     set_camera_target_body(body2)
-                    #     set_renderer(True)
-                    #     print(f'checking collision between {obs_name} and bottle')
-                    #     wait_for_user()
-                ## set_camera_target_body(body2, dx=0.5, dy=-0.2, dz=0.3)
+            if obstacle_collision(body1, body2, get_moving_aabb):
+                report_collision(body1, body2, verbose=verbose)
                 return True
-            # elif collided(body1, [body2], tag='compare collision fn', world=world) or debug:
-            #     set_camera_target_body(body2, dx=0, dy=-0.5, dz=0.5)
-            #     print(f'get_collision_fn | no collision between {obs_name} and bottle')
-            #     set_renderer(True)
-            #     wait_for_user()
+        return False
+
+    @profiled('collision')
+    def collision_fn(q, verbose=False):
+        if violates_limits(q, verbose=verbose):
+            return True
+        get_moving_aabb = set_configuration(q)
+        return configuration_collision(get_moving_aabb, verbose=verbose)
+
+    @profiled('collision')
+    def batch_collision_fn(qs, stop_at_first=False, verbose=False):
+        """ qs is a (N, d) array, the joint limits of all of them are checked at once
+            stop_at_first=True stops at the first collision along an edge and marks the rest as colliding """
+        qs = np.array(qs, dtype=float).reshape(-1, len(joints))
+        collisions = ~(np.less_equal(lower_limits, qs) & np.less_equal(qs, upper_limits)).all(axis=1)
+        for i, q in enumerate(qs):
+            if not collisions[i]:
+                reset_joint_positions(body, joints, q)
+                for attachment in attachments:
+                    attachment.assign()
+                get_moving_aabb = cached_fn(get_buffered_aabb, cache=True, max_distance=max_distance/2., **kwargs)
+                collisions[i] = configuration_collision(get_moving_aabb, verbose=verbose)
+            if collisions[i] and stop_at_first:
+                collisions[i:] = True
+                break
+        return collisions
 
+    if batch:
+        return batch_collision_fn
+
+    @profiled('collision')
+    def instrumented_collision_fn(q, verbose=False):
+        """ same as collision_fn, but also reports the checks between the pairs in DEBUG_COLLISION_NAMES """
+        if violates_limits(q, verbose=verbose):
+            return True
+        get_moving_aabb = set_configuration(q)
+        if self_collision(verbose=verbose):
+            return True
+        for body1, body2 in get_obstacle_pairs(get_moving_aabb):
+            if body1.body == body2 or (body1.body, body2) in ignored_pairs:
+                continue
+            debug_names = get_debug_collision_names(body, body1, body2)
+            if obstacle_collision(body1, body2, get_moving_aabb):
+                if debug_names is not None:
+                    print('utils.get_collision_fn | collision between {} and {}'.format(*debug_names))
+                report_collision(body1, body2, verbose=verbose)
+                return True
+            if debug_names is not None and verbose:
+                print('utils.get_collision_fn | no collision between {} and {}'.format(*debug_names))
         return False
+
+    if instrumented:
+        return instrumented_collision_fn
     return collision_fn
 
+def get_batch_collision_fn(body, joints, obstacles=[], attachments=[], cache=True, **kwargs):
+    """ companion of get_collision_fn for validating many configurations, e.g. the steps of an edge,
+        returns batch_collision_fn(qs, stop_at_first=False) -> boolean vector over the (N, d) array qs
+        that shares the obstacle AABBs, self-collision link pairs and broadphase index across the batch """
+    return get_collision_fn(body, joints, obstacles=obstacles, attachments=attachments, cache=cache,
+                            batch=True, **kwargs)
+
 def interpolate_joint_waypoints(body, joints, waypoints, resolutions=None,
-                                collision_fn=lambda *args, **kwargs: False, **kwargs):
+                                collision_fn=lambda *args, **kwargs: False, batch_collision_fn=None, **kwargs):
     # TODO: unify with refine_path
     extend_fn = get_extend_fn(body, joints, resolutions=resolutions, **kwargs)
     path = waypoints[:1]
     for waypoint in waypoints[1:]:
         assert len(joints) == len(waypoint)
-        for q in list(extend_fn(path[-1], waypoint)):
+        segment = list(extend_fn(path[-1], waypoint))
+        if batch_collision_fn is not None:
+            if batch_collision_fn([segment[i] for i in bisect_indices(len(segment))], stop_at_first=True).any():
+                return None
+            path.extend(segment)
+            continue
+        for q in segment:
             if collision_fn(q):
                 return None
             path.append(q) # TODO: could instead yield
@@ -4122,15 +4445,15 @@ def plan_waypoints_joint_motion(body, joints, waypoints, start_conf=None, obstac
     if start_conf is None:
         start_conf = get_joint_positions(body, joints)
     assert len(start_conf) == len(joints)
-    collision_fn = get_collision_fn(body, joints, obstacles, attachments, self_collisions, disabled_collisions,
-                                    custom_limits=custom_limits, max_distance=max_distance,
-                                    use_aabb=use_aabb, cache=cache, **kwargs)
+    batch_collision_fn = get_batch_collision_fn(body, joints, obstacles, attachments, self_collisions=self_collisions,
+                                                disabled_collisions=disabled_collisions, custom_limits=custom_limits,
+                                                max_distance=max_distance, use_aabb=use_aabb, cache=cache, **kwargs)
     waypoints = [start_conf] + list(waypoints)
-    for i, waypoint in enumerate(waypoints):
-        if collision_fn(waypoint):
-            #print('Warning: waypoint configuration {}/{} is in collision'.format(i, len(waypoints)))
-            return None
-    return interpolate_joint_waypoints(body, joints, waypoints, resolutions=resolutions, collision_fn=collision_fn)
+    if batch_collision_fn(waypoints, stop_at_first=True).any():
+        #print('Warning: a waypoint configuration is in collision')
+        return None
+    return interpolate_joint_waypoints(body, joints, waypoints, resolutions=resolutions,
+                                       batch_collision_fn=batch_collision_fn)
 
 
 def plan_direct_joint_motion(body, joints, end_conf, **kwargs):
@@ -4159,7 +4482,11 @@ def check_initial_end(start_conf, end_conf, collision_fn, verbose=False, debug=F
 def plan_joint_motion(body, joints, end_conf, obstacles=[], attachments=[],
                       self_collisions=True, disabled_collisions=set(), ignored_pairs=[],
                       weights=None, resolutions=None, max_distance=MAX_DISTANCE,
-                      use_aabb=False, cache=True, custom_limits={}, algorithm=None, verbose=False, **kwargs):
+                      use_aabb=False, cache=True, custom_limits={}, algorithm=None, verbose=False,
+                      broadphase=None, lazy=False, roadmap=None, postprocess=None, **kwargs):
+    """ lazy=True first checks the direct edge in bisection order with get_bisect_edge_fn before planning
+        roadmap is a Roadmap of the static obstacles (see get_joint_roadmap) queried before falling back to birrt
+        postprocess is a dict of kwargs for postprocess_path, by default those given to set_path_postprocess """
 
     start_conf = get_joint_positions(body, joints)
     if verbose:
@@ -4177,21 +4504,38 @@ def plan_joint_motion(body, joints, end_conf, obstacles=[], attachments=[],
     extend_fn = get_extend_fn(body, joints, resolutions=resolutions)
     collision_fn = get_collision_fn(body, joints, obstacles, attachments, self_collisions, disabled_collisions,
                                     custom_limits=custom_limits, max_distance=max_distance, use_aabb=use_aabb,
-                                    cache=cache, ignored_pairs=ignored_pairs)
+                                    cache=cache, ignored_pairs=ignored_pairs, broadphase=broadphase)
 
     if not check_initial_end(start_conf, end_conf, collision_fn):
         return None
 
-    old_stdout = sys.stdout  # backup current stdout
-    sys.stdout = open(os.devnull, "w")
+    path = None
+    if lazy:
+        path = plan_lazy_direct_motion(body, joints, start_conf, end_conf, collision_fn,
+                                       resolutions=resolutions, verbose=verbose)
 
-    if algorithm is None:
-        path = birrt(start_conf, end_conf, distance_fn, sample_fn, extend_fn, collision_fn, **kwargs)
-    else:
-        path = solve(start_conf, end_conf, distance_fn, sample_fn, extend_fn, collision_fn, algorithm=algorithm, **kwargs)
-        # path = plan_lazy_prm(start_conf, end_conf, sample_fn, extend_fn, collision_fn)
+    if (path is None) and (roadmap is not None):
+        path = roadmap.query(start_conf, end_conf, collision_fn)
+        if verbose:
+            print(f'\t[utils.plan_joint_motion] roadmap of {len(roadmap)} vertices found path = {path is not None}')
 
-    sys.stdout = old_stdout  # reset old stdout
+    if path is None:
+        old_stdout = sys.stdout  # backup current stdout
+        sys.stdout = open(os.devnull, "w")
+
+        if algorithm is None:
+            path = birrt(start_conf, end_conf, distance_fn, sample_fn, extend_fn, collision_fn, **kwargs)
+        else:
+            path = solve(start_conf, end_conf, distance_fn, sample_fn, extend_fn, collision_fn, algorithm=algorithm, **kwargs)
+            # path = plan_lazy_prm(start_conf, end_conf, sample_fn, extend_fn, collision_fn)
+
+        sys.stdout = old_stdout  # reset old stdout
+
+    if postprocess is None:
+        postprocess = PATH_POSTPROCESS
+    if (path is not None) and postprocess:
+        path = postprocess_path(path, extend_fn, collision_fn, distance_fn,
+                                duration_fn=get_path_duration_fn(body, joints), **postprocess)
 
     # duration = time.time() - start_time
     # if duration > 1:
@@ -4201,6 +4545,17 @@ def plan_joint_motion(body, joints, end_conf, obstacles=[], attachments=[],
 
 plan_holonomic_motion = plan_joint_motion
 
+def plan_lazy_direct_motion(body, joints, start_conf, end_conf, collision_fn, verbose=False, **kwargs):
+    stats = defaultdict(int)
+    edge_fn = get_bisect_edge_fn(body, joints, collision_fn, stats=stats, **kwargs)
+    path = edge_fn(start_conf, end_conf)
+    if verbose:
+        print(f'\t[utils.plan_lazy_direct_motion] direct path found = {path is not None}\t '
+              f'checked = {stats["checks"]}\t saved = {stats["skipped"]}')
+    if path is None:
+        return None
+    return [start_conf] + path
+
 def plan_lazy_prm(start_conf, end_conf, sample_fn, extend_fn, collision_fn, **kwargs):
     # TODO: cost metric based on total robot movement (encouraging greater distances possibly)
     from motion_planners.lazy_prm import lazy_prm
@@ -4226,6 +4581,141 @@ def plan_lazy_prm(start_conf, end_conf, sample_fn, extend_fn, collision_fn, **kw
     wait_if_gui()
     return path
 
+class Roadmap(object):
+    """ a PRM whose vertices are free of the static obstacles it was built with, reused across queries:
+        each query searches the graph and only validates the edges on the shortest path with its own collision_fn,
+        so obstacles that changed since (e.g. opened doors, attachments) are still respected """
+
+    def __init__(self, sample_fn, distance_fn, extend_fn, collision_fn, obstacles=[],
+                 num_samples=200, num_neighbors=10, max_attempts=10):
+        self.sample_fn = sample_fn
+        self.distance_fn = distance_fn
+        self.extend_fn = extend_fn
+        self.collision_fn = collision_fn
+        self.obstacles = frozenset(obstacles)  ## the roadmap is outdated when these change
+        self.num_neighbors = num_neighbors
+        self.vertices = []
+        self.neighbors = defaultdict(dict)  ## vertex: {neighbor: distance}
+        self.grow(num_samples, max_attempts=max_attempts)
+
+    def __len__(self):
+        return len(self.vertices)
+
+    def get_nearest(self, q, vertices):
+        distances = [(self.distance_fn(q, self.vertices[v]), v) for v in vertices]
+        return sorted(distances)[:self.num_neighbors]
+
+    def grow(self, num_samples, max_attempts=10):
+        for _ in range(max_attempts * num_samples):
+            if num_samples <= 0:
+                break
+            q = self.sample_fn()
+            if self.collision_fn(q):
+                continue
+            num_samples -= 1
+            vertex = len(self.vertices)
+            for distance, neighbor in self.get_nearest(q, range(vertex)):
+                self.neighbors[vertex][neighbor] = self.neighbors[neighbor][vertex] = distance
+            self.vertices.append(q)
+
+    def check_edge(self, q1, q2, collision_fn):
+        path = list(self.extend_fn(q1, q2))
+        if any(collision_fn(path[i]) for i in bisect_indices(len(path))):
+            return None
+        return path
+
+    def search(self, neighbors, start, goal, blocked):
+        queue = [(0., start)]
+        parents = {start: None}
+        costs = {start: 0.}
+        while queue:
+            cost, vertex = heapq.heappop(queue)
+            if vertex == goal:
+                path = [vertex]
+                while parents[path[-1]] is not None:
+                    path.append(parents[path[-1]])
+                return path[::-1]
+            if cost > costs[vertex]:
+                continue
+            for neighbor, distance in neighbors(vertex).items():
+                new_cost = cost + distance
+                if (vertex, neighbor) in blocked or new_cost >= costs.get(neighbor, INF):
+                    continue
+                costs[neighbor] = new_cost
+                parents[neighbor] = vertex
+                heapq.heappush(queue, (new_cost, neighbor))
+        return None
+
+    def query(self, start_conf, end_conf, collision_fn, max_iterations=100, shortcut=True):
+        """ returns a path from start_conf to end_conf that avoids collision_fn, or None """
+        start, goal = -1, -2  ## temporary vertices of this query
+        confs = {start: start_conf, goal: end_conf}
+        extra_neighbors = defaultdict(dict)
+        for vertex in [start, goal]:
+            for distance, neighbor in self.get_nearest(confs[vertex], range(len(self))):
+                extra_neighbors[vertex][neighbor] = extra_neighbors[neighbor][vertex] = distance
+        extra_neighbors[start][goal] = extra_neighbors[goal][start] = self.distance_fn(start_conf, end_conf)
+
+        def get_conf(vertex):
+            return confs[vertex] if vertex < 0 else self.vertices[vertex]
+
+        def neighbors(vertex):
+            if vertex not in extra_neighbors:
+                return self.neighbors[vertex]
+            vertex_neighbors = dict(self.neighbors.get(vertex, {}))
+            vertex_neighbors.update(extra_neighbors[vertex])
+            return vertex_neighbors
+
+        blocked = set()
+        edges = {}
+        for _ in range(max_iterations):
+            vertices = self.search(neighbors, start, goal, blocked)
+            if vertices is None:
+                return None
+            for edge in get_pairs(vertices):
+                if edge not in edges:
+                    edges[edge] = self.check_edge(*map(get_conf, edge), collision_fn)
+                if edges[edge] is None:
+                    blocked.update([edge, edge[::-1]])
+                    break
+            else:
+                break
+        else:
+            return None
+
+        if shortcut:  ## greedily skip the roadmap vertices that the rest of the path can directly reach
+            index = 0
+            new_vertices = [vertices[0]]
+            while index < len(vertices) - 1:
+                for next_index in range(len(vertices) - 1, index + 1, -1):
+                    edge = (vertices[index], vertices[next_index])
+                    if edge not in edges:
+                        edges[edge] = self.check_edge(*map(get_conf, edge), collision_fn)
+                    if edges[edge] is not None:
+                        break
+                else:
+                    next_index = index + 1
+                new_vertices.append(vertices[next_index])
+                index = next_index
+            vertices = new_vertices
+        return [start_conf] + list(flatten(edges[edge] for edge in get_pairs(vertices)))
+
+def get_joint_roadmap(body, joints, obstacles=[], attachments=[], self_collisions=True, disabled_collisions=set(),
+                      ignored_pairs=[], weights=None, resolutions=None, max_distance=MAX_DISTANCE, use_aabb=True,
+                      custom_limits={}, **kwargs):
+    """ a Roadmap over the static obstacles for plan_joint_motion(roadmap=...) """
+    if (weights is None) and (resolutions is not None):
+        with np.errstate(divide='ignore'):
+            weights = np.reciprocal(resolutions)
+    sample_fn = get_sample_fn(body, joints, custom_limits=custom_limits)
+    distance_fn = get_distance_fn(body, joints, weights=weights)
+    extend_fn = get_extend_fn(body, joints, resolutions=resolutions)
+    collision_fn = get_collision_fn(body, joints, obstacles, attachments, self_collisions, disabled_collisions,
+                                    custom_limits=custom_limits, max_distance=max_distance, use_aabb=use_aabb,
+                                    cache=True, ignored_pairs=ignored_pairs)
+    with ConfSaver(body):
+        return Roadmap(sample_fn, distance_fn, extend_fn, collision_fn, obstacles=obstacles, **kwargs)
+
 #####################################
 
 def get_closest_angle_fn(body, joints, weights=None, reversible=True, linear_tol=0., **kwargs):
@@ -4284,7 +4774,8 @@ def plan_nonholonomic_motion(body, joints, end_conf, obstacles=[], attachments=[
                              self_collisions=True, disabled_collisions=set(),
                              weights=None, resolutions=None, reversible=True,
                              linear_tol=EPSILON, angular_tol=0.,
-                             max_distance=MAX_DISTANCE, use_aabb=False, cache=True, custom_limits={}, algorithm=None, **kwargs):
+                             max_distance=MAX_DISTANCE, use_aabb=False, cache=True, custom_limits={}, algorithm=None,
+                             lazy=False, **kwargs):
 
     assert len(joints) == len(end_conf) == 3
     sample_fn = get_sample_fn(body, joints, custom_limits=custom_limits)
@@ -4301,6 +4792,12 @@ def plan_nonholonomic_motion(body, joints, end_conf, obstacles=[], attachments=[
     if not check_initial_end(start_conf, end_conf, collision_fn):
         return None
 
+    if lazy:
+        path = plan_lazy_direct_motion(body, joints, start_conf, end_conf, collision_fn,
+                                       extend_fn=extend_fn, verbose=kwargs.get('verbose', False))
+        if path is not None:
+            return path
+
     if algorithm is None:
         return birrt(start_conf, end_conf, distance_fn, sample_fn, extend_fn, collision_fn, **kwargs)
     return solve(start_conf, end_conf, distance_fn, sample_fn, extend_fn, collision_fn, algorithm=algorithm, **kwargs)
@@ -4325,9 +4822,8 @@ def get_base_distance_fn(weights=1*np.ones(3)):
         return np.sqrt(np.dot(weights, difference * difference))
     return fn
 
-def plan_base_motion(body, end_conf, base_limits, obstacles=[], direct=False,
-                     weights=1*np.ones(3), resolutions=0.05*np.ones(3),
-                     max_distance=MAX_DISTANCE, algorithm=None, **kwargs):
+def get_base_motion_fns(body, base_limits, obstacles=[], weights=1*np.ones(3), resolutions=0.05*np.ones(3),
+                        max_distance=MAX_DISTANCE):
     def sample_fn():
         x, y = np.random.uniform(*base_limits)
         theta = np.random.uniform(*CIRCULAR_LIMITS)
@@ -4350,6 +4846,21 @@ def plan_base_motion(body, end_conf, base_limits, obstacles=[], direct=False,
         # TODO: update this function
         set_base_values(body, q)
         return any(pairwise_collision(body, obs, max_distance=max_distance) for obs in obstacles)
+    return sample_fn, distance_fn, extend_fn, collision_fn
+
+def get_base_roadmap(body, base_limits, obstacles=[], weights=1*np.ones(3), resolutions=0.05*np.ones(3),
+                     max_distance=MAX_DISTANCE, **kwargs):
+    """ a Roadmap over the static obstacles for plan_base_motion(roadmap=...) """
+    sample_fn, distance_fn, extend_fn, collision_fn = get_base_motion_fns(
+        body, base_limits, obstacles, weights=weights, resolutions=resolutions, max_distance=max_distance)
+    with PoseSaver(body):
+        return Roadmap(sample_fn, distance_fn, extend_fn, collision_fn, obstacles=obstacles, **kwargs)
+
+def plan_base_motion(body, end_conf, base_limits, obstacles=[], direct=False,
+                     weights=1*np.ones(3), resolutions=0.05*np.ones(3),
+                     max_distance=MAX_DISTANCE, algorithm=None, roadmap=None, postprocess=None, **kwargs):
+    sample_fn, distance_fn, extend_fn, collision_fn = get_base_motion_fns(
+        body, base_limits, obstacles, weights=weights, resolutions=resolutions, max_distance=max_distance)
 
     start_conf = get_base_values(body)
     if not check_initial_end(start_conf, end_conf, collision_fn):
@@ -4357,9 +4868,21 @@ def plan_base_motion(body, end_conf, base_limits, obstacles=[], direct=False,
 
     if direct:
         return direct_path(start_conf, end_conf, extend_fn, collision_fn)
-    if algorithm is None:
-        return birrt(start_conf, end_conf, distance_fn, sample_fn, extend_fn, collision_fn, **kwargs)
-    return solve(start_conf, end_conf, distance_fn, sample_fn, extend_fn, collision_fn, algorithm=algorithm, **kwargs)
+    path = None
+    if roadmap is not None:
+        path = roadmap.query(start_conf, end_conf, collision_fn)
+    if path is None:
+        if algorithm is None:
+            path = birrt(start_conf, end_conf, distance_fn, sample_fn, extend_fn, collision_fn, **kwargs)
+        else:
+            path = solve(start_conf, end_conf, distance_fn, sample_fn, extend_fn, collision_fn,
+                         algorithm=algorithm, **kwargs)
+
+    if postprocess is None:
+        postprocess = PATH_POSTPROCESS
+    if (path is not None) and postprocess:
+        path = postprocess_path(path, extend_fn, collision_fn, distance_fn, **postprocess)
+    return path
 
 #####################################
 
@@ -4410,15 +4933,67 @@ def is_center_on_aabb(body, bottom_aabb, above_epsilon=1e-2, below_epsilon=0.0):
 def is_center_stable(body, surface, **kwargs):
     return is_center_on_aabb(body, get_aabb(surface), **kwargs)
 
+FOOTPRINT_YAWS = 32
+FOOTPRINT_CACHE = {}
+
+
+def get_footprint_key(body):
+    """ bodies loaded from the same asset at the same scale and joint positions share their footprints """
+    info = get_model_info(body)
+    if info is not None and info.path is not None:
+        asset = (info.path, info.scale)
+    else:
+        asset = tuple((data.geometry_type, tuple(data.dimensions), data.filename)
+                      for data in get_collision_data(body))
+    conf = tuple(np.round(get_joint_positions(body, get_movable_joints(body)), 3))
+    return asset, conf
+
+
+def get_footprint_yaws(num_yaws=FOOTPRINT_YAWS):
+    return np.linspace(*CIRCULAR_LIMITS, num=num_yaws, endpoint=False)
+
+
+def get_footprint_index(yaw, num_yaws=FOOTPRINT_YAWS):
+    """ index of the discretized yaw closest to yaw """
+    return int(np.round((wrap_angle(yaw) - CIRCULAR_LIMITS[0]) / (2*PI / num_yaws))) % num_yaws
+
+
+def get_footprints(body, top_pose=unit_pose(), num_yaws=FOOTPRINT_YAWS):
+    """ the aabbs of body relative to its origin when rotated by each yaw of get_footprint_yaws,
+        computed with the simulator once per asset and then shared by all its bodies """
+    key = (get_footprint_key(body), tuple(np.round(top_pose[1], 3)), num_yaws)
+    if key not in FOOTPRINT_CACHE:
+        footprints = []
+        with PoseSaver(body):
+            for yaw in get_footprint_yaws(num_yaws):
+                pose = multiply(Pose(euler=Euler(yaw=yaw)), top_pose)
+                set_pose(body, pose)
+                lower, upper = get_aabb(body)
+                footprints.append(AABB(np.array(lower) - pose[0], np.array(upper) - pose[0]))
+        FOOTPRINT_CACHE[key] = footprints
+    return FOOTPRINT_CACHE[key]
+
+
 def sample_placement_on_aabb(top_body, bottom_aabb, top_pose=unit_pose(),
-                             percent=1.0, max_attempts=50, epsilon=1e-3):
+                             percent=1.0, max_attempts=50, epsilon=1e-3, cached=True):
+    """ cached=True samples among the discretized yaws of get_footprints, only setting the pose of top_body
+        once the placement is found """
     # TODO: transform into the coordinate system of the bottom
     # TODO: maybe I should instead just require that already in correct frame
+    footprints = get_footprints(top_body, top_pose=top_pose) if cached else None
     for _ in range(max_attempts):
-        theta = np.random.uniform(*CIRCULAR_LIMITS)
-        rotation = Euler(yaw=theta)
-        set_pose(top_body, multiply(Pose(euler=rotation), top_pose))
-        center, extent = get_center_extent(top_body)
+        if cached:
+            index = np.random.randint(len(footprints))
+            theta = get_footprint_yaws(len(footprints))[index]
+            rotation = Euler(yaw=theta)
+            extent = get_aabb_extent(footprints[index])
+            offset = -get_aabb_center(footprints[index])
+        else:
+            theta = np.random.uniform(*CIRCULAR_LIMITS)
+            rotation = Euler(yaw=theta)
+            set_pose(top_body, multiply(Pose(euler=rotation), top_pose))
+            center, extent = get_center_extent(top_body)
+            offset = get_point(top_body) - center
         lower = (np.array(bottom_aabb[0]) + percent*extent/2)[:2] # TODO: scale_aabb
         upper = (np.array(bottom_aabb[1]) - percent*extent/2)[:2]
         aabb = AABB(lower, upper)
@@ -4426,7 +5001,7 @@ def sample_placement_on_aabb(top_body, bottom_aabb, top_pose=unit_pose(),
             continue
         x, y = sample_aabb(aabb)
         z = (bottom_aabb[1] + extent/2.)[2] + epsilon
-        point = np.array([x, y, z]) + (get_point(top_body) - center)
+        point = np.array([x, y, z]) + offset
         pose = multiply(Pose(point, rotation), top_pose)
         set_pose(top_body, pose)
         return pose
@@ -4915,6 +5490,7 @@ def is_pose_close(pose, target_pose, pos_tolerance=1e-3, ori_tolerance=1e-3*np.p
         return False
     return True
 
+@profiled('ik')
 def inverse_kinematics(robot, link, target_pose, max_iterations=200, max_time=INF, custom_limits={}, **kwargs):
     start_time = time.time()
     movable_joints = get_movable_joints(robot)
@@ -5036,6 +5612,7 @@ def create_sub_robot(robot, first_joint, target_link):
     assert len(selected_joints) == len(get_movable_joints(sub_robot))
     return sub_robot, selected_joints, sub_target_link
 
+@profiled('ik')
 def multiple_sub_inverse_kinematics(robot, first_joint, target_link, target_pose, max_attempts=1, max_solutions=INF,
                                     max_time=INF, custom_limits={}, first_close=True, **kwargs):
     # TODO: gradient descent using collision_info
@@ -5131,6 +5708,7 @@ def plan_cartesian_motion(robot, first_joint, target_link, waypoint_poses,
     remove_body(sub_robot)
     return solutions
 
+@profiled('ik')
 def sub_inverse_kinematics(robot, first_joint, target_link, target_pose, **kwargs):
     solutions = plan_cartesian_motion(robot, first_joint, target_link, [target_pose], **kwargs)
     if solutions:
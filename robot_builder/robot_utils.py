@@ -1,10 +1,18 @@
 import numpy as np
 import copy
+import json
+import time
+from itertools import combinations, product, islice
+from os.path import join, abspath, dirname, isfile
 
 from pybullet_tools.utils import joint_from_name, get_link_subtree, link_from_name, clone_body, \
     set_all_color, TRANSPARENT, get_max_limit, get_min_limit, get_extend_fn, get_moving_links, \
     set_joint_positions, pairwise_collision, get_link_pose, multiply, set_pose, euler_from_quat, \
-    RED, set_color, get_link_name, get_joints, is_movable, wait_for_user, quat_from_euler, set_renderer
+    RED, set_color, get_link_name, get_joints, is_movable, wait_for_user, quat_from_euler, set_renderer, \
+    get_movable_joints, get_all_links, can_collide, are_links_adjacent, pairwise_link_collision, aabb_overlap, \
+    get_aabb, get_sample_fn, ConfSaver, get_body_name, elapsed_time, get_joint_name, unit_point, \
+    quat_from_pose, point_from_pose, tform_point, angle_between, get_pose, Pose, Euler
+from pybullet_tools.logging_utils import dump_json
 from pybullet_tools.bullet_utils import BASE_LINK, BASE_RESOLUTIONS, BASE_VELOCITIES, BASE_JOINTS, \
     draw_base_limits as draw_base_limits_bb, BASE_LIMITS, nice
 from pybullet_tools.grasp_utils import enumerate_rotational_matrices, \
@@ -175,3 +183,345 @@ def create_mobile_robot(world, load_robot_urdf_fn, robot_class, base_group, join
     for arm in robot.get_all_arms():
         robot.open_arm(arm)
     return robot
+
+
+#####################################
+
+
+NEVER_COLLISIONS_VERSION = 1
+NEVER_COLLISIONS_FROM_FILE = {}  ## path: content of the json file, None if missing or outdated
+
+
+def get_never_collisions_file(robot):
+    """ one table per RobotAPI subclass, e.g. databases/never_collisions_PR2Robot.json """
+    robot_name = robot if isinstance(robot, str) else robot.__class__.__name__
+    return abspath(join(dirname(__file__), '..', 'databases', f'never_collisions_{robot_name}.json'))
+
+
+def compute_never_collisions(robot, num_samples=10000, verbose=True):
+    """ sample configurations of all movable joints and return the non-adjacent link pairs that never collide """
+    body = robot.body
+    joints = get_movable_joints(body)
+    sample_fn = get_sample_fn(body, joints, custom_limits=robot.custom_limits)
+    links = [link for link in get_all_links(body) if can_collide(body, link)]
+    link_pairs = [pair for pair in combinations(links, 2) if not are_links_adjacent(body, *pair)]
+
+    start_time = time.time()
+    collided_pairs = set()
+    with ConfSaver(body):
+        for i in range(num_samples):
+            set_joint_positions(body, joints, sample_fn())
+            aabbs = {link: get_aabb(body, link) for link in links}
+            for link1, link2 in link_pairs:
+                if (link1, link2) in collided_pairs or not aabb_overlap(aabbs[link1], aabbs[link2]):
+                    continue
+                if pairwise_link_collision(body, link1, body, link2):
+                    collided_pairs.add((link1, link2))
+            if verbose and (i + 1) % 100 == 0:
+                print(f'compute_never_collisions({robot.__class__.__name__}) | {i + 1}/{num_samples} samples'
+                      f'\t{len(collided_pairs)}/{len(link_pairs)} pairs collided\t{elapsed_time(start_time):.1f} sec')
+    return [pair for pair in link_pairs if pair not in collided_pairs]
+
+
+def save_never_collisions(robot, num_samples=10000, verbose=True):
+    body = robot.body
+    never_collisions = compute_never_collisions(robot, num_samples=num_samples, verbose=verbose)
+    path = get_never_collisions_file(robot)
+    data = {
+        'version': NEVER_COLLISIONS_VERSION,
+        'robot': robot.__class__.__name__,
+        'body': get_body_name(body),
+        'num_samples': num_samples,
+        'num_links': len(get_all_links(body)),
+        'pairs': [[get_link_name(body, link1), get_link_name(body, link2)] for link1, link2 in never_collisions],
+    }
+    dump_json(data, path, sort_dicts=False)
+    NEVER_COLLISIONS_FROM_FILE.pop(path, None)
+    if verbose:
+        print(f'save_never_collisions | saved {len(never_collisions)} pairs to {path}')
+    return path
+
+
+def load_never_collisions(robot):
+    """ returns the set of (link1, link2) that never collide for the robot, empty if not precomputed """
+    path = get_never_collisions_file(robot)
+    if path not in NEVER_COLLISIONS_FROM_FILE:
+        data = None
+        if isfile(path):
+            data = json.load(open(path, 'r'))
+            if data.get('version') != NEVER_COLLISIONS_VERSION:
+                print(f'load_never_collisions | ignoring {path} of version {data.get("version")}, '
+                      f'expected {NEVER_COLLISIONS_VERSION}')
+                data = None
+        NEVER_COLLISIONS_FROM_FILE[path] = data
+    data = NEVER_COLLISIONS_FROM_FILE[path]
+    if data is None:
+        return set()
+    link_mapping = {get_link_name(robot.body, link): link for link in get_all_links(robot.body)}
+    return {(link_mapping[name1], link_mapping[name2]) for name1, name2 in data['pairs']
+            if (name1 in link_mapping) and (name2 in link_mapping)}
+
+
+#####################################
+
+
+WORKSPACE_MAP_VERSION = 1
+WORKSPACE_MAP_FROM_FILE = {}  ## path: {(arm, grasp_direction): (grid, lower, resolution)}, None if missing or outdated
+WORKSPACE_GRASP_DIRECTIONS = ['top', 'side']
+
+
+def get_workspace_map_file(robot):
+    """ one map per RobotAPI subclass, e.g. databases/workspace_map_PR2Robot.npz """
+    robot_name = robot if isinstance(robot, str) else robot.__class__.__name__
+    return abspath(join(dirname(__file__), '..', 'databases', f'workspace_map_{robot_name}.npz'))
+
+
+def get_grasp_direction(robot, grasp_pose, top_grasp_tolerance=np.pi/4):
+    """ same as grasp_utils.is_top_grasp, 'top' if the gripper points down within top_grasp_tolerance """
+    direction = tform_point((unit_point(), quat_from_pose(grasp_pose)), robot.grasp_direction)
+    return 'top' if angle_between(direction, (0, 0, -1)) <= top_grasp_tolerance else 'side'
+
+
+def get_base_xy_yaw(robot, base_conf):
+    """ the x, y, theta values of a base or base-torso Conf, whose joints may be ordered differently """
+    values = dict(zip([get_joint_name(robot.body, joint) for joint in base_conf.joints], base_conf.values))
+    return tuple(values[name] for name in BASE_JOINTS)
+
+
+def get_base_from_tool_point(tool_pose, base_values):
+    """ the tool point in the frame of the base at (x, y, yaw) """
+    x, y, yaw = base_values
+    dx, dy, z = np.array(point_from_pose(tool_pose)) - np.array([x, y, 0])
+    return np.array([np.cos(yaw) * dx + np.sin(yaw) * dy, -np.sin(yaw) * dx + np.cos(yaw) * dy, z])
+
+
+def compute_workspace_map(robot, arms=None, num_samples=50000, resolution=0.05, num_grown=2, verbose=True):
+    """ sample the torso and arm joints with the base at the origin (forward kinematics only, no collisions)
+        and mark the voxels of the tool points, separately for top and side grasps,
+        then grow the voxels by num_grown so that the test doesn't reject poses between the samples """
+    body = robot.body
+    if arms is None:
+        arms = robot.get_all_arms()
+    base_joints = robot.get_base_joints()
+    torso_joints = [j for j in base_joints if get_joint_name(body, j) not in BASE_JOINTS]
+    workspace_map = {}
+    start_time = time.time()
+    with ConfSaver(body):
+        set_joint_positions(body, [joint_from_name(body, name) for name in BASE_JOINTS], [0, 0, 0])
+        for arm in arms:
+            joints = torso_joints + list(robot.get_arm_joints(arm))
+            sample_fn = get_sample_fn(body, joints, custom_limits=robot.custom_limits)
+            tool_link = link_from_name(body, robot.get_tool_link(arm))
+            tool_from_root = robot.get_tool_from_root(arm)
+            points = {direction: [] for direction in WORKSPACE_GRASP_DIRECTIONS}
+            for i in range(num_samples):
+                set_joint_positions(body, joints, sample_fn())
+                tool_pose = get_link_pose(body, tool_link)
+                direction = get_grasp_direction(robot, multiply(tool_pose, tool_from_root))
+                points[direction].append(point_from_pose(tool_pose))
+            for direction, direction_points in points.items():
+                if len(direction_points) == 0:
+                    continue
+                indices = np.floor(np.array(direction_points) / resolution).astype(int)
+                lower = indices.min(axis=0) - num_grown
+                grid = np.zeros(indices.max(axis=0) - lower + num_grown + 1, dtype=bool)
+                grid[tuple((indices - lower).T)] = True
+                grown = grid.copy()
+                for offset in product(range(-num_grown, num_grown + 1), repeat=3):
+                    grown |= np.roll(grid, offset, axis=(0, 1, 2))
+                workspace_map[arm, direction] = (grown, lower * resolution, resolution)
+                if verbose:
+                    print(f'compute_workspace_map({robot.__class__.__name__}) | {arm} {direction}\t'
+                          f'{len(direction_points)} samples\t{grown.sum()} voxels\t{elapsed_time(start_time):.1f} sec')
+    return workspace_map
+
+
+def save_workspace_map(robot, num_samples=50000, resolution=0.05, num_grown=2, verbose=True):
+    workspace_map = compute_workspace_map(robot, num_samples=num_samples, resolution=resolution,
+                                          num_grown=num_grown, verbose=verbose)
+    path = get_workspace_map_file(robot)
+    arrays = {}
+    for (arm, direction), (grid, lower, resolution) in workspace_map.items():
+        arrays[f'{arm}:{direction}:grid'] = grid
+        arrays[f'{arm}:{direction}:lower'] = lower
+        arrays[f'{arm}:{direction}:resolution'] = resolution
+    np.savez_compressed(path, version=WORKSPACE_MAP_VERSION, robot=robot.__class__.__name__,
+                        num_samples=num_samples, **arrays)
+    WORKSPACE_MAP_FROM_FILE.pop(path, None)
+    if verbose:
+        print(f'save_workspace_map | saved {len(workspace_map)} maps to {path}')
+    return path
+
+
+def load_workspace_map(robot):
+    """ returns {(arm, 'top' | 'side'): (grid, lower, resolution)}, None if not precomputed """
+    path = get_workspace_map_file(robot)
+    if path not in WORKSPACE_MAP_FROM_FILE:
+        workspace_map = None
+        if isfile(path):
+            data = np.load(path)
+            if data['version'] != WORKSPACE_MAP_VERSION:
+                print(f'load_workspace_map | ignoring {path} of version {data["version"]}, '
+                      f'expected {WORKSPACE_MAP_VERSION}')
+            else:
+                workspace_map = {}
+                for key in data.files:
+                    if key.endswith(':grid'):
+                        arm, direction, _ = key.split(':')
+                        workspace_map[arm, direction] = (data[key], data[f'{arm}:{direction}:lower'],
+                                                         float(data[f'{arm}:{direction}:resolution']))
+        WORKSPACE_MAP_FROM_FILE[path] = workspace_map
+    return WORKSPACE_MAP_FROM_FILE[path]
+
+
+def is_reachable_in_workspace(robot, arm, grasp_pose, base_conf):
+    """ O(1) lookup of the tool point in the workspace map of the arm, None if there is no map """
+    workspace_map = load_workspace_map(robot)
+    if workspace_map is None:
+        return None
+    key = (arm, get_grasp_direction(robot, grasp_pose))
+    if key not in workspace_map:
+        return False
+    grid, lower, resolution = workspace_map[key]
+    tool_pose = robot.get_tool_pose_for_ik(arm, grasp_pose)
+    base_values = get_base_xy_yaw(robot, base_conf)
+    index = np.floor((get_base_from_tool_point(tool_pose, base_values) - lower) / resolution).astype(int)
+    if np.any(index < 0) or np.any(index >= grid.shape):
+        return False
+    return bool(grid[tuple(index)])
+
+
+#####################################
+
+
+GRASP_SCORES_VERSION = 1
+GRASP_SCORES_FROM_FILE = {}  ## path: {instance_name: {arm: (grasps, scores)}}, None if missing or outdated
+GRASP_SCORE_HEIGHTS = (0.6, 1.1)  ## range of the heights of the surfaces that objects are picked from
+
+
+def get_grasp_scores_file(robot):
+    """ one table per RobotAPI subclass, e.g. databases/grasp_scores_PR2Robot.json """
+    robot_name = robot if isinstance(robot, str) else robot.__class__.__name__
+    return abspath(join(dirname(__file__), '..', 'databases', f'grasp_scores_{robot_name}.json'))
+
+
+def compute_grasp_scores(robot, world, bodies, arms=None, num_poses=10, num_bases=5,
+                         heights=GRASP_SCORE_HEIGHTS, verbose=True):
+    """ for each hand grasp of the bodies, the fraction of IK calls that succeed with the body at num_poses
+        random heights and yaws and the base at num_bases confs each, drawn from the inverse reachability database
+        like get_ir_sampler(), without any obstacle """
+    from pybullet_tools.grasp_utils import get_hand_grasps
+    from pybullet_tools.pr2_utils import learned_pose_generator_vectorized
+
+    if arms is None:
+        arms = robot.get_all_arms()
+    base_joints = robot.get_base_joints()
+    torso_z = robot.get_base_positions()[2] if robot.use_torso else None
+    grasp_scores = {}
+    start_time = time.time()
+    for body in bodies:
+        instance_name = world.get_instance_name(body)
+        if instance_name is None:
+            continue
+        grasps = get_hand_grasps(world, body, verbose=False)
+        if not grasps:
+            continue
+        point, quat = get_pose(body)
+        z = point[2] - get_aabb(body)[0][2]  ## of the body origin above its bottom
+        body_poses = [multiply(Pose(point=(0, 0, z + np.random.uniform(*heights)),
+                                    euler=Euler(yaw=np.random.uniform(-np.pi, np.pi))), (unit_point(), quat))
+                      for _ in range(num_poses)]
+        grasp_scores[instance_name] = {}
+        with ConfSaver(body):
+            with ConfSaver(robot.body):
+                for arm in arms:
+                    arm_joints = robot.get_arm_joints(arm)
+                    scores = []
+                    for grasp in grasps:
+                        successes = attempts = 0
+                        for body_pose in body_poses:
+                            set_pose(body, body_pose)
+                            gripper_pose = robot.get_grasp_pose(body_pose, grasp, arm, body=body)
+                            ## the ir sampler looks up all hand grasps in the database of top grasps
+                            base_generator = learned_pose_generator_vectorized(robot, gripper_pose, arm=arm,
+                                                                               grasp_type='top')
+                            for base_conf in islice(base_generator, num_bases):
+                                if robot.use_torso:
+                                    x, y, theta = base_conf
+                                    base_conf = (x, y, torso_z + np.random.uniform(0, 0.2), theta)
+                                set_joint_positions(robot.body, base_joints, base_conf)
+                                set_joint_positions(robot.body, arm_joints, robot.get_carry_conf(arm, 'hand', grasp))
+                                attempts += 1
+                                if robot.inverse_kinematics(arm, gripper_pose, [], verbose=False) is not None:
+                                    successes += 1
+                        scores.append(successes / attempts if attempts > 0 else 0.)
+                    grasp_scores[instance_name][arm] = (grasps, scores)
+                    if verbose:
+                        print(f'compute_grasp_scores({robot.__class__.__name__}) | {instance_name} {arm}\t'
+                              f'scores = {nice(scores, 2)}\t{elapsed_time(start_time):.1f} sec')
+    return grasp_scores
+
+
+def save_grasp_scores(robot, world, bodies, num_poses=10, num_bases=5, verbose=True):
+    """ the scores of other instances already in the file are kept """
+    grasp_scores = compute_grasp_scores(robot, world, bodies, num_poses=num_poses, num_bases=num_bases,
+                                        verbose=verbose)
+    path = get_grasp_scores_file(robot)
+    data = {
+        'version': GRASP_SCORES_VERSION,
+        'robot': robot.__class__.__name__,
+        'num_poses': num_poses,
+        'num_bases': num_bases,
+        'scores': {},
+    }
+    if isfile(path):
+        old_data = json.load(open(path, 'r'))
+        if old_data.get('version') == GRASP_SCORES_VERSION:
+            data['scores'] = old_data['scores']
+    for instance_name, arm_scores in grasp_scores.items():
+        data['scores'][instance_name] = {
+            arm: [list(nice(point, 4)) + list(nice(quat, 4)) + [round(score, 3)]
+                  for (point, quat), score in zip(grasps, scores)]
+            for arm, (grasps, scores) in arm_scores.items()
+        }
+    dump_json(data, path, sort_dicts=False)
+    GRASP_SCORES_FROM_FILE.pop(path, None)
+    if verbose:
+        print(f'save_grasp_scores | saved the grasp scores of {len(grasp_scores)} instances to {path}')
+    return path
+
+
+def load_grasp_scores(robot):
+    """ returns {instance_name: {arm: (points, quats, scores)}} as arrays, None if not precomputed """
+    path = get_grasp_scores_file(robot)
+    if path not in GRASP_SCORES_FROM_FILE:
+        grasp_scores = None
+        if isfile(path):
+            data = json.load(open(path, 'r'))
+            if data.get('version') != GRASP_SCORES_VERSION:
+                print(f'load_grasp_scores | ignoring {path} of version {data.get("version")}, '
+                      f'expected {GRASP_SCORES_VERSION}')
+            else:
+                grasp_scores = {}
+                for instance_name, arm_scores in data['scores'].items():
+                    grasp_scores[instance_name] = {}
+                    for arm, rows in arm_scores.items():
+                        rows = np.array(rows).reshape(-1, 8)
+                        grasp_scores[instance_name][arm] = (rows[:, :3], rows[:, 3:7], rows[:, 7])
+        GRASP_SCORES_FROM_FILE[path] = grasp_scores
+    return GRASP_SCORES_FROM_FILE[path]
+
+
+def get_grasp_score(robot, instance_name, arm, grasp, quat_tolerance=1e-3):
+    """ the score of the saved grasp of the same orientation with the nearest position,
+        which also matches the grasps scaled for another instance scale, None if there is none """
+    grasp_scores = load_grasp_scores(robot)
+    if grasp_scores is None or arm not in grasp_scores.get(instance_name, {}):
+        return None
+    points, quats, scores = grasp_scores[instance_name][arm]
+    point, quat = grasp
+    matches = 1 - np.abs(np.dot(quats, quat)) < quat_tolerance  ## q and -q are the same rotation
+    if not np.any(matches):
+        return None
+    distances = np.linalg.norm(points[matches] - np.array(point), axis=1)
+    return float(scores[matches][np.argmin(distances)])
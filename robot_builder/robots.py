@@ -15,7 +15,7 @@ from pybullet_tools.utils import get_joint_positions, clone_body, set_all_color,
     sub_inverse_kinematics, Point, get_collision_fn, get_aabb_center, get_max_limit
 
 from pybullet_tools.bullet_utils import equal, nice, is_tuple, get_links_collided, \
-    collided, query_yes_no, has_tracik, is_mesh_entity, get_rotation_matrix
+    collided, query_yes_no, has_tracik, is_mesh_entity, get_rotation_matrix, IKCache
 from pybullet_tools.camera_utils import set_camera_target_body
 from pybullet_tools.pose_utils import Attachment
 from pybullet_tools.pr2_streams import SELF_COLLISIONS
@@ -32,7 +32,7 @@ from world_builder.world_utils import load_asset
 
 from robot_builder.robot_utils import get_robot_group_joints, close_until_collision, \
     create_robot_gripper, BASE_GROUP, BASE_TORSO_GROUP, get_cloned_gripper_joints, \
-    get_joints_by_names, test_tool_from_root_transformations
+    get_joints_by_names, test_tool_from_root_transformations, load_never_collisions
 
 
 class RobotAPI(Robot):
@@ -58,10 +58,13 @@ class RobotAPI(Robot):
         self.possible_obstacles = {}  ## body: obstacles
         self.collision_animations = []
         self.ik_solvers = {arm: None for arm in self.arms}
+        self.ik_cache = None  ## IKCache of arm solutions by relative tool pose, see enable_ik_cache()
+        self.batch_ik = False  ## solve IKFast over a grid of free joint values at once, see solve_ik_once()
         self.debug_handles = []
         self.remove_operators = None
 
         self.collided_body_link = defaultdict(int)
+        self._never_collisions = None  ## loaded lazily by get_disabled_collisions()
 
     def reset_log_collisions(self):
         self.collided_body_link = defaultdict(int)
@@ -145,6 +148,21 @@ class RobotAPI(Robot):
     def get_custom_limits(self):
         return self.custom_limits
 
+    def get_disabled_collisions(self):
+        """ link pairs that never collide, precomputed by tutorials/create_never_collisions.py,
+            and those given to the constructor """
+        if self._never_collisions is None:
+            self._never_collisions = self.load_never_collisions()
+        disabled_collisions = self.disabled_collisions
+        if not disabled_collisions:
+            return self._never_collisions
+        if isinstance(disabled_collisions, dict):
+            disabled_collisions = disabled_collisions.items()
+        return self._never_collisions | set(map(tuple, disabled_collisions))
+
+    def load_never_collisions(self):
+        return load_never_collisions(self)
+
     def iterate_approach_path(self, arm, gripper, pose_value, grasp, body=None, visualize=False):
         if visualize:
             set_all_color(gripper, RED)
@@ -241,6 +259,12 @@ class RobotAPI(Robot):
         """ otherwise cannot pickle 'SwigPyObject' object """
         self.ik_solvers = {arm: None for arm in self.arms}
 
+    def enable_ik_cache(self, **kwargs):
+        """ reuse or warm start from the arm solutions of nearly the same relative tool pose in run_ik_once """
+        if self.ik_cache is None:
+            self.ik_cache = IKCache(**kwargs)
+        return self.ik_cache
+
     ###############################################################################
 
     def get_grasp_pose(self, body_pose, grasp, arm='left', body=None, verbose=False):
@@ -466,6 +490,7 @@ class MobileRobot(RobotAPI):
 
     arms = None
     grasp_types = ['top', 'side']
+    base_radius = None  ## inscribed radius of the base footprint, for the occupancy test of the ir sampler
 
     def __init__(self, body, use_torso=True, **kwargs):
         # joints = self.joint_groups[self.base_group]
@@ -659,6 +684,22 @@ class MobileRobot(RobotAPI):
     ## -------------------------------------------------------------
 
     def run_ik_once(self, arm, tool_pose, tool_link, arm_joint):
+        """ with self.ik_cache, the solution for the same relative tool pose is returned directly
+            and the one for a nearby pose is set as the current arm conf, which seeds TracIK and IKFast """
+        if self.ik_cache is None:
+            return self.solve_ik_once(arm, tool_pose, tool_link, arm_joint)
+        base_from_tool = self.ik_cache.get_base_from_tool(self.body, arm_joint, tool_pose)
+        arm_conf, exact = self.ik_cache.lookup(arm, base_from_tool)
+        if exact:
+            return arm_conf
+        if arm_conf is not None:
+            self.set_joint_positions(self.get_arm_joints(arm), arm_conf)
+        arm_conf = self.solve_ik_once(arm, tool_pose, tool_link, arm_joint)
+        if arm_conf is not None:
+            self.ik_cache.add(arm, base_from_tool, arm_conf)
+        return arm_conf
+
+    def solve_ik_once(self, arm, tool_pose, tool_link, arm_joint):
         """ by default, assume IKFast is not compiled """
         kwargs = dict(custom_limits=self.custom_limits)
         if has_tracik():
@@ -672,6 +713,10 @@ class MobileRobot(RobotAPI):
             from pybullet_tools.ikfast.pr2.ik import pr2_inverse_kinematics, is_ik_compiled, USE_CURRENT
             if is_ik_compiled():
                 # TODO(caelan): sub_inverse_kinematics's clone_body has large overhead
+                if self.batch_ik:
+                    ## the grid covers the upper arm roll, the solution closest to the current conf is returned
+                    return pr2_inverse_kinematics(self.body, arm, tool_pose, **kwargs,
+                                                  batch=True, nearby_conf=USE_CURRENT)
                 return pr2_inverse_kinematics(self.body, arm, tool_pose, **kwargs,
                                               upper_limits=USE_CURRENT, nearby_conf=USE_CURRENT)
             tool_link = link_from_name(self.body, tool_link)
@@ -780,6 +825,7 @@ class PR2Robot(MobileRobot):
     joint_group_names = ['left', 'right', BASE_GROUP, BASE_TORSO_GROUP]
     tool_from_hand = Pose(euler=Euler(math.pi / 2, 0, -math.pi / 2))
     cloned_finger_link = 7  ## for detecting if a grasp is pointing upwards
+    base_radius = 0.3
 
     torso_lift_joint = 'torso_lift_joint'
     head_pan_joint = 'head_pan_joint'
@@ -797,6 +843,11 @@ class PR2Robot(MobileRobot):
     def open_arm(self, arm):
         open_arm(self.body, arm)
 
+    def load_never_collisions(self):
+        """ also the hand-written table in pr2_never_collisions.py """
+        from pybullet_tools.pr2_utils import get_disabled_collisions
+        return load_never_collisions(self) | get_disabled_collisions(self.body)
+
     # def get_finger_link(self, arm):
     #     link_name = 'l_gripper_l_finger_link' if arm == 'left' else 'r_gripper_l_finger_link'
     #     raise link_from_name(self.body, link_name)
@@ -1086,7 +1137,8 @@ class PR2Robot(MobileRobot):
         tool_from_root = self.get_tool_from_root(arm)
         gripper_pose = multiply(robot.get_grasp_pose(pose.value, pose_value, body=obj), invert(tool_from_root))
 
-        grasp_conf = pr2_inverse_kinematics(robot, arm, gripper_pose, custom_limits=custom_limits) #, upper_limits=USE_CURRENT)
+        grasp_conf = pr2_inverse_kinematics(robot, arm, gripper_pose, custom_limits=custom_limits,
+                                            batch=self.batch_ik) #, upper_limits=USE_CURRENT)
                                                 #nearby_conf=USE_CURRENT) # upper_limits=USE_CURRENT,
 
         count_down = grasp_conf_tries
@@ -1103,7 +1155,8 @@ class PR2Robot(MobileRobot):
                 #    #wait_if_gui()
 
                 return None
-            grasp_conf = pr2_inverse_kinematics(robot, arm, gripper_pose, custom_limits=custom_limits)
+            grasp_conf = pr2_inverse_kinematics(robot, arm, gripper_pose, custom_limits=custom_limits,
+                                                batch=self.batch_ik)
             count_down -= 1
 
         if verbose:
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+from os import listdir
+from os.path import join
+
+from pybullet_tools.database_utils import convert_pickled_database
+from world_builder.paths import DATABASES_PATH
+
+
+def main():
+    """ convert the inverse reachability and learned sampler pickles to memory-mapped columnar databases,
+        which are then loaded instead of the pickles until the pickles change """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--prefix', type=str, nargs='*', default=['nvidia_kitchen_'],
+                        help='Prefixes of the learned sampler databases, besides the *_ir.pickle databases')
+    args = parser.parse_args()
+
+    for name in sorted(listdir(DATABASES_PATH)):
+        if not name.endswith('.pickle'):
+            continue
+        if not (name.endswith('_ir.pickle') or any(name.startswith(prefix) for prefix in args.prefix)):
+            continue
+        for path in convert_pickled_database(join(DATABASES_PATH, name)):
+            print('Wrote:', path)
+
+
+if __name__ == '__main__':
+    main()
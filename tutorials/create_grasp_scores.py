@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+
+from pybullet_tools.utils import connect, disconnect, set_random_seed, set_numpy_seed
+
+from world_builder.world import World
+from world_builder.entities import Movable
+from world_builder.world_utils import load_asset
+from robot_builder.robot_builders import build_robot_from_args
+from robot_builder.robot_utils import save_grasp_scores
+
+from tutorials.test_utils import get_instances
+
+
+def main():
+    """ precompute the ik success rate of the saved hand grasps of each instance, loaded by get_grasp_gen(ranked=True) """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--robot', type=str, default='pr2', choices=['pr2'])
+    parser.add_argument('-c', '--categories', type=str, nargs='+', default=['Food', 'Bottle', 'Medicine'])
+    parser.add_argument('-n', type=int, default=10, help='Number of object poses sampled per grasp')
+    parser.add_argument('-b', type=int, default=5, help='Number of base confs sampled per object pose')
+    parser.add_argument('-v', '--viewer', action='store_true', help='Enables the PyBullet viewer')
+    args = parser.parse_args()
+
+    set_random_seed(0)
+    set_numpy_seed(0)
+    connect(use_gui=args.viewer)
+    world = World()
+    robot = build_robot_from_args(world, args.robot, initial_xy=(0, 0), use_torso=True,
+                                  custom_limits=((-4, -4, 0), (4, 4, 2)))
+    bodies = []
+    for i, category in enumerate(args.categories):
+        for j, instance in enumerate(get_instances(category)):
+            cat = category
+            if isinstance(instance, tuple):
+                cat, instance = instance
+            obj = world.add_object(Movable(load_asset(cat, x=2 + j, y=2 + i, random_instance=instance),
+                                           category=cat))
+            bodies.append(obj.body)
+    save_grasp_scores(robot, world, bodies, num_poses=args.n, num_bases=args.b)
+    disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+
+from pybullet_tools.utils import connect, disconnect, set_random_seed, set_numpy_seed
+
+from world_builder.world import World
+from robot_builder.robot_builders import build_robot_from_args
+from robot_builder.robot_utils import save_never_collisions
+
+
+def main():
+    """ precompute the link pairs that never collide for a robot, loaded by get_collision_fn afterwards """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--robot', type=str, default='pr2', choices=['pr2', 'spot', 'feg'])
+    parser.add_argument('-n', type=int, default=10000, help='Number of configurations sampled')
+    parser.add_argument('-v', '--viewer', action='store_true', help='Enables the PyBullet viewer')
+    args = parser.parse_args()
+
+    set_random_seed(0)
+    set_numpy_seed(0)
+    connect(use_gui=args.viewer)
+    world = World()
+    kwargs = dict(initial_xy=(0, 0), custom_limits=((-4, -4, 0), (4, 4, 2)))
+    if args.robot != 'feg':
+        kwargs['use_torso'] = True
+    robot = build_robot_from_args(world, args.robot, **kwargs)
+    save_never_collisions(robot, num_samples=args.n)
+    disconnect()
+
+
+if __name__ == '__main__':
+    main()
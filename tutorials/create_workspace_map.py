@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+
+from pybullet_tools.utils import connect, disconnect, set_random_seed, set_numpy_seed
+
+from world_builder.world import World
+from robot_builder.robot_builders import build_robot_from_args
+from robot_builder.robot_utils import save_workspace_map
+
+
+def main():
+    """ precompute the voxels reachable by the tool of each arm, loaded by the test-inverse-reachability stream """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--robot', type=str, default='pr2', choices=['pr2', 'spot'])
+    parser.add_argument('-n', type=int, default=50000, help='Number of configurations sampled per arm')
+    parser.add_argument('--resolution', type=float, default=0.05, help='Size of the voxels')
+    parser.add_argument('-v', '--viewer', action='store_true', help='Enables the PyBullet viewer')
+    args = parser.parse_args()
+
+    set_random_seed(0)
+    set_numpy_seed(0)
+    connect(use_gui=args.viewer)
+    world = World()
+    robot = build_robot_from_args(world, args.robot, initial_xy=(0, 0), use_torso=True,
+                                  custom_limits=((-4, -4, 0), (4, 4, 2)))
+    save_workspace_map(robot, num_samples=args.n, resolution=args.resolution)
+    disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+from __future__ import print_function
+
+import time
+import argparse
+
+import numpy as np
+
+from pybullet_tools.utils import connect, disconnect, create_box, set_point, get_sample_fn, \
+    set_random_seed, set_numpy_seed, BROADPHASE_MODES, get_collision_fn, get_batch_collision_fn, ConfSaver, \
+    TAN, GREY, GREEN
+from pybullet_tools.pr2_problems import create_floor
+
+from world_builder.world import World
+from world_builder.entities import Object, Movable
+from robot_builder.robot_builders import create_pr2_robot
+
+
+def create_box_kitchen(world, num_movables=40, seed=0):
+    """ a PR2 kitchen made of boxes: counters and cabinets along three walls, movables on top """
+    rng = np.random.RandomState(seed)
+    world.add_object(Object(create_floor(), category='floor'))
+    counters = []
+    for i in range(8):
+        for wall_x, wall_y, dx, dy in [(1.5, None, 0, 1), (None, 2.0, 1, 0), (None, -2.0, 1, 0)]:
+            x = wall_x if wall_x is not None else -1.5 + 0.6 * i * dx
+            y = wall_y if wall_y is not None else -2.1 + 0.6 * i * dy
+            counter = create_box(0.6, 0.6, 0.9, color=TAN)
+            set_point(counter, (x, y, 0.45))
+            counters.append(world.add_object(Object(counter, category='counter')))
+            cabinet = create_box(0.4, 0.6, 0.6, color=GREY)
+            set_point(cabinet, (x, y, 1.8))
+            world.add_object(Object(cabinet, category='cabinet'))
+    for i in range(num_movables):
+        counter = counters[rng.randint(len(counters))]
+        x, y, _ = counter.get_pose()[0]
+        movable = create_box(0.06, 0.06, 0.15, mass=1, color=GREEN)
+        set_point(movable, (x + rng.uniform(-0.25, 0.25), y + rng.uniform(-0.25, 0.25), 0.9 + 0.075))
+        world.add_object(Movable(movable, category='bottle'))
+    return [b for b in world.BODY_TO_OBJECT if b != world.robot.body]
+
+
+def benchmark_collision_fn(collision_fn, confs):
+    start_time = time.time()
+    collisions = [collision_fn(q) for q in confs]
+    duration = time.time() - start_time
+    return collisions, len(confs) / duration
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=1000, help='Number of configurations checked')
+    parser.add_argument('-g', '--group', type=str, default='left_arm', help='Joint group of PR2')
+    parser.add_argument('-v', '--viewer', action='store_true', help='Enables the PyBullet viewer')
+    args = parser.parse_args()
+
+    set_random_seed(0)
+    set_numpy_seed(0)
+    connect(use_gui=args.viewer)
+    world = World()
+    robot = create_pr2_robot(world, base_q=(0.8, 0, 0))
+    obstacles = create_box_kitchen(world)
+    joints = robot.get_group_joints(args.group)
+    sample_fn = get_sample_fn(robot, joints, custom_limits=robot.custom_limits)
+    confs = [sample_fn() for _ in range(args.n)]
+    print(f'checking {args.n} {args.group} confs against {len(obstacles)} obstacles')
+
+    kwargs = dict(obstacles=obstacles, self_collisions=robot.self_collisions,
+                  custom_limits=robot.custom_limits, use_aabb=True)
+    results = {}
+    with ConfSaver(robot):
+        for instrumented in [True, False]:
+            for broadphase in BROADPHASE_MODES:
+                collision_fn = get_collision_fn(robot, joints, instrumented=instrumented,
+                                                broadphase=broadphase, **kwargs)
+                collisions, rate = benchmark_collision_fn(collision_fn, confs)
+                results[instrumented, broadphase] = collisions
+                print(f'instrumented={instrumented}\t broadphase={broadphase}\t '
+                      f'{rate:.1f} checks/sec\t {sum(collisions)} in collision')
+        for broadphase in BROADPHASE_MODES:
+            batch_collision_fn = get_batch_collision_fn(robot, joints, broadphase=broadphase, **kwargs)
+            start_time = time.time()
+            collisions = list(batch_collision_fn(confs))
+            rate = len(confs) / (time.time() - start_time)
+            results['batch', broadphase] = collisions
+            print(f'batch\t broadphase={broadphase}\t {rate:.1f} checks/sec\t {sum(collisions)} in collision')
+    assert all(collisions == results[True, None] for collisions in results.values())
+    disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -12,7 +12,7 @@ from pybullet_tools.utils import get_joint_name, get_joint_position, get_link_na
     quat_from_euler, get_link_subtree
 from pybullet_tools.bullet_utils import BASE_LINK, is_box_entity, collided, nice, BASE_RESOLUTIONS, colorize_link
 from pybullet_tools.pose_utils import sample_obj_in_body_link_space, sample_obj_on_body_link_surface, \
-    create_attachment, change_pose_interactive
+    create_attachment, change_pose_interactive, FreeSpaceMap, sample_free_space_placement
 from pybullet_tools.camera_utils import get_camera_image_at_pose, set_camera_target_body
 
 from world_builder.world_utils import get_mobility_id, get_mobility_category, get_mobility_identifier, \
@@ -164,6 +164,8 @@ class Object(Index):
         obj.supporting_surface = self
         if obj not in self.supported_objects:
             self.supported_objects.append(obj)
+        if getattr(self, 'free_space_map', None) is not None:
+            self.free_space_map.add(obj.body)
 
     def attach_obj(self, obj):
         link = self.link if self.link is not None else -1
@@ -212,6 +214,18 @@ class Object(Index):
                     # if visualize:
                     #     wait_unlocked()
 
+        if not done and isinstance(self, (Surface, Space)):
+            for _ in range(max_trial):
+                placement = self.sample_free_placement(obj)
+                if placement is None:
+                    break
+                x, y, z, yaw = placement
+                body_pose = Pose(point=Point(x=x, y=y, z=z), euler=Euler(yaw=yaw))
+                set_pose(obj, body_pose)
+                if not collided(obj, obstacles, tag='place_obj_free_space', world=world, verbose=False):
+                    done = True
+                    break
+
         start_time = time.time()
         place_fn = sample_obj_in_body_link_space if isinstance(self, Space) else sample_obj_on_body_link_surface
         while not done:
@@ -245,6 +259,8 @@ class Object(Index):
                 print(f'REMOVED {self} supporting_surface ({self.supporting_surface})')
             if self in self.supporting_surface.supported_objects:
                 self.supporting_surface.supported_objects.remove(self)
+            if getattr(self.supporting_surface, 'free_space_map', None) is not None:
+                self.supporting_surface.free_space_map.remove(self.body)
             self.supporting_surface = None
 
     def change_supporting_surface(self, obj):
@@ -560,6 +576,21 @@ class Region(Object):
     def __init__(self, body, governing_joints=[], **kwargs):
         super(Region, self).__init__(body, collision=False, **kwargs)
         self.governing_joints = governing_joints
+        self.free_space_map = None
+
+    def get_free_space_map(self, ignored=[], **kwargs):
+        """ rebuilt when the region has moved, e.g. the drawer was opened, else updated incrementally """
+        aabb = self.aabb()
+        if self.free_space_map is None or not np.allclose(self.free_space_map.aabb, aabb, atol=1e-3):
+            self.free_space_map = FreeSpaceMap(aabb, **kwargs)
+        self.free_space_map.update([o.body for o in self.supported_objects if o.body not in ignored])
+        return self.free_space_map
+
+    def sample_free_placement(self, obj, **kwargs):
+        """ x, y, z, yaw of obj in a cell of the region not covered by the objects it already supports """
+        body = obj.body if isinstance(obj, Object) else obj
+        free_space_map = self.get_free_space_map(ignored=[body])
+        return sample_free_space_placement(body, free_space_map, on_top=not isinstance(self, Space), **kwargs)
 
     def set_governing_joints(self, governing_joints):
         """ (body, joint) pairs that change the pose of (body, link) """
@@ -13,6 +13,7 @@ from pybullet_tools.pose_utils import sample_pose, xyzyaw_to_pose, sample_center
 from pybullet_tools.bullet_utils import nice, collided, equal
 from pybullet_tools.logging_utils import print_dict
 from pybullet_tools.general_streams import Position
+from pybullet_tools.database_utils import has_columnar_database, load_columnar_database
 
 from world_builder.paths import DATABASES_PATH
 from world_builder.world_utils import sort_body_indices, RIGHT, LEFT, ABOVE, BELOW
@@ -1026,8 +1027,11 @@ def learned_nvidia_bconf_list_gen(world, inputs, verbose=True, num_samples=5):
 
 
 def load_database(world, name):
+    """ the memory-mapped columnar database if converted, see pybullet_tools.database_utils """
     dual_arm = '' if not world.robot.dual_arm else 'dual_arm_'
     pickled_path = join(DATABASES_PATH, f'nvidia_kitchen_{dual_arm}{name}.pickle')
+    if has_columnar_database(pickled_path):
+        return load_columnar_database(pickled_path)
     return pickle.load(open(pickled_path, 'rb'))
 
 
@@ -1059,7 +1063,20 @@ def learned_nvidia_pickled_pose_list_gen(world, body, surfaces, num_samples=30,
     return results
 
 
-def learned_nvidia_pickled_bconf_list_gen(world, inputs, num_samples=30, verbose=False):
+def get_pose_kdtrees(p_to_q_database):
+    """ for each (arm, object, grasp) key, its list of pose keys and a KD-tree over them """
+    from scipy.spatial import cKDTree
+    kdtrees = {}
+    for key, p_to_q in p_to_q_database.items():
+        poses = list(p_to_q.keys())
+        kdtrees[key] = (poses, cKDTree(np.asarray(poses)))
+    return kdtrees
+
+
+def learned_nvidia_pickled_bconf_list_gen(world, inputs, num_samples=30, num_nearest=1, max_distance=0.1,
+                                          verbose=False):
+    """ when the pose isn't in the database, the base confs of its num_nearest poses
+        that are within max_distance in every dimension are returned """
     from pybullet_tools.pr2_primitives import Pose
 
     if world.learned_bconf_database is None:
@@ -1067,6 +1084,7 @@ def learned_nvidia_pickled_bconf_list_gen(world, inputs, num_samples=30, verbose
         world.learned_bconf_database = {
             p: load_database(world, name=p) for p in database_names
         }
+        world.learned_bconf_database['aog_kdtrees'] = get_pose_kdtrees(world.learned_bconf_database['aog_to_p_to_q'])
 
     robot = world.robot
     joints = robot.get_group_joints('base-torso')
@@ -1096,13 +1114,12 @@ def learned_nvidia_pickled_bconf_list_gen(world, inputs, num_samples=30, verbose
             if key2 in p_to_q:
                 results = p_to_q[key2]
             else:
-                keys = np.asarray(list(p_to_q.keys()))
-                diff = keys - np.asarray(key2)
-                min_index = np.argmin(np.sum(diff*diff, axis=1))
-                min_diff = diff[min_index]
-                if np.max(np.abs(min_diff)) < 0.1:
-                    key_found = list(p_to_q.keys())[min_index]
-                    results = p_to_q[key_found]
+                poses, kdtree = world.learned_bconf_database['aog_kdtrees'][key]
+                _, indices = kdtree.query(key2, k=min(num_nearest, len(poses)))
+                keys_found = [poses[i] for i in np.atleast_1d(indices)
+                              if np.max(np.abs(np.asarray(poses[i]) - key2)) < max_distance]
+                if len(keys_found) > 0:
+                    results = [q for key_found in keys_found for q in p_to_q[key_found]]
                 elif verbose:
                     print(f'learned_nvidia_pickled_aog_to_p_to_q({key2}) not found in database')
 
@@ -8,6 +8,7 @@ import shutil
 from os.path import join, isdir, abspath, basename, isfile
 import os
 import json
+import hashlib
 import numpy as np
 from pprint import pformat, pprint
 
@@ -20,18 +21,19 @@ from pybullet_tools.utils import get_max_velocities, WorldSaver, elapsed_time, g
     get_movable_joints, apply_alpha, get_all_links, set_color, set_all_color, dump_body, clear_texture, \
     get_link_name, get_aabb, draw_aabb, GREY, GREEN, quat_from_euler, wait_for_user, get_camera_matrix, \
     Euler, PI, get_center_extent, create_box, RED, unit_quat, set_joint_position, get_joint_limits, \
-    get_camera_pose
+    get_camera_pose, get_joint_roadmap
 from pybullet_tools.pr2_streams import Position, get_handle_grasp_gen, pr2_grasp
 from pybullet_tools.general_streams import pose_from_attachment, LinkPose, RelPose
 from pybullet_tools.bullet_utils import set_zero_world, nice, open_joint, summarize_joints, get_point_distance, \
     add_body, close_joint, toggle_joint, check_joint_state, \
     nice, LINK_STR, CAMERA_MATRIX, equal, sort_body_parts, get_root_links, colorize_world, colorize_link, \
-    draw_fitted_box, find_closest_match, multiply_quat, is_joint_open, get_merged_aabb, tupify
+    draw_fitted_box, find_closest_match, multiply_quat, is_joint_open, get_merged_aabb, tupify, tupify_arr, \
+    CollisionCache
 from pybullet_tools.pose_utils import ObjAttachment, draw_pose2d_path, draw_pose3d_path, xyzyaw_to_pose, \
     is_placement, is_contained, get_learned_yaw
 from pybullet_tools.camera_utils import get_pose2d, get_camera_image_at_pose, visualize_camera_image, \
     set_camera_target_body, set_camera_target_body
-from pybullet_tools.logging_utils import print_dict, myprint, print_debug, print_pink
+from pybullet_tools.logging_utils import print_dict, myprint, print_debug, print_pink, StreamProfiler
 
 from pybullet_tools.pr2_primitives import Pose, Conf, get_ik_ir_gen, get_motion_gen, \
     Attach, Detach, Clean, Cook, control_commands, link_from_name, \
@@ -42,6 +44,7 @@ from world_builder.entities import Region, Location, Robot, Surface, Articulated
 from world_builder.world_utils import GRASPABLES, get_objs_in_camera_images, make_camera_collage, \
     get_camera_image, sort_body_indices
 from world_builder.init_utils import add_joint_status_facts
+from world_builder.paths import DATABASES_PATH
 
 DEFAULT_CONSTANTS = ['@movable', '@bottle', '@edible', '@medicine']  ## , '@world'
 
@@ -252,6 +255,9 @@ class World(WorldBase):
         self.learned_bconf_database = None
         self.learned_pose_database = None
         self.learned_position_database = None
+        self.online_reachability = None  ## OnlineReachability of the base confs that solved ik so far
+        self.roadmaps = {}  ## (robot, joints): Roadmap over self.fixed
+        self.stream_profiler = None  ## StreamProfiler accumulated over all subproblems of a run
 
         ## for visualization
         self.path = None
@@ -381,6 +387,27 @@ class World(WorldBase):
         # objs = [o for o in objs if not (o in attached_objects and attached_objects[o] in self.movable)]
         return sort_body_indices(objs)
 
+    def get_roadmap(self, robot, joints, custom_limits={}, verbose=False, **kwargs):
+        """ the PRM for planning the motion of joints within custom_limits around self.fixed,
+            rebuilt only when self.fixed changes """
+        limits = tuple(sorted((joint, tupify_arr(limit)) for joint, limit in custom_limits.items()))
+        key = (robot.body, tuple(joints), limits)
+        fixed = self.fixed
+        if key not in self.roadmaps or self.roadmaps[key].obstacles != frozenset(fixed):
+            start_time = time.time()
+            self.roadmaps[key] = get_joint_roadmap(robot, joints, obstacles=fixed, custom_limits=custom_limits,
+                                                   self_collisions=robot.self_collisions,
+                                                   ignored_pairs=self.ignored_pairs, **kwargs)
+            if verbose:
+                print(f'world.get_roadmap | built roadmap of {len(self.roadmaps[key])} vertices '
+                      f'in {elapsed_time(start_time):.2f} sec')
+        return self.roadmaps[key]
+
+    def get_stream_profiler(self):
+        if self.stream_profiler is None:
+            self.stream_profiler = StreamProfiler()
+        return self.stream_profiler
+
     ## -----------------------------------------------------------------------
 
     @property
@@ -1082,6 +1109,8 @@ class World(WorldBase):
 
     def set_learned_bconf_list_gen(self, list_gen_fn):
         """ likely defined in world_builder/loaders_{DOMAIN}.py """
+        if self.online_reachability is not None:
+            list_gen_fn = self.online_reachability.get_bconf_list_gen(list_gen_fn)
         self.learned_bconf_list_gen = list_gen_fn
 
     def set_learned_pose_list_gen(self, pose_list_gen):
@@ -1092,6 +1121,24 @@ class World(WorldBase):
         """ likely defined in world_builder/loaders_{DOMAIN}.py """
         self.learned_position_list_gen = list_gen_fn
 
+    def get_scene_hash(self):
+        """ identifies the scene by the names and poses of the fixed objects """
+        scene = sorted((str(self.get_name(body)), nice(get_pose(body))) for body in self.fixed)
+        return hashlib.md5(str(scene).encode()).hexdigest()[:8]
+
+    def enable_online_reachability(self, path=None):
+        """ base confs that solved ik are saved during planning and tried first for the same (arm, object, grasp)
+            at nearby poses, before falling back to the learned_bconf_list_gen of the domain """
+        from pybullet_tools.learned_samplers import OnlineReachability
+        if self.online_reachability is not None:
+            return self.online_reachability
+        if path is None:
+            robot_name = self.robot.__class__.__name__
+            path = join(DATABASES_PATH, f'online_reachability_{robot_name}_{self.get_scene_hash()}.jsonl')
+        self.online_reachability = OnlineReachability(path, world=self)
+        self.learned_bconf_list_gen = self.online_reachability.get_bconf_list_gen(self.learned_bconf_list_gen)
+        return self.online_reachability
+
     def reset_learned_samplers(self):
         self.learned_bconf_list_gen = None
         self.learned_pose_list_gen = None
@@ -1881,7 +1928,8 @@ class World(WorldBase):
 
 class State(object):
     def __init__(self, world, objects=[], attachments={}, facts=[], variables={},
-                 grasp_types=None, gripper=None, unobserved_objs=None, observation_model=None): ##
+                 grasp_types=None, gripper=None, unobserved_objs=None, observation_model=None,
+                 collision_cache=None): ##
         self.world = world
         if len(objects) == 0:
             # objects = [o for o in world.objects if isinstance(o, int)]
@@ -1916,6 +1964,14 @@ class State(object):
         self.grasp_types = grasp_types
         ## allowing both types causes trouble when the AConf used for generating IK isn't the same as the one during execution
 
+        ## shared by the cfree tests of all streams if enabled, see get_stream_map(collision_cache=True)
+        self.collision_cache = collision_cache
+
+    def enable_collision_cache(self, **kwargs):
+        if self.collision_cache is None:
+            self.collision_cache = CollisionCache(**kwargs)
+        return self.collision_cache
+
     def get_gripper(self, arm=None, visual=True):
         ## TODO: currently only one cloned gripper from the first arm, no problem so far
         if self.gripper is None:
@@ -1994,7 +2050,7 @@ class State(object):
         if unobserved_objs is None:
             unobserved_objs = self.unobserved_objs
         return State(self.world, objects=objects, attachments=attachments, facts=facts,
-                     variables=variables, unobserved_objs=unobserved_objs)
+                     variables=variables, unobserved_objs=unobserved_objs, collision_cache=self.collision_cache)
 
     def assign(self):
         # TODO: topological sort